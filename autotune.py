@@ -0,0 +1,75 @@
+'''
+    Video Upscaler
+    Calibration clip and choice of the thread count and upscale workers for autotune runs
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import logging
+
+logger = logging.getLogger("videoupscaler")
+
+#frames of the calibration clip, cut from the middle of the first source
+AUTOTUNE_FRAMES = 120
+#a higher thread count or more workers has to be this much faster to be chosen, fewer holds less memory
+AUTOTUNE_MIN_GAIN = 0.05
+AUTOTUNE_THREAD_COUNTS = "1,2,4"
+AUTOTUNE_WORKERS = "1,2"
+
+
+def parse_counts(value: str):
+    #a comma list of counts of at least one, in ascending order
+    counts = sorted({int(item) for item in str(value).split(",") if item.strip()})
+
+    if (not counts or counts[0] < 1):
+        raise ValueError(f"Counts must be a comma list of numbers of at least 1, got {value}")
+
+    return counts
+
+
+def clip_args(src_file: str, start: float, frames: int, out_file: str):
+    #the video of the source from start, encoded so the clip has exactly the frames asked for when the source has them
+    return [
+        '-ss',
+        f"{start:.3f}",
+        '-i',
+        src_file,
+        '-map',
+        '0:v:0',
+        '-frames:v',
+        str(frames),
+        '-c:v',
+        'libx264',
+        '-preset',
+        'veryfast',
+        '-crf',
+        '16',
+        '-pix_fmt',
+        'yuv420p',
+        '-an',
+        '-sn',
+        '-y',
+        out_file
+        ]
+
+
+def clip_start(duration: float, fps: float, frames: int):
+    #the clip is centred in the source, away from titles and black lead in
+    if (duration <= 0 or fps <= 0):
+        return 0.0
+
+    return max((duration - frames / fps) / 2, 0.0)
+
+
+def pick_best(rates: dict, min_gain: float = AUTOTUNE_MIN_GAIN):
+    #the smallest count no other count beats by more than min_gain, rates is count -> frames per second
+    best = None
+
+    for count in sorted(rates):
+        if (best is None or rates[count] > rates[best] * (1 + min_gain)):
+            best = count
+
+    return best
+
+
+def format_rates(rates: dict):
+    return ", ".join(f"{count}: {rate:.2f}fps" for count, rate in sorted(rates.items()))
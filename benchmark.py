@@ -0,0 +1,299 @@
+'''
+    Video Upscaler
+    Benchmark matrix across models, types, scales, noise levels, thread counts and input resolutions
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from model_builder import ProcessorModelEnum, modeltypesmap
+from upscale_backends import BACKENDS, BACKEND_STUB
+from metrics import read_metrics
+
+logger = logging.getLogger("videoupscaler")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+VIDEO_UPSCALER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "video_upscaler.py")
+
+REPORT_FIELDS = ["model", "model_type", "scale", "noise_level", "thread_count", "resolution", "status", "wall_time", "fps", "frames", "peak_rss_kb", "peak_temp_bytes", "output_bytes"]
+CELL_KEY_FIELDS = ["model", "model_type", "scale", "noise_level", "thread_count", "resolution"]
+DIFF_FIELDS = ["wall_time", "fps", "peak_rss_kb", "peak_temp_bytes", "output_bytes"]
+
+
+def parse_models(value: str):
+    #all, or a comma list of model[:type index], multi model chains take no type
+    if value == "all":
+        return [(model, model_type) for model in modeltypesmap for model_type in modeltypesmap[model]]
+
+    models = []
+    for item in value.split(","):
+        name, _, model_type = item.partition(":")
+        model = ProcessorModelEnum[name.strip()]
+        models.append((model, int(model_type) if model_type else 1))
+
+    return models
+
+
+def parse_list(value: str, cast = int):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def directory_size(path: str):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def output_size(path: str):
+    #the manifest and metrics files are not output
+    return sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path) if not file.startswith("."))
+
+
+def make_clip(ffmpeg_bin: str, clips_dir: str, resolution: str, duration: int, fps: int):
+    #synthetic test pattern with audio, one directory per resolution as the upscaler takes a directory
+    clip_dir = os.path.join(clips_dir, resolution)
+    clip_file = os.path.join(clip_dir, f"testsrc_{resolution}.mp4")
+
+    if os.path.exists(clip_file):
+        return clip_dir
+
+    os.makedirs(clip_dir, exist_ok=True)
+    cmd = [
+        ffmpeg_bin,
+        '-v',
+        'error',
+        '-f',
+        'lavfi',
+        '-i',
+        f"testsrc2=size={resolution}:rate={fps}",
+        '-f',
+        'lavfi',
+        '-i',
+        "sine=frequency=440",
+        '-t',
+        str(duration),
+        '-c:v',
+        'libx264',
+        '-pix_fmt',
+        'yuv420p',
+        '-c:a',
+        'aac',
+        '-y',
+        clip_file
+        ]
+
+    subprocess.run(cmd, check=True)
+    return clip_dir
+
+
+class TempSampler(threading.Thread):
+
+    def __init__(self, path: str, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def wait_with_rusage(proc: subprocess.Popen):
+    #on posix wait4 reports the peak rss of the upscaler and the ffmpeg and video2x processes it waited on
+    if hasattr(os, "wait4"):
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, rusage.ru_maxrss
+
+    return proc.wait(), None
+
+
+def run_cell(args, cell: dict, clip_dir: str, cell_dir: str):
+    out_dir = os.path.join(cell_dir, "output")
+    temp_dir = os.path.join(cell_dir, "tmp")
+    metrics_file = os.path.join(cell_dir, "metrics.jsonl")
+
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(temp_dir, exist_ok=True)
+
+    cmd = [
+        sys.executable,
+        VIDEO_UPSCALER,
+        '-i', clip_dir,
+        '-o', out_dir,
+        '-m', str(ProcessorModelEnum[cell["model"]].value),
+        '-t', str(cell["model_type"]),
+        '-s', str(cell["scale"]),
+        '-n', str(cell["noise_level"]),
+        '--tc', str(cell["thread_count"]),
+        '--backend', args.backend,
+        '--cache_dir', os.path.join(args.output, "cache"),
+        '--metrics', metrics_file,
+        '--no_resume'
+        ]
+
+    if args.video2x_bin:
+        cmd += ['--video2x_bin', args.video2x_bin]
+
+    cmd += args.upscaler_args
+
+    #temp files go to a per cell directory so its peak size can be sampled
+    env = dict(os.environ, TMPDIR=temp_dir, TEMP=temp_dir, TMP=temp_dir)
+
+    with open(os.path.join(cell_dir, "upscaler.log"), "w", encoding="utf-8") as log_file:
+        sampler = TempSampler(temp_dir)
+        sampler.start()
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+        return_code, peak_rss = wait_with_rusage(proc)
+        wall_time = time.monotonic() - started
+        sampler.stop()
+
+    upscale_stages = [record for record in read_metrics(metrics_file) if record.get("type") == "stage" and record.get("stage") == "upscale"]
+    #stream copy stages report no frame count, the synthetic clip length is known
+    frames = sum(record["frames"] for record in upscale_stages) or args.duration * args.fps
+    upscale_seconds = sum(record["seconds"] for record in upscale_stages)
+    jobs = [record for record in read_metrics(metrics_file) if record.get("type") == "job"]
+
+    status = "done" if return_code == 0 and jobs and all(job["status"] == "done" for job in jobs) else "failed"
+
+    result = dict(cell)
+    result.update({
+        "status": status,
+        "wall_time": wall_time,
+        "fps": frames / upscale_seconds if upscale_seconds > 0 else 0.0,
+        "frames": frames,
+        "peak_rss_kb": peak_rss,
+        "peak_temp_bytes": sampler.peak,
+        "output_bytes": output_size(out_dir)
+    })
+    return result
+
+
+def cell_key(result: dict):
+    return tuple(str(result[field]) for field in CELL_KEY_FIELDS)
+
+
+def diff_results(results: list, baseline: list):
+    baseline_cells = { cell_key(result): result for result in baseline }
+    diffs = []
+
+    for result in results:
+        previous = baseline_cells.get(cell_key(result))
+        if previous is None:
+            continue
+
+        diff = { field: result[field] for field in CELL_KEY_FIELDS }
+        for field in DIFF_FIELDS:
+            current_value = result.get(field) or 0
+            previous_value = previous.get(field) or 0
+            diff[f"{field}_previous"] = previous_value
+            diff[f"{field}_current"] = current_value
+            diff[f"{field}_change_pct"] = ((current_value - previous_value) / previous_value * 100) if previous_value else None
+        diffs.append(diff)
+
+    return diffs
+
+
+def write_csv(path: str, rows: list, fields: list):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND_STUB)
+    parser.add_argument('--video2x_bin', default=None)
+    parser.add_argument('--ffmpeg_bin', default="ffmpeg")
+    parser.add_argument('--models', default="realesrgan:1")
+    parser.add_argument('--scales', default="2,4")
+    parser.add_argument('--noise_levels', default="3")
+    parser.add_argument('--thread_counts', default="1")
+    parser.add_argument('--resolutions', default="640x360,1280x720")
+    parser.add_argument('--duration', type=int, default=5)
+    parser.add_argument('--fps', type=int, default=24)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--name', default=time.strftime("benchmark_%Y%m%d_%H%M%S"))
+
+    #any other arguments are passed through to video_upscaler.py for every cell
+    args, upscaler_args = parser.parse_known_args()
+    args.upscaler_args = upscaler_args
+
+    os.makedirs(args.output, exist_ok=True)
+    clips_dir = os.path.join(args.output, "clips")
+    run_dir = os.path.join(args.output, args.name)
+
+    matrix = itertools.product(parse_models(args.models), parse_list(args.scales), parse_list(args.noise_levels), parse_list(args.thread_counts), parse_list(args.resolutions, str))
+    results = []
+
+    for (model, model_type), scale, noise_level, thread_count, resolution in matrix:
+        cell = {
+            "model": model.name,
+            "model_type": model_type,
+            "scale": scale,
+            "noise_level": noise_level,
+            "thread_count": thread_count,
+            "resolution": resolution
+        }
+
+        clip_dir = make_clip(args.ffmpeg_bin, clips_dir, resolution, args.duration, args.fps)
+        cell_dir = os.path.join(run_dir, "_".join(str(cell[field]) for field in CELL_KEY_FIELDS))
+
+        logger.info(f"Running {cell}")
+        result = run_cell(args, cell, clip_dir, cell_dir)
+        logger.info(f"{result["status"]} in {result["wall_time"]:.2f}s at {result["fps"]:.2f}fps, peak rss {result["peak_rss_kb"]}KB, peak temp {result["peak_temp_bytes"]} bytes")
+        results.append(result)
+
+    report = {
+        "name": args.name,
+        "backend": args.backend,
+        "duration": args.duration,
+        "fps": args.fps,
+        "results": results
+    }
+
+    with open(os.path.join(args.output, f"{args.name}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    write_csv(os.path.join(args.output, f"{args.name}.csv"), results, REPORT_FIELDS)
+    logger.info(f"Wrote report {os.path.join(args.output, args.name)}.json/.csv")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        diffs = diff_results(results, baseline)
+        fields = CELL_KEY_FIELDS + [f"{field}_{suffix}" for field in DIFF_FIELDS for suffix in ("previous", "current", "change_pct")]
+        write_csv(os.path.join(args.output, f"{args.name}_diff.csv"), diffs, fields)
+
+        for diff in diffs:
+            changes = ", ".join(f"{field} {diff[f"{field}_change_pct"]:+.1f}%" for field in DIFF_FIELDS if diff[f"{field}_change_pct"] is not None)
+            logger.info(f"{"/".join(str(diff[field]) for field in CELL_KEY_FIELDS)}: {changes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+    Video Upscaler
+    Black bar detection from frames sampled across a source, so letterboxed content is cropped before the model
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import logging
+import re
+from process_runner import CommandError, run_process
+
+logger = logging.getLogger("videoupscaler")
+
+#points across the duration sampled, and frames analysed at each
+CROP_SAMPLES = 8
+CROP_SAMPLE_FRAMES = 10
+#luma at or below this is black, out of 255
+CROP_LIMIT = 24
+#a crop removing less than this share of the frame is edge noise, not bars
+CROP_MIN_SAVING = 0.03
+#a sample whose content is less than this share of the frame is a fade or a black scene
+CROP_MIN_CONTENT = 0.1
+#the first and last share of the duration are skipped, titles and credits are often a different shape
+CROP_MARGIN = 0.05
+CROP_SAMPLE_TIMEOUT = 120
+
+CROPDETECT_RE = re.compile(r"\[Parsed_cropdetect[^\]]*\].*?crop=(-?\d+):(-?\d+):(-?\d+):(-?\d+)")
+
+
+def cropdetect_args(src_file: str, start: float, frames: int = CROP_SAMPLE_FRAMES):
+    #seeks before the input so each sample only decodes from the keyframe before it
+    return [
+        '-nostats',
+        '-ss',
+        f"{start:.3f}",
+        '-i',
+        src_file,
+        '-map',
+        '0:v:0',
+        '-vf',
+        f"cropdetect=limit={CROP_LIMIT}:round=2:reset=0",
+        '-frames:v',
+        str(frames),
+        '-an',
+        '-sn',
+        '-f',
+        'null',
+        '-'
+        ]
+
+
+def sample_times(duration: float, samples: int = CROP_SAMPLES):
+    if (duration <= 0):
+        return [0.0]
+
+    start = duration * CROP_MARGIN
+    span = duration - 2 * start
+    return [start + span * (index + 0.5) / samples for index in range(samples)]
+
+
+def even_down(value: int):
+    return value - value % 2
+
+
+def combine_crops(crops: list, width: int, height: int):
+    '''
+        The crop covering the content of every sample, as (width, height, x, y), or None when the bars are
+        too thin to be worth it. Samples of black or nearly black frames are left out.
+    '''
+    boxes = [(w, h, x, y) for w, h, x, y in crops if w > 0 and h > 0 and w * h >= width * height * CROP_MIN_CONTENT]
+    if (not boxes):
+        return None
+
+    left = even_down(max(min(x for _, _, x, _ in boxes), 0))
+    top = even_down(max(min(y for _, _, _, y in boxes), 0))
+    right = min(max(x + w for w, _, x, _ in boxes), width)
+    bottom = min(max(y + h for _, h, _, y in boxes), height)
+    crop_width = even_down(right - left)
+    crop_height = even_down(bottom - top)
+
+    if (crop_width * crop_height > width * height * (1 - CROP_MIN_SAVING)):
+        return None
+
+    return crop_width, crop_height, left, top
+
+
+def pad_box(crop: tuple, width: int, height: int, out_width: int, out_height: int):
+    #the source frame at the upscaled size and where the upscaled crop sits in it, as (width, height, x, y)
+    crop_width, crop_height, x, y = crop
+    scale_x = out_width / crop_width
+    scale_y = out_height / crop_height
+    pad_width = max(even_down(round(width * scale_x)), out_width)
+    pad_height = max(even_down(round(height * scale_y)), out_height)
+    pad_x = min(even_down(round(x * scale_x)), pad_width - out_width)
+    pad_y = min(even_down(round(y * scale_y)), pad_height - out_height)
+    return pad_width, pad_height, pad_x, pad_y
+
+
+async def detect_crop(ffmpeg_bin: str, src_file: str, duration: float, width: int, height: int, samples: int = CROP_SAMPLES):
+    #runs cropdetect on frames sampled across the source, returns the crop as (width, height, x, y) or None
+    crops = []
+
+    for start in sample_times(duration, samples):
+        found = []
+
+        def parse_line(line: str):
+            #cropdetect logs a line per frame, the last of a sample covers all its frames
+            match = CROPDETECT_RE.search(line)
+            if (match):
+                found.append(tuple(int(value) for value in match.groups()))
+            return match is not None
+
+        try:
+            await run_process([ffmpeg_bin] + cropdetect_args(src_file, start), None, on_line=parse_line, timeout=CROP_SAMPLE_TIMEOUT)
+        except CommandError as e:
+            raise RuntimeError(f"Crop detection failed for {src_file}, {e}") from e
+
+        if (found):
+            crops.append(found[-1])
+
+    crop = combine_crops(crops, width, height)
+    logger.info(f"Detected crop {crop} of {width}x{height} in {src_file} from {len(crops)} samples")
+    return crop
@@ -0,0 +1,93 @@
+'''
+    Video Upscaler
+    Named encoder profiles covering encoder, preset, rate control and audio policy
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import logging
+import os
+
+logger = logging.getLogger("videoupscaler")
+
+PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "encoder_profiles.json")
+
+AUDIO_COPY = "copy"
+AUDIO_COPY_COMPATIBLE = "copy_compatible"
+AUDIO_TRANSCODE = "transcode"
+AUDIO_POLICIES = [AUDIO_COPY, AUDIO_COPY_COMPATIBLE, AUDIO_TRANSCODE]
+
+
+class EncoderProfile:
+
+    def __init__(self, name: str, encoder: str, options: dict = None, lossless_options: dict = None, audio: str = AUDIO_COPY_COMPATIBLE, audio_copy_codecs: list = None, audio_codec: str = "aac", audio_bitrate: str = "192k"):
+        if (audio not in AUDIO_POLICIES):
+            raise ValueError(f"Invalid audio policy {audio} for profile {name}, must be one of {AUDIO_POLICIES}")
+
+        self.name = name
+        self.encoder = encoder
+        self.options = options or {}
+        self.lossless_options = lossless_options
+        self.audio = audio
+        self.audio_copy_codecs = audio_copy_codecs if audio_copy_codecs is not None else ["aac"]
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+
+    def encoder_options(self, lossless: bool = False):
+        if (lossless and self.lossless_options is not None):
+            return self.lossless_options
+
+        return self.options
+
+    def copies_audio(self, source_codec: str):
+        if (self.audio == AUDIO_COPY):
+            return True
+
+        return self.audio == AUDIO_COPY_COMPATIBLE and source_codec in self.audio_copy_codecs
+
+    def audio_args(self, source_codec: str):
+        #returns the ffmpeg audio codec args and the codec the output audio ends up in
+        if (self.copies_audio(source_codec)):
+            return ['-c:a', 'copy'], source_codec
+
+        cmd = ['-c:a', self.audio_codec]
+
+        if (self.audio_bitrate):
+            cmd += ['-b:a', self.audio_bitrate]
+
+        return cmd, self.audio_codec
+
+    def ffmpeg_args(self, lossless: bool = False):
+        cmd = ['-c:v', self.encoder]
+
+        for key, value in self.encoder_options(lossless).items():
+            cmd += [f"-{key}", str(value)]
+
+        return cmd
+
+    def __repr__(self):
+        return f"EncoderProfile({self.name} {self.encoder} {self.options} audio {self.audio})"
+
+
+def load_profiles(profiles_file: str = None):
+    #bundled profiles, overridden or extended by a user profiles file
+    files = [PROFILES_FILE]
+
+    if (profiles_file):
+        files.append(profiles_file)
+
+    profiles = {}
+
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for name, item in json.load(f).items():
+                profiles[name] = EncoderProfile(name, **item)
+
+    return profiles
+
+
+def get_profile(profiles: dict, name: str):
+    if (name not in profiles):
+        raise ValueError(f"Unknown encoder profile {name}, must be one of {list(profiles.keys())}")
+
+    return profiles[name]
@@ -0,0 +1,157 @@
+'''
+    Video Upscaler
+    Per job failure handling, output validation, retries with backoff, degrading after out of memory errors and quarantine
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import logging
+import os
+import re
+import time
+from file_lock import locked
+from media_probe import MediaInfo
+from process_runner import CommandError
+
+logger = logging.getLogger("videoupscaler")
+
+QUARANTINE_FILE_NAME = ".videoupscaler_quarantine.jsonl"
+
+FAILURE_OOM = "oom"
+FAILURE_TRANSIENT = "transient"
+FAILURE_PERMANENT = "permanent"
+
+#GPU and host allocation failures from video2x (vulkan), ncnn, nvenc and ffmpeg
+OOM_PATTERNS = re.compile(r"out of (device |host )?memory|ERROR_OUT_OF_(DEVICE|HOST)_MEMORY|vkAllocateMemory failed|std::bad_alloc|Cannot allocate memory|NV_ENC_ERR_OUT_OF_MEMORY|CUDA_ERROR_OUT_OF_MEMORY", re.IGNORECASE)
+#the same input fails the same way every time, retrying only costs time
+PERMANENT_PATTERNS = re.compile(r"Invalid data found when processing input|moov atom not found|does not support|Unknown encoder|Unrecognized option|Decoder .* not found", re.IGNORECASE)
+
+#output duration may differ from the source by this fraction or OUTPUT_DURATION_SLACK seconds, whichever is larger
+OUTPUT_DURATION_TOLERANCE = 0.01
+OUTPUT_DURATION_SLACK = 0.5
+OUTPUT_FRAME_TOLERANCE = 0.01
+OUTPUT_FRAME_SLACK = 2
+
+#the segment length for a job that ran out of memory unsegmented, and the shortest segment degrading goes to
+OOM_SEGMENT_SECONDS = 120
+MIN_SEGMENT_SECONDS = 30
+
+
+class OutputValidationError(RuntimeError):
+    pass
+
+
+def failure_text(error: Exception):
+    #the error and, for a failed process, its last lines of output
+    text = str(error)
+
+    if (isinstance(error, CommandError)):
+        text += "\n" + "\n".join(error.tail)
+
+    if (error.__cause__ is not None):
+        text += "\n" + failure_text(error.__cause__)
+
+    return text
+
+
+def classify_failure(error: Exception):
+    text = failure_text(error)
+
+    if (OOM_PATTERNS.search(text)):
+        return FAILURE_OOM
+
+    if (PERMANENT_PATTERNS.search(text)):
+        return FAILURE_PERMANENT
+
+    #stalls, validation failures, broken pipes and anything unknown get another go
+    return FAILURE_TRANSIENT
+
+
+def validate_output(src_media: MediaInfo, out_media: MediaInfo, expected_frames: int = 0):
+    #raises OutputValidationError when the output is missing video or its length does not match the source
+    if (out_media.video is None):
+        raise OutputValidationError("Output has no video stream")
+
+    if (src_media is None):
+        return
+
+    if (src_media.duration > 0):
+        difference = abs(out_media.duration - src_media.duration)
+        if (difference > max(src_media.duration * OUTPUT_DURATION_TOLERANCE, OUTPUT_DURATION_SLACK)):
+            raise OutputValidationError(f"Output duration {out_media.duration:.2f}s does not match the source {src_media.duration:.2f}s")
+
+    #a count estimated from the duration and frame rate can be off by more than the slack, eg on a variable frame rate source
+    if (expected_frames > 0 and not src_media.frame_count_estimated and out_media.frame_count > 0 and not out_media.frame_count_estimated):
+        difference = abs(out_media.frame_count - expected_frames)
+        if (difference > max(expected_frames * OUTPUT_FRAME_TOLERANCE, OUTPUT_FRAME_SLACK)):
+            raise OutputValidationError(f"Output has {out_media.frame_count} frames, expected {expected_frames}")
+
+
+class FailurePolicy:
+    '''
+        Decides what happens to a failed job. Transient and out of memory failures are retried
+        up to max_attempts with an exponential backoff, an out of memory failure first lowers the
+        thread count then, where the job can be segmented, the segment length. Permanent failures and jobs out of
+        attempts are quarantined so later runs skip them until the source or settings change.
+    '''
+
+    def __init__(self, max_attempts: int = 3, backoff: float = 30, max_backoff: float = 600):
+        self.max_attempts = max(int(max_attempts), 1)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+
+    def should_retry(self, attempts: int, failure: str):
+        return failure != FAILURE_PERMANENT and attempts < self.max_attempts
+
+    def delay(self, attempts: int):
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+    def degrade(self, job, duration: float = 0, segments: bool = True):
+        #lowers what the job asks of the GPU for the next attempt, returns what changed or None.
+        #segments is False when the job is upscaled whole whatever its segment length
+        if (job.thread_count > 1):
+            job.thread_count = max(job.thread_count // 2, 1)
+            return f"thread count {job.thread_count}"
+
+        if (not segments):
+            return None
+
+        if (job.segment_seconds > MIN_SEGMENT_SECONDS):
+            job.segment_seconds = max(job.segment_seconds // 2, MIN_SEGMENT_SECONDS)
+            return f"segments of {job.segment_seconds}s"
+
+        if (job.segment_seconds <= 0 and duration > OOM_SEGMENT_SECONDS):
+            job.segment_seconds = OOM_SEGMENT_SECONDS
+            return f"segments of {job.segment_seconds}s"
+
+        return None
+
+
+class QuarantineList:
+    '''
+        JSON lines list of the files that failed for good, in the output directory beside the manifest,
+        with the error and the last lines of output of the failed process.
+    '''
+
+    def __init__(self, out_dir: str, file_name: str = QUARANTINE_FILE_NAME):
+        self.path = os.path.join(out_dir, file_name)
+
+    def add(self, src_file: str, error: Exception, failure: str, attempts: int):
+        record = {
+            "src": os.path.abspath(src_file),
+            "failure": failure,
+            "attempts": attempts,
+            "error": str(error),
+            "tail": error.tail if isinstance(error, CommandError) else [],
+            "time": time.time()
+        }
+
+        with locked(self.path), open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def entries(self):
+        if (not os.path.exists(self.path)):
+            return []
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
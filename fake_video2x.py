@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+    Video Upscaler
+    Stand in for the video2x binary that scales with CPU ffmpeg filters so the pipeline
+    (segment splitting, ordering, concat, muxing) can be run without a GPU.
+
+    python video_upscaler.py -i in -o out --segment_seconds 30 --video2x_bin ./fake_video2x.py
+
+    With --passthrough the input is copied to the output unchanged without ffmpeg, which is what
+    the stub backend uses to measure the orchestration overhead alone.
+
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+FFMPEG_BIN = os.environ.get("FAKE_VIDEO2X_FFMPEG", "ffmpeg")
+
+#gpu encoders are swapped for a fast cpu encoder, intermediate pipe codecs are used as is
+GPU_ENCODERS = ["hevc_nvenc", "h264_nvenc", "av1_nvenc"]
+
+
+def build_command(args):
+    filters = []
+
+    if args.width > 0 and args.height > 0:
+        filters.append(f"scale={args.width}:{args.height}")
+    elif args.scale > 1:
+        filters.append(f"scale=iw*{args.scale}:ih*{args.scale}")
+
+    if args.frame_rate_mul > 1:
+        filters.append(f"fps=source_fps*{args.frame_rate_mul}")
+
+    cmd = [
+        FFMPEG_BIN,
+        '-v',
+        'error',
+        '-i',
+        args.input,
+        '-map',
+        '0:v:0'
+        ]
+
+    if not args.no_copy_streams:
+        cmd += ['-map', '0:a?', '-c:a', 'copy']
+
+    if filters:
+        cmd += ['-vf', ",".join(filters)]
+
+    if args.codec in GPU_ENCODERS:
+        cmd += ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18']
+    else:
+        cmd += ['-c:v', args.codec]
+
+    cmd += [
+        '-progress',
+        'pipe:1',
+        '-y',
+        args.output
+        ]
+
+    return cmd
+
+
+def passthrough(args):
+    #streamed so a named pipe input or output works too
+    with open(args.input, "rb") as src, open(args.output, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    return 0
+
+
+def main():
+    #-h is the video2x output height, not help
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-i', '--input', required=True)
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('-c', '--codec', default="libx264")
+    parser.add_argument('-s', '--scale', type=int, default=0)
+    parser.add_argument('-w', '--width', type=int, default=0)
+    parser.add_argument('-h', '--height', type=int, default=0)
+    parser.add_argument('-m', '--frame_rate_mul', type=int, default=0)
+    parser.add_argument('--no-copy-streams', dest='no_copy_streams', action='store_true')
+    parser.add_argument('--passthrough', action='store_true')
+    #model, noise, thread count and encoder options are accepted and ignored
+    args, unknown = parser.parse_known_args()
+
+    if args.passthrough:
+        return passthrough(args)
+
+    cmd = build_command(args)
+    print(' '.join(cmd), file=sys.stderr)
+    return subprocess.call(cmd)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+'''
+    Video Upscaler
+    Exclusive lock on a shared file, so hosts sharing an output directory do not interleave writes to it
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_SUFFIX = ".lock"
+
+
+@contextlib.contextmanager
+def locked(path: str):
+    #held on a lock file beside path, which is replaced by compaction. flock is passed to the server on NFS.
+    #without fcntl, on Windows, nothing is locked and only one host should write the directory
+    if (fcntl is None):
+        yield
+        return
+
+    with open(path + LOCK_SUFFIX, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
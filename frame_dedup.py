@@ -0,0 +1,194 @@
+'''
+    Video Upscaler
+    Duplicate frame removal before upscaling and rebuilding the original timing afterwards
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import logging
+import re
+from process_runner import CommandError, run_process, terminate_process
+
+logger = logging.getLogger("videoupscaler")
+
+#mpdecimate logs every frame decision at debug level
+DECIMATE_RE = re.compile(r"\[Parsed_mpdecimate[^\]]*\].*?\b(keep|drop) pts:(-?\d+)")
+#below this share of duplicate frames the decimate and rebuild passes cost more than they save
+DEDUP_MIN_SAVING = 0.05
+#bytes per pixel of the yuv4mpeg colourspaces ffmpeg writes
+Y4M_CHROMA = { "420": 1.5, "422": 2.0, "444": 3.0, "mono": 1.0 }
+
+
+class FramePlan:
+    '''
+        The keep or drop decision of every source frame in order. Each kept frame is
+        repeated for itself and the dropped frames after it to rebuild the source timing.
+    '''
+
+    def __init__(self):
+        self.keep = []
+
+    def add(self, keep: bool):
+        self.keep.append(keep)
+
+    @property
+    def total_frames(self):
+        return len(self.keep)
+
+    @property
+    def unique_frames(self):
+        return sum(self.keep)
+
+    @property
+    def saving(self):
+        return 1 - self.unique_frames / self.total_frames if self.total_frames else 0.0
+
+    def repeats(self):
+        repeats = []
+        leading = 0
+
+        for keep in self.keep:
+            if (keep):
+                repeats.append(1)
+            elif (repeats):
+                repeats[-1] += 1
+            else:
+                #mpdecimate keeps the first frame, this only guards a plan starting with drops
+                leading += 1
+
+        if (repeats):
+            repeats[0] += leading
+
+        return repeats
+
+    def __repr__(self):
+        return f"FramePlan({self.unique_frames}/{self.total_frames} unique, {self.saving * 100:.1f}% duplicates)"
+
+
+def decimate_args(src_file: str, out_file: str, encoder_args: list):
+    #one pass analyses and writes only the unique frames. They are retimed back to back at the source
+    #rate so the upscaler sees an ordinary constant rate file and does not duplicate frames to fill gaps
+    return [
+        '-v',
+        'debug',
+        '-nostats',
+        '-i',
+        src_file,
+        '-map',
+        '0:v:0',
+        '-vf',
+        'mpdecimate,setpts=N/FRAME_RATE/TB',
+        '-fps_mode',
+        'passthrough',
+        '-an',
+        '-sn'
+        ] + encoder_args + [
+        '-y',
+        out_file
+        ]
+
+
+async def decimate(cmd: list):
+    #runs the decimate command and returns the frame plan parsed from its log
+    plan = FramePlan()
+
+    def parse_line(line: str):
+        #the decisions are parsed rather than logged, the debug log is one line per frame
+        match = DECIMATE_RE.search(line)
+        if (match):
+            plan.add(match.group(1) == "keep")
+        return match is not None
+
+    try:
+        await run_process(cmd, logger, "DECIMATE", on_line=parse_line)
+    except CommandError as e:
+        raise RuntimeError(f"Frame decimation failed, {e}") from e
+
+    return plan
+
+
+def y4m_frame_size(header: str):
+    params = { token[0]: token[1:] for token in header.split()[1:] }
+    width, height = int(params["W"]), int(params["H"])
+    colourspace = params.get("C", "420jpeg")
+    chroma = next((value for key, value in Y4M_CHROMA.items() if colourspace.startswith(key)), 1.5)
+    #10 bit and higher samples are two bytes
+    depth = 2 if re.search(r"p(9|1\d)", colourspace) else 1
+    return int(width * height * chroma * depth)
+
+
+def y4m_header(header: str, frame_rate: str):
+    #the rebuilt stream has the source rate whatever rate the upscaled stream reports
+    num, _, den = frame_rate.partition("/")
+    tokens = [token for token in header.split() if not token.startswith("F")]
+    tokens.insert(3, f"F{num}:{den or 1}")
+    return " ".join(tokens) + "\n"
+
+
+async def rebuild_timing(decoder_cmd: list, encoder_cmd: list, repeats: list, frame_rate: str):
+    '''
+        Decodes the upscaled unique frames to yuv4mpeg and writes each one repeats times to the encoder.
+        Returns the number of frames the upscaled stream had, which has to match the unique frames of the plan.
+    '''
+    decoder = await asyncio.create_subprocess_exec(*decoder_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    encoder = await asyncio.create_subprocess_exec(*encoder_cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    errors = asyncio.gather(decoder.stderr.read(), encoder.stderr.read())
+    frames_read = 0
+    frame_size = 0
+    extra_bytes = 0
+
+    try:
+        header = (await decoder.stdout.readline()).decode("ascii")
+        if (not header.startswith("YUV4MPEG2")):
+            raise RuntimeError("Upscaled stream did not decode to yuv4mpeg")
+
+        frame_size = y4m_frame_size(header)
+        encoder.stdin.write(y4m_header(header, frame_rate).encode("ascii"))
+
+        for repeat in repeats:
+            frame_header = await decoder.stdout.readline()
+            if (not frame_header):
+                break
+
+            frame = await decoder.stdout.readexactly(frame_size)
+            frames_read += 1
+
+            for _ in range(repeat):
+                encoder.stdin.write(b"FRAME\n")
+                encoder.stdin.write(frame)
+                await encoder.stdin.drain()
+
+        encoder.stdin.close()
+        await encoder.stdin.wait_closed()
+    except (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError):
+        pass
+    except BaseException:
+        #cancelled, neither process is needed any more
+        await terminate_process(decoder)
+        await terminate_process(encoder)
+        raise
+    finally:
+        if (encoder.stdin and not encoder.stdin.is_closing()):
+            encoder.stdin.close()
+
+        #read the decoder to the end so it never blocks on a full pipe, anything left is frames past the plan
+        while True:
+            chunk = await decoder.stdout.read(1 << 20)
+            if (not chunk):
+                break
+            extra_bytes += len(chunk)
+
+        decoder_code = await decoder.wait()
+        encoder_code = await encoder.wait()
+        decoder_error, encoder_error = await errors
+
+    if (encoder_code != 0):
+        raise RuntimeError(f"Rebuilding frame timing failed, encoder returned {encoder_code}: {encoder_error.decode("utf-8", errors="replace")[-2000:]}")
+
+    if (decoder_code != 0 and frames_read < len(repeats)):
+        raise RuntimeError(f"Rebuilding frame timing failed, decoder returned {decoder_code}: {decoder_error.decode("utf-8", errors="replace")[-2000:]}")
+
+    if (frame_size > 0):
+        frames_read += extra_bytes // (frame_size + len(b"FRAME\n"))
+
+    return frames_read
@@ -0,0 +1,410 @@
+'''
+    Video Upscaler
+    Cheap pre steps run on decoded frames in NumPy buffers and streamed to the upscaler, rather than encoded to a file first
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import collections
+import copy
+import logging
+import os
+import re
+import subprocess
+import threading
+from typing import Callable
+from process_runner import CommandError, TAIL_LINES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("videoupscaler")
+
+#frames decoded, filtered and written together, the filters are vectorized over the whole batch
+FRAME_BATCH = 8
+#frames are decoded to full resolution chroma so crops and resizes need no chroma rounding,
+#they are written as 4:2:0 which every upscaler and encoder takes
+FRAME_PIX_FMT = "yuv444p"
+FRAME_PLANES = 3
+#smallest crop or resize accepted, anything smaller is a typo
+MIN_FRAME_SIZE = 16
+
+
+def parse_size(value: str):
+    #WxH
+    match = re.fullmatch(r"(\d+)[x:](\d+)", value.strip())
+    if (not match):
+        raise ValueError(f"Size {value} must be WxH")
+
+    width, height = int(match.group(1)), int(match.group(2))
+    if (width < MIN_FRAME_SIZE or height < MIN_FRAME_SIZE):
+        raise ValueError(f"Size {value} must be at least {MIN_FRAME_SIZE}x{MIN_FRAME_SIZE}")
+
+    if (width % 2 or height % 2):
+        raise ValueError(f"Size {value} must be even for 4:2:0 chroma")
+
+    return width, height
+
+
+def parse_crop(value: str):
+    #W:H:X:Y as the ffmpeg crop filter takes it, the offsets default to centred
+    parts = value.strip().split(":")
+    if (len(parts) not in (2, 4) or not all(part.isdigit() for part in parts)):
+        raise ValueError(f"Crop {value} must be W:H or W:H:X:Y")
+
+    width, height = parse_size(f"{parts[0]}x{parts[1]}")
+    if (len(parts) == 2):
+        return width, height, None, None
+
+    return width, height, int(parts[2]), int(parts[3])
+
+
+class FrameFilters:
+    '''
+        The pre steps applied to every decoded frame in order, crop, deinterlace, denoise then resize.
+        Denoise is the largest difference between a pixel and the same pixel of the previous frame
+        that is still averaged with it, moving pixels differ by more and are left alone.
+    '''
+
+    def __init__(self, crop: str = None, resize: str = None, deinterlace: bool = False, denoise: int = 0):
+        self.crop = parse_crop(crop) if crop else None
+        self.resize = parse_size(resize) if resize else None
+        self.deinterlace = bool(deinterlace)
+        self.denoise = int(denoise)
+
+        if (self.denoise < 0 or self.denoise > 255):
+            raise ValueError(f"Denoise threshold must be 0 to 255, got {self.denoise}")
+
+    @property
+    def active(self):
+        return self.crop is not None or self.resize is not None or self.deinterlace or self.denoise > 0
+
+    def with_crop(self, crop: tuple):
+        #a copy cropping to (width, height, x, y), for a crop detected per source
+        filters = copy.copy(self)
+        filters.crop = tuple(crop)
+        return filters
+
+    def crop_box(self, width: int, height: int):
+        #x, y, width, height of the crop in a width x height frame
+        if (self.crop is None):
+            return 0, 0, width, height
+
+        crop_width, crop_height, x, y = self.crop
+        x = (width - crop_width) // 2 if x is None else x
+        y = (height - crop_height) // 2 if y is None else y
+
+        if (x < 0 or y < 0 or x + crop_width > width or y + crop_height > height):
+            raise ValueError(f"Crop {crop_width}x{crop_height} at {x},{y} does not fit a {width}x{height} frame")
+
+        return x, y, crop_width, crop_height
+
+    def output_size(self, width: int, height: int):
+        if (width <= 0 or height <= 0):
+            return width, height
+
+        if (self.resize is not None):
+            return self.resize
+
+        _, _, width, height = self.crop_box(width, height)
+        return width, height
+
+    def settings(self):
+        #recorded with the job settings, any change reprocesses a file
+        return {
+            "crop": list(self.crop) if self.crop else None,
+            "resize": list(self.resize) if self.resize else None,
+            "deinterlace": self.deinterlace,
+            "denoise": self.denoise
+        }
+
+    def __repr__(self):
+        steps = []
+
+        if (self.crop is not None):
+            steps.append("crop {0}x{1}{2}".format(self.crop[0], self.crop[1], "" if self.crop[2] is None else f" at {self.crop[2]},{self.crop[3]}"))
+        if (self.deinterlace):
+            steps.append("deinterlace")
+        if (self.denoise > 0):
+            steps.append(f"denoise {self.denoise}")
+        if (self.resize is not None):
+            steps.append("resize {0}x{1}".format(*self.resize))
+
+        return f"FrameFilters({", ".join(steps) if steps else "none"})"
+
+
+def bilinear_taps(src_size: int, dst_size: int):
+    #the two source lines each output line is made from and the weight of the second, pixel centres aligned
+    position = (np.arange(dst_size, dtype=np.float32) + 0.5) * (src_size / dst_size) - 0.5
+    position = np.clip(position, 0, src_size - 1)
+    first = np.floor(position).astype(np.intp)
+    second = np.minimum(first + 1, src_size - 1)
+    weight = (position - first).astype(np.float32)
+    return first, second, weight
+
+
+class FrameProcessor:
+    '''
+        The frame buffers of one source size and the filters over them. Every buffer is allocated once,
+        frames are decoded straight into frames and each filter writes into a preallocated buffer, so no
+        frame is allocated while streaming. process(count) filters the first count frames and returns them,
+        subsample() halves the chroma of filtered frames for writing.
+    '''
+
+    def __init__(self, filters: FrameFilters, width: int, height: int, batch: int = FRAME_BATCH):
+        if (np is None):
+            raise RuntimeError("Frame filters need numpy, install it with pipenv install numpy")
+
+        self.filters = filters
+        self.width = width
+        self.height = height
+        self.batch = batch
+        self.frames = np.empty((batch, FRAME_PLANES, height, width), dtype=np.uint8)
+        self.frame_size = FRAME_PLANES * height * width
+
+        x, y, crop_width, crop_height = filters.crop_box(width, height)
+        self.crop = (slice(y, y + crop_height), slice(x, x + crop_width))
+        self.out_width, self.out_height = filters.output_size(width, height)
+        if (self.out_width % 2 or self.out_height % 2):
+            raise ValueError(f"Frame size {self.out_width}x{self.out_height} must be even for 4:2:0 chroma, crop or resize it")
+
+        shape = (batch, FRAME_PLANES, crop_height, crop_width)
+
+        #line sums and averages of two uint8 frames do not fit uint8
+        self.sums = np.empty(shape, dtype=np.uint16) if filters.deinterlace or filters.denoise else None
+
+        if (filters.denoise):
+            self.previous = np.empty(shape, dtype=np.uint8)
+            self.differences = np.empty(shape, dtype=np.int16)
+            self.still = np.empty(shape, dtype=np.bool_)
+            #the last source frame of the batch before, the first frame of the source is its own previous frame
+            self.carry = np.empty(shape[1:], dtype=np.uint8)
+            self.carried = False
+
+        if (filters.resize is not None):
+            self.rows_first, self.rows_second, row_weight = bilinear_taps(crop_height, self.out_height)
+            self.columns_first, self.columns_second, self.column_weight = bilinear_taps(crop_width, self.out_width)
+            self.row_weight = row_weight[:, None]
+            self.row_keep = 1 - self.row_weight
+            self.column_keep = 1 - self.column_weight
+            self.row_taps = (np.empty((batch, FRAME_PLANES, self.out_height, crop_width), dtype=np.uint8), np.empty((batch, FRAME_PLANES, self.out_height, crop_width), dtype=np.uint8))
+            self.rows = (np.empty((batch, FRAME_PLANES, self.out_height, crop_width), dtype=np.float32), np.empty((batch, FRAME_PLANES, self.out_height, crop_width), dtype=np.float32))
+            self.columns = (np.empty((batch, FRAME_PLANES, self.out_height, self.out_width), dtype=np.float32), np.empty((batch, FRAME_PLANES, self.out_height, self.out_width), dtype=np.float32))
+
+        if (filters.resize is not None or filters.crop is not None):
+            #written out frame by frame, a cropped view is not contiguous
+            self.output = np.empty((batch, FRAME_PLANES, self.out_height, self.out_width), dtype=np.uint8)
+
+        chroma_shape = (batch, FRAME_PLANES - 1, self.out_height // 2, self.out_width // 2)
+        self.chroma_sums = np.empty(chroma_shape, dtype=np.uint16)
+        self.chroma = np.empty(chroma_shape, dtype=np.uint8)
+
+    def process(self, count: int):
+        frames = self.frames[:count, :, self.crop[0], self.crop[1]]
+
+        if (self.filters.deinterlace):
+            self.blend_lines(frames, self.sums[:count])
+
+        if (self.filters.denoise):
+            self.blend_still(frames, count)
+
+        if (self.filters.resize is not None):
+            return self.bilinear(frames, count)
+
+        if (self.filters.crop is not None):
+            np.copyto(self.output[:count], frames)
+            return self.output[:count]
+
+        return frames
+
+    def subsample(self, frames):
+        #each chroma sample of the output is the rounded average of a 2x2 block, centred as yuv4mpeg 420jpeg
+        count = len(frames)
+        sums = self.chroma_sums[:count]
+        planes = frames[:, 1:]
+
+        np.add(planes[:, :, 0::2, 0::2], planes[:, :, 0::2, 1::2], out=sums, dtype=np.uint16)
+        np.add(sums, planes[:, :, 1::2, 0::2], out=sums)
+        np.add(sums, planes[:, :, 1::2, 1::2], out=sums)
+        np.add(sums, 2, out=sums)
+        np.right_shift(sums, 2, out=sums)
+        np.copyto(self.chroma[:count], sums, casting="unsafe")
+        return self.chroma[:count]
+
+    def blend_lines(self, frames, sums):
+        #every line averaged with the line below, weaves both fields into each line at half the vertical detail
+        np.add(frames[:, :, :-1], frames[:, :, 1:], out=sums[:, :, :-1], dtype=np.uint16)
+        np.multiply(frames[:, :, -1:], 2, out=sums[:, :, -1:], dtype=np.uint16)
+        np.right_shift(sums, 1, out=sums)
+        np.copyto(frames, sums, casting="unsafe")
+
+    def blend_still(self, frames, count: int):
+        #averages each pixel with the previous source frame where it barely changed
+        previous = self.previous[:count]
+        differences = self.differences[:count]
+        still = self.still[:count]
+        sums = self.sums[:count]
+
+        previous[0] = self.carry if self.carried else frames[0]
+        previous[1:] = frames[:-1]
+        np.copyto(self.carry, frames[-1])
+        self.carried = True
+
+        np.subtract(frames, previous, out=differences, dtype=np.int16)
+        np.abs(differences, out=differences)
+        np.less_equal(differences, self.filters.denoise, out=still)
+        np.add(frames, previous, out=sums, dtype=np.uint16)
+        np.right_shift(sums, 1, out=sums)
+        np.copyto(frames, sums, casting="unsafe", where=still)
+
+    def bilinear(self, frames, count: int):
+        #rows then columns, each output sample is a weighted sum of two gathered source samples
+        first, second = self.row_taps[0][:count], self.row_taps[1][:count]
+        rows, rows_second = self.rows[0][:count], self.rows[1][:count]
+        columns, columns_second = self.columns[0][:count], self.columns[1][:count]
+        output = self.output[:count]
+
+        np.take(frames, self.rows_first, axis=2, out=first, mode="clip")
+        np.take(frames, self.rows_second, axis=2, out=second, mode="clip")
+        np.multiply(first, self.row_keep, out=rows)
+        np.multiply(second, self.row_weight, out=rows_second)
+        np.add(rows, rows_second, out=rows)
+
+        np.take(rows, self.columns_first, axis=3, out=columns, mode="clip")
+        np.take(rows, self.columns_second, axis=3, out=columns_second, mode="clip")
+        np.multiply(columns, self.column_keep, out=columns)
+        np.multiply(columns_second, self.column_weight, out=columns_second)
+        np.add(columns, columns_second, out=columns)
+        np.add(columns, 0.5, out=columns)
+        np.copyto(output, columns, casting="unsafe")
+        return output
+
+
+def decode_args(src_file: str):
+    #the first video stream as raw planar frames on stdout
+    return [
+        '-v',
+        'error',
+        '-nostats',
+        '-i',
+        src_file,
+        '-map',
+        '0:v:0',
+        '-an',
+        '-sn',
+        '-f',
+        'rawvideo',
+        '-pix_fmt',
+        FRAME_PIX_FMT,
+        '-'
+        ]
+
+
+def y4m_stream_header(width: int, height: int, frame_rate: str):
+    num, _, den = frame_rate.partition("/")
+    return f"YUV4MPEG2 W{width} H{height} F{num}:{den or 1} Ip A1:1 C420jpeg\n".encode("ascii")
+
+
+class FramePipeline:
+    '''
+        Decodes a source with ffmpeg into the buffers of a FrameProcessor a batch at a time, filters them and
+        writes yuv4mpeg to out_file, a fifo the upscaler reads. Blocking, run() is called from a thread.
+    '''
+
+    def __init__(self, decoder_cmd: list, out_file: str, processor: FrameProcessor, frame_rate: str, on_progress: Callable = None):
+        self.decoder_cmd = decoder_cmd
+        self.out_file = out_file
+        self.processor = processor
+        self.frame_rate = frame_rate
+        self.on_progress = on_progress
+        self.frames = 0
+        self.decoder = None
+        self.stopped = threading.Event()
+        #memoryview of the whole batch buffer, frames are read into it with no copy
+        self.buffer = memoryview(processor.frames).cast("B")
+
+    def read_batch(self):
+        #fills as many whole frames of the batch as the decoder has, returns how many
+        stream = self.decoder.stdout
+        size = len(self.buffer)
+        filled = 0
+
+        while (filled < size):
+            read = stream.readinto(self.buffer[filled:])
+            if (not read):
+                break
+            filled += read
+
+        return filled // self.processor.frame_size
+
+    def run(self):
+        #returns the number of frames written
+        errors = collections.deque(maxlen=TAIL_LINES)
+        self.decoder = subprocess.Popen(self.decoder_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        error_reader = threading.Thread(target=lambda: errors.extend(line.decode("utf-8", errors="replace").rstrip() for line in self.decoder.stderr), daemon=True)
+        error_reader.start()
+        finished = False
+
+        try:
+            with open(self.out_file, "wb") as out:
+                out.write(y4m_stream_header(self.processor.out_width, self.processor.out_height, self.frame_rate))
+
+                while (not self.stopped.is_set()):
+                    count = self.read_batch()
+                    if (count == 0):
+                        break
+
+                    frames = self.processor.process(count)
+                    chroma = self.processor.subsample(frames)
+
+                    for index in range(count):
+                        out.write(b"FRAME\n")
+                        out.write(frames[index, 0])
+                        out.write(chroma[index])
+
+                    self.frames += count
+                    if (self.on_progress is not None):
+                        self.on_progress(self.frames)
+
+            finished = not self.stopped.is_set()
+        except BrokenPipeError:
+            #the upscaler exited, its own error fails the job rather than this one
+            if (not self.stopped.is_set()):
+                logger.warning(f"The upscaler stopped reading frames after {self.frames}")
+        finally:
+            if (not finished and self.decoder.poll() is None):
+                self.decoder.kill()
+            return_code = self.decoder.wait()
+            error_reader.join()
+
+        if (finished and return_code != 0):
+            raise CommandError(self.decoder_cmd, return_code, errors)
+
+        return self.frames
+
+    def stop(self):
+        self.stopped.set()
+
+        if (self.decoder is not None and self.decoder.poll() is None):
+            self.decoder.kill()
+
+        #a writer blocked opening the fifo returns once a reader has opened it, its writes then fail
+        try:
+            os.close(os.open(self.out_file, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+
+async def run_frame_pipeline(pipeline: FramePipeline):
+    #runs the pipeline in a thread, cancelling stops the decoder and waits for the thread to end
+    task = asyncio.ensure_future(asyncio.to_thread(pipeline.run))
+
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        while (not task.done()):
+            pipeline.stop()
+            await asyncio.wait([task], timeout=0.1)
+        raise
@@ -0,0 +1,125 @@
+'''
+    Video Upscaler
+    Persistent job manifest for resuming interrupted batch runs
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import logging
+import os
+import time
+from file_lock import locked
+
+logger = logging.getLogger("videoupscaler")
+
+MANIFEST_FILE_NAME = ".videoupscaler_manifest.jsonl"
+
+STATUS_STARTED = "started"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+#failed every attempt or in a way retrying can not fix, skipped until the source or settings change
+STATUS_QUARANTINED = "quarantined"
+#a job the manifest or a lease said was done already, only reported to callers and never recorded
+STATUS_SKIPPED = "skipped"
+
+
+class JobManifest:
+    '''
+        JSON lines manifest stored in the output directory. Each line records the
+        state of one source file keyed on its path, size and mtime along with the
+        effective settings it was processed with. The last line for a source wins.
+        Writes and compaction hold a file lock, hosts sharing the output directory
+        append to the same manifest.
+    '''
+
+    def __init__(self, out_dir: str, settings: dict, file_name: str = MANIFEST_FILE_NAME, retry_quarantined: bool = False):
+        self.path = os.path.join(out_dir, file_name)
+        self.retry_quarantined = retry_quarantined
+        #round trip through json so tuples and enums compare equal to loaded records
+        self.settings = json.loads(json.dumps(settings, default=str))
+        self.records = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        #read and compacted under the lock, a line appended by another host in between would be lost
+        with locked(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        #a line cut short by a crash mid write
+                        logger.warning(f"Skipping corrupt manifest line in {self.path}")
+                        continue
+                    self.records[record["src"]] = record
+
+            self.compact()
+
+        logger.info(f"Loaded {len(self.records)} manifest records from {self.path}")
+
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def source_key(self, src_file: str):
+        stat = os.stat(src_file)
+        return os.path.abspath(src_file), stat.st_size, stat.st_mtime_ns
+
+    def should_process(self, src_file: str, dst_file: str):
+        src, size, mtime = self.source_key(src_file)
+        record = self.records.get(src)
+
+        if record is None:
+            return True, "new"
+
+        if record["size"] != size or record["mtime"] != mtime:
+            return True, "source changed"
+
+        if record["settings"] != self.settings:
+            return True, "settings changed"
+
+        if record["status"] == STATUS_DONE:
+            if os.path.exists(dst_file):
+                return False, "completed"
+            return True, "output missing"
+
+        if record["status"] == STATUS_FAILED:
+            return True, "retry failed"
+
+        if record["status"] == STATUS_QUARANTINED:
+            if self.retry_quarantined:
+                return True, "retry quarantined"
+            return False, f"quarantined, {record.get("error")}"
+
+        return True, "resume interrupted"
+
+    def mark(self, src_file: str, dst_file: str, status: str, error: str = None):
+        src, size, mtime = self.source_key(src_file)
+        record = {
+            "src": src,
+            "size": size,
+            "mtime": mtime,
+            "settings": self.settings,
+            "dst": os.path.abspath(dst_file),
+            "status": status,
+            "time": time.time()
+        }
+
+        if error is not None:
+            record["error"] = error
+
+        self.records[src] = record
+
+        with locked(self.path), open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,209 @@
+'''
+    Video Upscaler
+    Estimating the cost of each job and ordering the queue by shortest job, priority or deadline
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import fnmatch
+import json
+import logging
+import os
+import statistics
+from datetime import datetime
+from resolution_planner import FRAME_MODELS
+
+logger = logging.getLogger("videoupscaler")
+
+ORDER_WALK = "walk"
+ORDER_SJF = "sjf"
+ORDER_PRIORITY = "priority"
+ORDER_DEADLINE = "deadline"
+ORDERS = [ORDER_WALK, ORDER_SJF, ORDER_PRIORITY, ORDER_DEADLINE]
+
+#per source settings beside it, eg movie.mkv.upscale.json, these are never queued as sources
+SIDECAR_SUFFIX = ".upscale.json"
+
+#seconds per megapixel of output per frame before any upscale stage has been recorded on this host.
+#only the ratios between models matter for the ordering
+DEFAULT_COST_FACTORS = {
+    "realesrgan": 0.05,
+    "realcugan": 0.08,
+    "libplacebo": 0.005,
+    "rife": 0.02
+}
+DEFAULT_COST_FACTOR = 0.05
+#recorded stages of a model needed before its own factor is trusted
+MIN_SAMPLES = 3
+
+UNKNOWN_COST = float("inf")
+
+#what a pass estimate is based on, a recorded frame rate of this host, a calibrated factor or a default
+BASIS_RECORDED = "recorded"
+BASIS_CALIBRATED = "calibrated"
+BASIS_DEFAULT = "default"
+#sources probed at once to order a batch
+PROBE_CONCURRENCY = 8
+
+
+def megapixels(width: int, height: int):
+    return width * height / 1e6
+
+
+def format_cost(cost: float):
+    if (cost == UNKNOWN_COST):
+        return "unknown cost"
+
+    minutes, seconds = divmod(int(cost), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class CostModel:
+    '''
+        Estimated upscale seconds of a job from its planned passes. A pass that ran on this host before
+        takes the frame rate recorded in the performance profile, otherwise frames x output megapixels
+        x a factor per backend, model and type. Factors are calibrated from the upscale stages in the
+        metrics file, models with too few stages recorded use the defaults scaled by how fast this host
+        is for the others.
+    '''
+
+    def __init__(self, factors: dict = None, host_speed: float = 1.0, profile = None):
+        #(backend, model, type) -> seconds per output megapixel frame
+        self.factors = factors or {}
+        self.host_speed = host_speed
+        #PerfProfile or None
+        self.profile = profile
+
+    @staticmethod
+    def from_metrics(records: list, profile = None):
+        samples = {}
+
+        for record in records:
+            if (record.get("type") != "stage" or record.get("stage") != "upscale" or record.get("return_code") != 0):
+                continue
+
+            frames = record.get("frames") or 0
+            pixels = record.get("out_pixels") or 0
+            if (frames <= 0 or pixels <= 0 or record.get("seconds", 0) <= 0):
+                continue
+
+            key = (record.get("backend"), record.get("model"), record.get("model_type"))
+            samples.setdefault(key, []).append(record["seconds"] / (frames * pixels / 1e6))
+
+        factors = { key: statistics.median(values) for key, values in samples.items() if len(values) >= MIN_SAMPLES }
+        ratios = [factor / DEFAULT_COST_FACTORS.get(key[1], DEFAULT_COST_FACTOR) for key, factor in factors.items()]
+
+        return CostModel(factors, statistics.median(ratios) if ratios else 1.0, profile)
+
+    def factor(self, backend: str, model: str, model_type: str):
+        factor = self.factors.get((backend, model, model_type))
+        if (factor is not None):
+            return factor
+
+        return DEFAULT_COST_FACTORS.get(model, DEFAULT_COST_FACTOR) * self.host_speed
+
+    def pass_estimate(self, item: dict, frames: int, backend: str, thread_count: int = 1):
+        #(seconds, what the estimate is based on) of one planned pass
+        model = item["model"].name
+
+        if (self.profile is not None):
+            fps = self.profile.fps(backend, model, item["type"], item["scale"], item.get("in_width", 0), item.get("in_height", 0), thread_count)
+            if (fps):
+                return frames / fps, BASIS_RECORDED
+
+        basis = BASIS_CALIBRATED if (backend, model, item["type"]) in self.factors else BASIS_DEFAULT
+        return frames * megapixels(item.get("out_width", 0), item.get("out_height", 0)) * self.factor(backend, model, item["type"]), basis
+
+    def estimate_passes(self, plan, frames: int, backend: str, frame_rate_mul: int = 0, thread_count: int = 1):
+        #(seconds, basis) of each pass, empty when the source was not probed
+        if (plan is None or frames <= 0 or plan.out_width <= 0):
+            return []
+
+        estimates = []
+
+        for item in plan.passes:
+            pass_frames = frames * frame_rate_mul if frame_rate_mul > 0 and item["model"] in FRAME_MODELS else frames
+            estimates.append(self.pass_estimate(item, pass_frames, backend, thread_count))
+
+        return estimates
+
+    def estimate(self, plan, frames: int, backend: str, frame_rate_mul: int = 0, thread_count: int = 1):
+        estimates = self.estimate_passes(plan, frames, backend, frame_rate_mul, thread_count)
+        return sum(seconds for seconds, _ in estimates) if estimates else UNKNOWN_COST
+
+    def __repr__(self):
+        return f"{len(self.factors)} calibrated models, others at {self.host_speed:.2f}x the default cost"
+
+
+def parse_deadline(value):
+    #ISO 8601 time, naive times are local, or a unix timestamp
+    if (value is None or value == ""):
+        return None
+
+    if (isinstance(value, (int, float))):
+        return float(value)
+
+    return datetime.fromisoformat(value).timestamp()
+
+
+class PriorityRules:
+    '''
+        Priority and deadline of a source from a JSON list of {"pattern", "priority", "deadline"} rules,
+        matched in order on the path relative to the input directory or the file name, and from a
+        sidecar file next to the source which wins over the rules.
+    '''
+
+    def __init__(self, rules: list = None):
+        self.rules = rules or []
+
+    @staticmethod
+    def load(path: str = None):
+        if (not path):
+            return PriorityRules()
+
+        with open(path, "r", encoding="utf-8") as f:
+            return PriorityRules(json.load(f))
+
+    def sidecar(self, src_file: str):
+        path = src_file + SIDECAR_SUFFIX
+
+        if (not os.path.exists(path)):
+            return {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring sidecar {path}: {e}")
+            return {}
+
+    def lookup(self, src_file: str, src_dir: str):
+        #returns (priority, deadline timestamp or None)
+        relative = os.path.relpath(src_file, src_dir).replace(os.sep, "/")
+        name = os.path.basename(src_file)
+        settings = {}
+
+        for rule in self.rules:
+            if (fnmatch.fnmatch(relative, rule["pattern"]) or fnmatch.fnmatch(name, rule["pattern"])):
+                settings = dict(rule)
+                break
+
+        settings.update(self.sidecar(src_file))
+        return int(settings.get("priority", 0)), parse_deadline(settings.get("deadline"))
+
+
+def order_key(order: str, cost: float, priority: int = 0, deadline: float = None):
+    #lower sorts first, the queue breaks ties in submission order
+    if (order == ORDER_SJF):
+        return (cost,)
+
+    if (order == ORDER_PRIORITY):
+        return (-priority, cost)
+
+    if (order == ORDER_DEADLINE):
+        #least slack first, the latest a job can start and still finish in time. Jobs without a deadline follow
+        if (deadline is not None):
+            return (0, deadline - (cost if cost != UNKNOWN_COST else 0))
+        return (1, cost)
+
+    return (0,)
@@ -0,0 +1,141 @@
+'''
+    Video Upscaler
+    Job queue and bounded worker pool for running per file upscale jobs
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import itertools
+import logging
+import traceback
+from typing import Awaitable, Callable, Iterable
+from resource_governor import AdaptiveLimit, ResourceGovernor
+
+logger = logging.getLogger("videoupscaler")
+
+
+class UpscaleJob:
+
+    def __init__(self, src_file: str, src_file_name: str, dst_file: str):
+        #original source path, output file name (always .mp4) and output path
+        self.src_file = src_file
+        self.src_file_name = src_file_name
+        self.dst_file = dst_file
+        #probed media info of the source, its audio and subtitle tracks and the task transcoding those not copied
+        self.media = None
+        self.tracks = None
+        self.tracks_task = None
+        #the upscale passes planned from the probed size
+        self.plan = None
+        #failed attempts so far, and the thread count and segment length lowered after running out of memory
+        self.attempts = 0
+        self.thread_count = 1
+        self.segment_seconds = 0
+        #estimated upscale seconds and the queue order key, lower runs first
+        self.cost = None
+        self.sort_key = (0,)
+        #the manifest status of the last attempt, and the future of a job submitted through the library api
+        self.status = None
+        self.result = None
+        #the result cache key of the source content and settings
+        self.cache_key = None
+        #frame filters of this source when they differ from the configured ones, eg a detected crop
+        self.filters = None
+
+    def __repr__(self):
+        return f"UpscaleJob({self.src_file} -> {self.dst_file})"
+
+
+class JobScheduler:
+    '''
+        Runs queued jobs on a pool of workers. Each stage of a job acquires a slot
+        from the stage limit it needs, upscale for the GPU bound video2x passes and
+        transcode for the CPU bound ffmpeg pre process, track and mux stages. There is a
+        worker per slot, so with the default one of each a file is pre processed or muxed
+        while another upscales. Pre processing file N+1 while file N upscales and file N-1
+        muxes needs a transcode limit of two. Queued jobs are taken in the order
+        of their sort key, then in the order they were queued. A governor lowers the limits
+        while the host is short of memory or overloaded.
+    '''
+
+    def __init__(self, upscale_workers: int = 1, transcode_workers: int = 1, governor: ResourceGovernor = None):
+        self.upscale_workers = max(1, int(upscale_workers))
+        self.transcode_workers = max(1, int(transcode_workers))
+        self.worker_count = self.upscale_workers + self.transcode_workers
+
+        self.upscale = AdaptiveLimit(self.upscale_workers)
+        self.transcode = AdaptiveLimit(self.transcode_workers)
+        self.governor = governor if governor is not None and governor.enabled else None
+        self.governor_task = None
+
+        self.queue = None
+        self.workers = []
+        #jobs with equal keys run in the order they were queued
+        self.sequence = itertools.count()
+        #jobs waiting out a retry backoff without holding a worker
+        self.delayed = set()
+
+    def start(self, handler: Callable[[UpscaleJob], Awaitable[None]]):
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.create_task(self.worker(i, handler)) for i in range(self.worker_count)]
+
+        if (self.governor is not None):
+            self.governor_task = asyncio.create_task(self.governor.run({ "upscale": self.upscale, "transcode": self.transcode }))
+        logger.info(f"Started {self.worker_count} workers, upscale limit {self.upscale_workers}, transcode limit {self.transcode_workers}")
+
+    def submit(self, job: UpscaleJob):
+        self.queue.put_nowait((job.sort_key, next(self.sequence), job))
+
+    def submit_later(self, job: UpscaleJob, delay: float):
+        async def wait_and_submit():
+            await asyncio.sleep(delay)
+            self.submit(job)
+
+        task = asyncio.create_task(wait_and_submit())
+        self.delayed.add(task)
+        task.add_done_callback(self.delayed.discard)
+
+    async def join(self):
+        #the queue can empty while a retry is waiting to be queued again
+        await self.queue.join()
+        while self.delayed:
+            await asyncio.wait(set(self.delayed))
+            await self.queue.join()
+
+        await self.stop()
+
+    async def stop(self):
+        #cancels the workers without waiting for the queue, for a long running watch that is shut down
+        tasks = self.workers + list(self.delayed)
+        if (self.governor_task is not None):
+            tasks.append(self.governor_task)
+            self.governor_task = None
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+
+    async def run(self, jobs: Iterable[UpscaleJob], handler: Callable[[UpscaleJob], Awaitable[None]]):
+        self.start(handler)
+
+        for job in jobs:
+            self.submit(job)
+
+        await self.join()
+
+    async def worker(self, index: int, handler: Callable[[UpscaleJob], Awaitable[None]]):
+        while True:
+            _, _, job = await self.queue.get()
+            try:
+                logger.info(f"Worker {index} starting {job.src_file}")
+                await handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                #a single bad file must not stop the rest of the batch
+                logger.error(f"Job failed {job.src_file}: {e}")
+                logger.debug(traceback.format_exc())
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,236 @@
+'''
+    Video Upscaler
+    Media inspection with a single ffprobe call per file and an on disk probe cache
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from process_runner import CommandError, run_process
+
+logger = logging.getLogger("videoupscaler")
+
+#an ffprobe of a file on a stalled network share can hang forever
+PROBE_TIMEOUT = 120
+
+PROBE_CACHE_FILE_NAME = "probe_cache.json"
+
+
+def default_cache_dir():
+    if sys.platform == 'win32':
+        return os.path.join(os.environ.get('LOCALAPPDATA'), "videoupscaler")
+
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser("~"), ".cache")), "videoupscaler")
+
+
+def parse_rate(rate: str):
+    #ffprobe frame rates are fractions like 24000/1001, 0/0 when unknown
+    if not rate:
+        return 0.0
+
+    if "/" in rate:
+        num, den = rate.split("/", 1)
+        den = float(den)
+        return float(num) / den if den else 0.0
+
+    return float(rate)
+
+
+def parse_duration(value: str):
+    #seconds, or the hh:mm:ss.nanoseconds of the matroska DURATION tag. 0 when unknown
+    if not value or value == "N/A":
+        return 0.0
+
+    try:
+        seconds = 0.0
+        for part in str(value).split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return 0.0
+
+
+class MediaInfo:
+
+    def __init__(self, data: dict):
+        #data is the raw ffprobe json output so the cache can hold it unchanged
+        self.data = data
+        self.streams = data.get("streams", [])
+        self.format = data.get("format", {})
+
+        self.video = next((stream for stream in self.streams if stream.get("codec_type") == "video"), None)
+        self.audio_streams = [stream for stream in self.streams if stream.get("codec_type") == "audio"]
+        self.audio = self.audio_streams[0] if self.audio_streams else None
+        self.subtitle_streams = [stream for stream in self.streams if stream.get("codec_type") == "subtitle"]
+
+    @property
+    def format_name(self):
+        return self.format.get("format_name")
+
+    @property
+    def duration(self):
+        duration = self.format.get("duration") or (self.video or {}).get("duration")
+        return float(duration) if duration else 0.0
+
+    @property
+    def width(self):
+        return int(self.video.get("width", 0)) if self.video else 0
+
+    @property
+    def height(self):
+        return int(self.video.get("height", 0)) if self.video else 0
+
+    @property
+    def video_codec(self):
+        return self.video.get("codec_name") if self.video else None
+
+    @property
+    def audio_codec(self):
+        return self.audio.get("codec_name") if self.audio else None
+
+    @property
+    def fps(self):
+        if not self.video:
+            return 0.0
+
+        return parse_rate(self.video.get("avg_frame_rate")) or parse_rate(self.video.get("r_frame_rate"))
+
+    @property
+    def video_duration(self):
+        #the length of the video stream, which can be shorter than the container when audio or subtitles run on
+        if not self.video:
+            return 0.0
+
+        tags = self.video.get("tags", {})
+        duration = parse_duration(self.video.get("duration"))
+        #matroska only has it as a tag, DURATION-eng and the like when the stream has a language
+        duration = duration or next((parse_duration(value) for name, value in tags.items() if name.upper().startswith("DURATION")), 0.0)
+        return duration or self.duration
+
+    @property
+    def frame_count_estimated(self):
+        return bool(self.video) and not self.video.get("nb_frames")
+
+    @property
+    def frame_count(self):
+        if not self.video:
+            return 0
+
+        if self.video.get("nb_frames"):
+            return int(self.video["nb_frames"])
+
+        #matroska and others do not store a frame count, estimate it rather than decode the file
+        return int(round(self.video_duration * self.fps))
+
+    def __repr__(self):
+        return f"MediaInfo({self.format_name} {self.video_codec} {self.width}x{self.height} {self.fps:.3f}fps {self.frame_count} frames {self.duration:.2f}s audio {self.audio_codec})"
+
+
+class ProbeCache:
+    '''
+        Probe results stored as json keyed on the absolute path, with the size and mtime
+        recorded so a changed file is probed again.
+    '''
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, PROBE_CACHE_FILE_NAME)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring corrupt probe cache {self.path}")
+
+    def file_key(self, src_file: str):
+        stat = os.stat(src_file)
+        return os.path.abspath(src_file), stat.st_size, stat.st_mtime_ns
+
+    def get(self, src_file: str):
+        path, size, mtime = self.file_key(src_file)
+        entry = self.entries.get(path)
+
+        if entry is None or entry["size"] != size or entry["mtime"] != mtime:
+            return None
+
+        return entry
+
+    def put(self, src_file: str, entry: dict):
+        path, size, mtime = self.file_key(src_file)
+        entry["size"] = size
+        entry["mtime"] = mtime
+        self.entries[path] = entry
+        self.save()
+
+    def update(self, src_file: str, **values):
+        #analysis results stored beside the probe of a file, dropped with it once the file changes
+        entry = self.get(src_file)
+        if entry is None:
+            return
+
+        entry.update(values)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+class MediaProbe:
+
+    def __init__(self, ffprobe_bin: str, cache: ProbeCache = None):
+        self.ffprobe_bin = ffprobe_bin
+        self.cache = cache
+        self.pending = {}
+
+    async def run_ffprobe(self, src_file: str):
+        cmd = [
+            self.ffprobe_bin,
+            '-v',
+            'error',
+            '-show_format',
+            '-show_streams',
+            '-of',
+            'json',
+            src_file
+            ]
+
+        try:
+            result = await run_process(cmd, None, capture_stdout=True, timeout=PROBE_TIMEOUT)
+        except CommandError as e:
+            raise RuntimeError(f"ffprobe failed for {src_file}: {e}") from e
+
+        return json.loads(result.stdout.decode('utf-8'))
+
+    async def probe(self, src_file: str):
+        if self.cache is not None:
+            entry = self.cache.get(src_file)
+            if entry is not None:
+                return MediaInfo(entry["probe"])
+
+        #concurrent jobs asking for the same file share one ffprobe call
+        key = os.path.abspath(src_file)
+        if key in self.pending:
+            return MediaInfo(await self.pending[key])
+
+        future = asyncio.ensure_future(self.run_ffprobe(src_file))
+        self.pending[key] = future
+
+        try:
+            data = await future
+        finally:
+            del self.pending[key]
+
+        if self.cache is not None:
+            self.cache.put(src_file, { "probe": data })
+
+        info = MediaInfo(data)
+        logger.info(f"Probed {src_file} {info}")
+        return info
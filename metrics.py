@@ -0,0 +1,105 @@
+'''
+    Video Upscaler
+    Per file and per stage timing metrics written as JSON lines
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import logging
+import os
+import socket
+import time
+from file_lock import locked
+
+logger = logging.getLogger("videoupscaler")
+
+METRICS_FILE_NAME = ".videoupscaler_metrics.jsonl"
+
+
+class StageMetrics:
+
+    def __init__(self, stage: str, src_file: str, labels: dict = None):
+        self.stage = stage
+        self.src_file = src_file
+        self.labels = labels or {}
+        self.started = time.time()
+        self.start_monotonic = time.monotonic()
+        self.last_event = None
+
+    def update(self, event):
+        self.last_event = event
+
+    def record(self, return_code: int):
+        seconds = time.monotonic() - self.start_monotonic
+        frames = self.last_event.frame if self.last_event is not None else 0
+
+        record = {
+            "type": "stage",
+            "stage": self.stage,
+            "file": self.src_file,
+            "start": self.started,
+            "seconds": seconds,
+            "frames": frames,
+            #average over the whole stage, the last reported fps is only the current rate
+            "fps": frames / seconds if seconds > 0 else 0.0,
+            "speed": self.last_event.speed if self.last_event is not None else 0.0,
+            "return_code": return_code
+        }
+        record.update(self.labels)
+        return record
+
+
+class MetricsRecorder:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.host = socket.gethostname()
+
+        directory = os.path.dirname(path)
+        if (directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def stage(self, stage: str, src_file: str, **labels):
+        return StageMetrics(stage, src_file, labels)
+
+    def write(self, record: dict):
+        record["host"] = self.host
+
+        #hosts sharing the output directory write the same file
+        with locked(self.path), open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def write_stage(self, metrics: StageMetrics, return_code: int):
+        record = metrics.record(return_code)
+        self.write(record)
+        logger.info(f"{record["stage"]} {os.path.basename(record["file"])} took {record["seconds"]:.1f}s, {record["frames"]} frames at {record["fps"]:.2f}fps")
+        return record
+
+    def write_job(self, src_file: str, dst_file: str, seconds: float, status: str, settings: dict = None):
+        self.write({
+            "type": "job",
+            "file": src_file,
+            "dst": dst_file,
+            "end": time.time(),
+            "seconds": seconds,
+            "status": status,
+            "settings": settings
+        })
+
+
+def read_metrics(path: str):
+    records = []
+
+    if not os.path.exists(path):
+        return records
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    return records
@@ -0,0 +1,162 @@
+'''
+    Video Upscaler
+    Per host upscale throughput recorded from completed runs, for batch time estimates and thread count suggestions,
+    and the thread count and upscale workers chosen by autotune calibration
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+logger = logging.getLogger("videoupscaler")
+
+PERF_DB_FILE_NAME = "perf.db"
+
+
+class PerfProfile:
+    '''
+        SQLite database in the cache directory with the frames and seconds of every successful
+        upscale stage, summed per host, backend, model, type, scale, input size and thread count.
+        A size or thread count never run is estimated from the pixel rate of the runs that were,
+        networks take time in proportion to the input pixels of each frame.
+    '''
+
+    def __init__(self, path: str, host: str = None):
+        self.path = path
+        self.host = host if host else socket.gethostname()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        db = self.connect()
+        try:
+            db.execute("""CREATE TABLE IF NOT EXISTS throughput (
+                host TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                model_type TEXT NOT NULL,
+                scale INTEGER NOT NULL,
+                in_width INTEGER NOT NULL,
+                in_height INTEGER NOT NULL,
+                thread_count INTEGER NOT NULL,
+                runs INTEGER NOT NULL,
+                frames INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                updated REAL,
+                PRIMARY KEY (host, backend, model, model_type, scale, in_width, in_height, thread_count))""")
+            #the configured model, or chain, and scale as calibrated, the model type is empty for a chain
+            db.execute("""CREATE TABLE IF NOT EXISTS tuning (
+                host TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                model_type TEXT NOT NULL,
+                scale INTEGER NOT NULL,
+                thread_count INTEGER NOT NULL,
+                upscale_workers INTEGER NOT NULL,
+                fps REAL NOT NULL,
+                updated REAL,
+                PRIMARY KEY (host, backend, model, model_type, scale))""")
+        finally:
+            db.close()
+
+    def connect(self):
+        #a connection per call, calls come from executor threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def record(self, stage: dict):
+        #adds an upscale stage metrics record, returns False for records without the sizes or timing needed
+        if (stage.get("return_code") != 0 or stage.get("frames", 0) <= 0 or stage.get("seconds", 0) <= 0 or stage.get("in_width", 0) <= 0):
+            return False
+
+        db = self.connect()
+        try:
+            db.execute("""INSERT INTO throughput (host, backend, model, model_type, scale, in_width, in_height, thread_count, runs, frames, seconds, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT (host, backend, model, model_type, scale, in_width, in_height, thread_count)
+                DO UPDATE SET runs = runs + 1, frames = frames + excluded.frames, seconds = seconds + excluded.seconds, updated = excluded.updated""",
+                (self.host, stage["backend"], stage["model"], stage["model_type"], stage["scale"], stage["in_width"], stage["in_height"], stage["thread_count"], stage["frames"], stage["seconds"], time.time()))
+        finally:
+            db.close()
+
+        return True
+
+    def rows(self, backend: str, model: str, model_type: str, scale: int = None):
+        sql = "SELECT * FROM throughput WHERE host = ? AND backend = ? AND model = ? AND model_type = ?"
+        params = (self.host, backend, model, model_type)
+
+        if (scale is not None):
+            sql += " AND scale = ?"
+            params += (scale,)
+
+        db = self.connect()
+        try:
+            return [dict(row) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def fps(self, backend: str, model: str, model_type: str, scale: int, width: int, height: int, thread_count: int):
+        #recorded frames per second for a pass, or None when the model, type and scale never ran on this host
+        if (width <= 0 or height <= 0):
+            return None
+
+        rows = self.rows(backend, model, model_type, scale)
+        exact = [row for row in rows if row["in_width"] == width and row["in_height"] == height and row["thread_count"] == thread_count]
+        if (exact):
+            return exact[0]["frames"] / exact[0]["seconds"]
+
+        #the same thread count at other sizes, then any thread count
+        rows = [row for row in rows if row["thread_count"] == thread_count] or rows
+        if (not rows):
+            return None
+
+        pixel_rate = sum(row["frames"] * row["in_width"] * row["in_height"] for row in rows) / sum(row["seconds"] for row in rows)
+        return pixel_rate / (width * height)
+
+    def thread_rates(self, backend: str, model: str, model_type: str, scale: int = None):
+        #input megapixels per second by thread count, over every size recorded
+        totals = {}
+
+        for row in self.rows(backend, model, model_type, scale):
+            pixels, seconds = totals.get(row["thread_count"], (0, 0.0))
+            totals[row["thread_count"]] = (pixels + row["frames"] * row["in_width"] * row["in_height"], seconds + row["seconds"])
+
+        return { thread_count: pixels / seconds / 1e6 for thread_count, (pixels, seconds) in sorted(totals.items()) if seconds > 0 }
+
+    def suggest_thread_count(self, backend: str, model: str, model_type: str, scale: int = None):
+        #the fastest recorded thread count at the scale, or over every scale when it has too few runs.
+        #None until at least two thread counts have been run
+        rates = self.thread_rates(backend, model, model_type, scale)
+
+        if (len(rates) < 2 and scale is not None):
+            rates = self.thread_rates(backend, model, model_type)
+
+        if (len(rates) < 2):
+            return None
+
+        return max(rates, key=rates.get)
+
+    def save_tuning(self, backend: str, model: str, model_type: str, scale: int, thread_count: int, upscale_workers: int, fps: float):
+        #replaces the calibrated configuration, fps is the frames per second of every worker together
+        db = self.connect()
+        try:
+            db.execute("""INSERT OR REPLACE INTO tuning (host, backend, model, model_type, scale, thread_count, upscale_workers, fps, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (self.host, backend, model, model_type, scale, thread_count, upscale_workers, fps, time.time()))
+        finally:
+            db.close()
+
+    def tuning(self, backend: str, model: str, model_type: str, scale: int):
+        #the calibrated configuration on this host, or None when autotune never ran for it
+        db = self.connect()
+        try:
+            row = db.execute("SELECT * FROM tuning WHERE host = ? AND backend = ? AND model = ? AND model_type = ? AND scale = ?",
+                (self.host, backend, model, model_type, scale)).fetchone()
+        finally:
+            db.close()
+
+        return dict(row) if row is not None else None
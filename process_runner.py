@@ -0,0 +1,213 @@
+'''
+    Video Upscaler
+    Running ffmpeg, ffprobe and upscaler processes with line framed output, bounded logging, timeouts and cancellation
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import collections
+import logging
+import os
+import time
+from typing import Callable
+from progress_parser import ProgressParser
+
+logger = logging.getLogger("videoupscaler")
+
+#lines kept per process and logged when it fails
+TAIL_LINES = 50
+#lines forwarded to the log per process in each interval, the rest are only counted
+LOG_LINES_PER_INTERVAL = 20
+LOG_INTERVAL = 10.0
+#seconds a terminated process gets to exit before it is killed
+KILL_GRACE = 5.0
+READ_SIZE = 65536
+
+
+class CommandError(RuntimeError):
+    '''
+        A process returned non zero, timed out or stalled. Carries the last lines of its output.
+    '''
+
+    def __init__(self, cmd: list, return_code: int, tail: list = None, reason: str = None):
+        self.cmd = cmd
+        self.return_code = return_code
+        self.tail = list(tail or [])
+        self.reason = reason if reason else f"returned {return_code}"
+        last_line = f": {self.tail[-1]}" if self.tail else ""
+        super().__init__(f"{os.path.basename(str(cmd[0]))} {self.reason}{last_line}")
+
+
+class LogForwarder:
+    '''
+        Forwards process output lines to the log at most max_lines per interval. Many concurrent
+        jobs each logging every ffmpeg line made the log handler the busiest part of the process.
+    '''
+
+    def __init__(self, log: logging.Logger, prefix: str, level: int = logging.DEBUG, max_lines: int = LOG_LINES_PER_INTERVAL, interval: float = LOG_INTERVAL):
+        self.log = log
+        self.prefix = prefix
+        self.level = level
+        self.max_lines = max_lines
+        self.interval = interval
+        self.window_start = time.monotonic()
+        self.count = 0
+        self.suppressed = 0
+
+    def line(self, line: str):
+        if (self.log is None or not self.log.isEnabledFor(self.level)):
+            return
+
+        now = time.monotonic()
+        if (now - self.window_start >= self.interval):
+            self.flush()
+            self.window_start = now
+            self.count = 0
+
+        if (self.count < self.max_lines):
+            self.count += 1
+            self.log.log(self.level, f"{self.prefix}: {line}")
+        else:
+            self.suppressed += 1
+
+    def flush(self):
+        if (self.suppressed > 0):
+            self.log.log(self.level, f"{self.prefix}: {self.suppressed} lines not logged")
+            self.suppressed = 0
+
+
+class ProcessResult:
+
+    def __init__(self, return_code: int, stdout: bytes = None, tail: list = None):
+        self.return_code = return_code
+        self.stdout = stdout
+        self.tail = tail or []
+
+
+async def terminate_process(proc, grace: float = KILL_GRACE):
+    #terminate, then kill what is still running after the grace period
+    if (proc.returncode is not None):
+        return
+
+    try:
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), grace)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+    await proc.wait()
+
+
+async def read_lines(stream, name: str, parser: ProgressParser, tail: collections.deque, forwarder: LogForwarder, activity: list, on_progress: Callable = None, on_line: Callable = None):
+    def handle(events, lines):
+        for line in lines:
+            #a line handler returns True for lines it consumed, eg parsed data, which are kept out of the log
+            if (on_line is not None and on_line(line)):
+                continue
+
+            tail.append(f"{name}: {line}")
+            forwarder.line(line)
+
+        if (events and on_progress is not None):
+            on_progress(events[-1])
+
+    while True:
+        data = await stream.read(READ_SIZE)
+        if (not data):
+            break
+
+        activity[0] = time.monotonic()
+        handle(*parser.feed(data))
+
+    handle(*parser.flush())
+
+
+async def read_all(stream, activity: list):
+    chunks = []
+
+    while True:
+        data = await stream.read(READ_SIZE)
+        if (not data):
+            break
+
+        activity[0] = time.monotonic()
+        chunks.append(data)
+
+    return b"".join(chunks)
+
+
+async def watch_idle(activity: list, idle_timeout: float):
+    #returns once there has been no output for idle_timeout seconds
+    while True:
+        remaining = activity[0] + idle_timeout - time.monotonic()
+        if (remaining <= 0):
+            return
+
+        await asyncio.sleep(min(remaining, 1.0))
+
+
+async def run_process(cmd: list, log: logging.Logger = logger, prefix: str = None, total: int = 0, on_progress: Callable = None, on_line: Callable = None, capture_stdout: bool = False, timeout: float = None, idle_timeout: float = None, check: bool = True, tail_lines: int = TAIL_LINES):
+    '''
+        Runs cmd reading stdout and stderr as they are written so the process never blocks on a full pipe.
+        Output is split into lines, progress lines go to on_progress, the others to on_line then a rate limited
+        debug log and a ring buffer of the last tail_lines lines which is logged if the process fails.
+        With capture_stdout stdout is returned whole instead, for json output. On a timeout, no output for
+        idle_timeout seconds, or cancellation the process is terminated then killed.
+        Raises CommandError on a non zero return code unless check is False.
+    '''
+    prefix = prefix if prefix else os.path.basename(str(cmd[0])).upper()
+    tail = collections.deque(maxlen=tail_lines)
+    forwarder = LogForwarder(log, prefix)
+    activity = [time.monotonic()]
+    reason = None
+
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+    if (capture_stdout):
+        stdout_reader = read_all(proc.stdout, activity)
+    else:
+        stdout_reader = read_lines(proc.stdout, f"{prefix}_STDOUT", ProgressParser(total), tail, forwarder, activity, on_progress, on_line)
+
+    stderr_reader = read_lines(proc.stderr, f"{prefix}_STDERR", ProgressParser(total), tail, forwarder, activity, on_progress, on_line)
+    readers = asyncio.ensure_future(asyncio.gather(stdout_reader, stderr_reader))
+    idle = asyncio.ensure_future(watch_idle(activity, idle_timeout)) if idle_timeout else None
+
+    try:
+        done, _ = await asyncio.wait([readers] + ([idle] if idle is not None else []), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        if (readers in done):
+            stdout, _ = readers.result()
+        else:
+            reason = f"timed out after {timeout}s" if idle not in done else f"stalled, no output for {idle_timeout}s"
+            stdout = None
+            await terminate_process(proc)
+            #a child of the process can still hold the pipes open
+            readers.cancel()
+            await asyncio.gather(readers, return_exceptions=True)
+
+        return_code = await proc.wait()
+    except BaseException:
+        #cancelled, or a line handler raised
+        await terminate_process(proc)
+        readers.cancel()
+        raise
+    finally:
+        if (idle is not None):
+            idle.cancel()
+        forwarder.flush()
+
+    if (return_code != 0 or reason is not None):
+        error = CommandError(cmd, return_code, tail, reason)
+        if (log is not None):
+            log.error(f"{prefix} {error.reason}, last {len(tail)} lines:\n" + "\n".join(tail))
+
+        if (check or reason is not None):
+            raise error
+
+    return ProcessResult(return_code, stdout if capture_stdout else None, list(tail))
@@ -0,0 +1,142 @@
+'''
+    Video Upscaler
+    Line framed progress parsing for video2x and ffmpeg output
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import re
+import time
+
+#ffmpeg stats and -progress lines start with frame=, video2x logs processing frame N/M.
+#anything else mentioning a frame, eg an error, is left as output
+FRAME_RE = re.compile(r"^frame=\s*(\d+)(?:\s*/\s*(\d+))?")
+VIDEO2X_FRAME_RE = re.compile(r"processing\s+frame\s+(\d+)\s*/\s*(\d+)", re.IGNORECASE)
+FPS_RE = re.compile(r"(?:^|[\s;])fps[=:\s]\s*([\d.]+)", re.IGNORECASE)
+SPEED_RE = re.compile(r"speed=\s*([\d.]+)x")
+REMAINING_RE = re.compile(r"(?:remaining|eta)[=:\s]\s*(\d+):(\d+):(\d+)", re.IGNORECASE)
+LINE_SPLIT_RE = re.compile(r"[\r\n]+")
+KEY_VALUE_RE = re.compile(r"^[a-z0-9_]+=\S*$")
+
+
+class ProgressEvent:
+
+    def __init__(self, frame: int, total_frames: int = 0, fps: float = 0.0, speed: float = 0.0, eta: float = None, elapsed: float = 0.0):
+        self.frame = frame
+        self.total_frames = total_frames
+        self.fps = fps
+        self.speed = speed
+        self.eta = eta
+        self.elapsed = elapsed
+
+    @property
+    def percent(self):
+        return (self.frame / self.total_frames * 100) if self.total_frames > 0 else None
+
+    def to_dict(self):
+        return {
+            "frame": self.frame,
+            "total_frames": self.total_frames,
+            "fps": self.fps,
+            "speed": self.speed,
+            "eta": self.eta,
+            "elapsed": self.elapsed
+        }
+
+    def __repr__(self):
+        return f"ProgressEvent(frame {self.frame}/{self.total_frames} fps {self.fps:.2f} speed {self.speed:.2f}x eta {self.eta})"
+
+
+class ProgressParser:
+    '''
+        Splits process output into whole lines on \\r or \\n, chunk boundaries never split a line.
+        Lines with a frame number become progress events. ffmpeg -progress output spreads one
+        update over several key=value lines, those are collected until the progress= line.
+    '''
+
+    def __init__(self, total_frames: int = 0):
+        self.total_frames = total_frames
+        self.started = time.monotonic()
+        self.buffer = ""
+        self.frame = None
+        self.fps = 0.0
+        self.speed = 0.0
+        self.eta = None
+        self.last_event = None
+
+    def feed(self, data: bytes):
+        #returns (events, lines) where lines are the complete non progress lines
+        self.buffer += data.decode("utf-8", errors="replace")
+        parts = LINE_SPLIT_RE.split(self.buffer)
+        self.buffer = parts.pop()
+        return self.parse_lines(parts)
+
+    def flush(self):
+        parts = [self.buffer]
+        self.buffer = ""
+        return self.parse_lines(parts)
+
+    def parse_lines(self, lines):
+        events = []
+        other = []
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            event, is_progress = self.parse_line(line)
+
+            if event is not None:
+                events.append(event)
+            elif not is_progress:
+                other.append(line)
+
+        return events, other
+
+    def parse_line(self, line: str):
+        #returns (event or None, whether the line was progress output)
+        frame_match = FRAME_RE.match(line) or VIDEO2X_FRAME_RE.search(line)
+        fps_match = FPS_RE.search(line)
+        speed_match = SPEED_RE.search(line)
+        remaining_match = REMAINING_RE.search(line)
+
+        if fps_match:
+            self.fps = float(fps_match.group(1))
+
+        if speed_match:
+            self.speed = float(speed_match.group(1))
+
+        if remaining_match:
+            hours, minutes, seconds = remaining_match.groups()
+            self.eta = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+        if frame_match:
+            self.frame = int(frame_match.group(1))
+            if frame_match.group(2):
+                self.total_frames = int(frame_match.group(2))
+
+        if KEY_VALUE_RE.match(line):
+            #ffmpeg -progress output, the update is complete at the progress= line
+            if line.startswith("progress=") and self.frame is not None:
+                return self.event(), True
+            return None, True
+
+        if frame_match:
+            return self.event(), True
+
+        return None, False
+
+    def event(self):
+        elapsed = time.monotonic() - self.started
+        fps = self.fps
+
+        if fps <= 0 and elapsed > 0:
+            fps = self.frame / elapsed
+
+        eta = self.eta
+        if eta is None and self.total_frames > 0 and fps > 0:
+            eta = max(self.total_frames - self.frame, 0) / fps
+
+        self.last_event = ProgressEvent(self.frame, self.total_frames, fps, self.speed, eta, elapsed)
+        self.eta = None
+        return self.last_event
@@ -0,0 +1,276 @@
+'''
+    Video Upscaler
+    Planning the model scale, pass count and chain intermediate size of each file from its probed resolution and a target size
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import itertools
+import math
+from model_builder import ProcessorModelEnum, modeltypesmap
+
+#named targets, --hd and --fourk
+TARGETS = {
+    "hd": (1920, 1080),
+    "1080p": (1920, 1080),
+    "fourk": (3840, 2160),
+    "4k": (3840, 2160),
+    "2160p": (3840, 2160)
+}
+
+#models that resize to any width and height rather than by a whole scale
+RESIZE_MODELS = (ProcessorModelEnum.libplacebo,)
+#frame interpolation does not change the size
+FRAME_MODELS = (ProcessorModelEnum.rife,)
+
+MIN_SCALE = 2
+
+
+def parse_target(value: str):
+    #WIDTHxHEIGHT, a height like 1440p, or a name in TARGETS. Returns (width, height), 0 is unconstrained
+    value = value.strip().lower()
+
+    if (value in TARGETS):
+        return TARGETS[value]
+
+    if (value.endswith("p") and value[:-1].isdigit()):
+        return (0, int(value[:-1]))
+
+    width, _, height = value.partition("x")
+    if (not width.isdigit() or not height.isdigit()):
+        raise ValueError(f"Unknown target {value}, use WIDTHxHEIGHT, a height like 1440p or one of {list(TARGETS)}")
+
+    return (int(width), int(height))
+
+
+def target_box(target: str = None, isHD: bool = False, is4K: bool = False):
+    if (target):
+        return parse_target(target)
+    elif (isHD):
+        return TARGETS["hd"]
+    elif (is4K):
+        return TARGETS["fourk"]
+
+    return (0, 0)
+
+
+def resolve_target(box: tuple, max_height: int = 0):
+    #the box outputs are fitted in with --mh as a height limit, or None to keep the configured scale
+    width, height = box
+
+    if (max_height > 0):
+        height = min(height, max_height) if height > 0 else max_height
+
+    return (width, height) if width > 0 or height > 0 else None
+
+
+def even(value: float):
+    #encoders need even dimensions for 4:2:0
+    return max(int(value) // 2 * 2, 2)
+
+
+def fit_ratio(width: int, height: int, target: tuple):
+    #the largest factor keeping width x height within the target box. A landscape box is
+    #turned for portrait sources so a 1080x1920 phone clip fits a 1920x1080 target the same way
+    box_width, box_height = target
+
+    if (box_width > 0 and box_height > 0 and (height > width) != (box_height > box_width)):
+        box_width, box_height = box_height, box_width
+
+    ratios = []
+    if (box_width > 0):
+        ratios.append(box_width / width)
+    if (box_height > 0):
+        ratios.append(box_height / height)
+
+    return min(ratios)
+
+
+def model_item(model: ProcessorModelEnum, model_type: str):
+    for item in modeltypesmap.get(model, {}).values():
+        if (item["type"] == model_type):
+            return item
+
+    return {}
+
+
+def model_scales(model: ProcessorModelEnum, model_type: str, max_scale: int):
+    #whole scales the model type can run at, up to max_scale
+    item = model_item(model, model_type)
+    low = max(item.get("min_scale", MIN_SCALE), MIN_SCALE)
+    high = min(item.get("max_scale", max_scale), max_scale)
+    return list(range(low, high + 1))
+
+
+def upscale_pass(model: ProcessorModelEnum, model_type: str, scale: int, width: int = 0, height: int = 0, lossless: bool = False):
+    #the same shape as the chain entries of multi_models_typemap
+    return {
+        "model": model,
+        "type": model_type,
+        "scale": scale,
+        "width": width,
+        "height": height,
+        "lossless": lossless
+    }
+
+
+def pass_dimensions(passes: list, width: int, height: int):
+    #(width, height, lossless) after each pass
+    dimensions = []
+
+    for item in passes:
+        if (item["width"] > 0):
+            width, height = item["width"], item["height"]
+        elif (item["scale"] > 1):
+            width, height = width * item["scale"], height * item["scale"]
+        dimensions.append((width, height, item["lossless"]))
+
+    return dimensions
+
+
+def pass_labels(item: dict):
+    #the sizes recorded with the upscale stage metrics of a planned pass, 0 when the source was not probed
+    return {
+        "in_width": item.get("in_width", 0),
+        "in_height": item.get("in_height", 0),
+        "out_pixels": item.get("out_width", 0) * item.get("out_height", 0)
+    }
+
+
+def pass_cost(scales: tuple, width: int, height: int):
+    #relative compute of a run of scale passes. The networks run at the input resolution of each pass,
+    #so the cost is the input pixels of every pass, which is why the smaller scale runs first
+    cost = 0
+    pixels = width * height
+
+    for scale in scales:
+        cost += pixels
+        pixels *= scale * scale
+
+    return cost
+
+
+class ScalePlan:
+    '''
+        The upscale passes of one file and the size they produce. fit is the size the output is
+        resized to after the passes, or the source when there are none, when no scale lands within the target.
+    '''
+
+    def __init__(self, passes: list, width: int = 0, height: int = 0, target: tuple = None, reason: str = "configured", fit: tuple = None):
+        self.passes = passes
+        self.width = width
+        self.height = height
+        self.target = target
+        self.reason = reason
+        self.fit = fit
+        self.dimensions = pass_dimensions(passes, width, height)
+
+        #each pass carries its input and output size for the stage metrics the cost of later jobs is estimated from
+        in_width, in_height = width, height
+        for item, (out_width, out_height, _) in zip(passes, self.dimensions):
+            item["in_width"], item["in_height"] = in_width, in_height
+            item["out_width"], item["out_height"] = out_width, out_height
+            in_width, in_height = out_width, out_height
+
+    @property
+    def out_width(self):
+        if (self.fit is not None):
+            return self.fit[0]
+        return self.dimensions[-1][0] if self.dimensions else self.width
+
+    @property
+    def out_height(self):
+        if (self.fit is not None):
+            return self.fit[1]
+        return self.dimensions[-1][1] if self.dimensions else self.height
+
+    @property
+    def chained(self):
+        return len(self.passes) > 1
+
+    def __repr__(self):
+        steps = " > ".join(f"{item["model"].name} {item["type"]} " + (f"{item["width"]}x{item["height"]}" if item["width"] > 0 else f"x{item["scale"]}") for item in self.passes) or "no upscale"
+        if (self.fit is not None):
+            steps += " > resize {0}x{1}".format(*self.fit)
+        target = f", target {self.target[0] or "any"}x{self.target[1] or "any"}" if self.target else ""
+        return f"{steps}, {self.width}x{self.height} -> {self.out_width}x{self.out_height}{target} ({self.reason})"
+
+
+def plan_scales(scales: list, ratio: float, max_passes: int, width: int, height: int):
+    #the scale passes with the largest total scale within ratio, ties go to the fewest pixels processed.
+    #None when even one pass of the smallest scale is too large
+    fitting = []
+
+    for count in range(1, max_passes + 1):
+        for combination in itertools.combinations_with_replacement(scales, count):
+            #float error on exact fits, eg 540 * 4 against 2160
+            if (math.prod(combination) <= ratio + 1e-6):
+                fitting.append(combination)
+
+    if (not fitting):
+        return None
+
+    return min(fitting, key=lambda combination: (-math.prod(combination), pass_cost(combination, width, height), len(combination)))
+
+
+def plan_model(model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, target: tuple = None, max_scale: int = 4, max_passes: int = 2):
+    '''
+        Passes of a single model. Without a target or probed size the configured scale runs.
+        Otherwise a resizing model goes straight to the fitted size, and a scaling model takes the scales,
+        each no larger than the configured one, whose total comes closest to the target without passing it.
+    '''
+    if (model in RESIZE_MODELS and target is not None and target[0] > 0 and target[1] > 0 and (width <= 0 or height <= 0)):
+        #unprobed, the box itself as --hd and --fourk always gave
+        return ScalePlan([upscale_pass(model, model_type, 0, target[0], target[1])], width, height, target, "target size, source not probed")
+
+    if (model in FRAME_MODELS or target is None or width <= 0 or height <= 0):
+        return ScalePlan([upscale_pass(model, model_type, scale)], width, height, target)
+
+    ratio = fit_ratio(width, height, target)
+
+    if (model in RESIZE_MODELS):
+        return ScalePlan([upscale_pass(model, model_type, 0, even(width * ratio), even(height * ratio))], width, height, target, "resized to fit")
+
+    scales = [item for item in model_scales(model, model_type, max_scale) if item <= scale] or [scale]
+    best = plan_scales(scales, ratio, max_passes, width, height)
+
+    if (best is None):
+        fit = (even(width * ratio), even(height * ratio))
+
+        if (ratio <= 1 + 1e-6):
+            #already fills the target, the model would only add pixels that are thrown away
+            if (fit == (width, height)):
+                return ScalePlan([], width, height, target, "source at target size, not upscaled")
+            return ScalePlan([], width, height, target, "source larger than target, resized to fit", fit)
+
+        #below the target by less than the smallest scale, which is upscaled then resized down to fit
+        return ScalePlan([upscale_pass(model, model_type, scales[0])], width, height, target, "smallest scale resized to fit target", fit)
+
+    passes = [upscale_pass(model, model_type, item, lossless=index < len(best) - 1) for index, item in enumerate(best)]
+    reason = "fits target" if len(passes) == 1 else f"{len(passes)} passes to reach target"
+    return ScalePlan(passes, width, height, target, reason)
+
+
+def plan_chain(chain: list, width: int, height: int, target: tuple = None, max_scale: int = 4):
+    '''
+        Passes of a chain in multi_models_typemap. With a target and a probed size the resize passes
+        make the intermediate size the final scale pass needs to fit the target, rather than the fixed size.
+        The largest final scale whose intermediate is not smaller than the source is the cheapest run
+        that does not throw detail away, without one the largest scale is used as the fixed chains do.
+    '''
+    passes = [dict(item) for item in chain]
+    final = passes[-1]
+
+    if (target is None or width <= 0 or height <= 0 or final["model"] in RESIZE_MODELS or not all(item["model"] in RESIZE_MODELS for item in passes[:-1])):
+        return ScalePlan(passes, width, height, target)
+
+    ratio = fit_ratio(width, height, target)
+    out_width, out_height = width * ratio, height * ratio
+    scales = sorted(model_scales(final["model"], final["type"], max_scale), reverse=True) or [final["scale"]]
+    scale = next((item for item in scales if out_width / item >= width and out_height / item >= height), scales[0])
+    reason = "intermediate sized for target" if out_width / scale >= width else "intermediate below source size"
+
+    for item in passes[:-1]:
+        item["width"], item["height"], item["scale"] = even(out_width / scale), even(out_height / scale), 0
+
+    final["scale"] = scale
+    return ScalePlan(passes, width, height, target, reason)
@@ -0,0 +1,169 @@
+'''
+    Video Upscaler
+    Stage limits that shrink while the host is short of memory or overloaded, and grow back once it recovers
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger("videoupscaler")
+
+MEMINFO_PATH = "/proc/meminfo"
+#a limit is raised again only after this many samples in a row below the thresholds and their margin
+RECOVER_SAMPLES = 3
+#share of the thresholds a sample has to stay inside to count towards recovering
+RECOVER_MARGIN = 0.8
+
+
+class AdaptiveLimit:
+    '''
+        A semaphore whose limit can change while it is held. Lowering it never stops a running stage,
+        new stages wait until fewer than the limit are running.
+    '''
+
+    def __init__(self, limit: int):
+        self.max_limit = max(1, int(limit))
+        self.limit = self.max_limit
+        self.active = 0
+        self.condition = None
+
+    async def set_limit(self, limit: int):
+        self.limit = min(max(1, int(limit)), self.max_limit)
+
+        #a raised limit lets waiting stages start
+        if (self.condition is not None):
+            async with self.condition:
+                self.condition.notify_all()
+
+    async def __aenter__(self):
+        if (self.condition is None):
+            self.condition = asyncio.Condition()
+
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def __repr__(self):
+        return f"AdaptiveLimit({self.active}/{self.limit} of {self.max_limit})"
+
+
+def read_meminfo(path: str = MEMINFO_PATH):
+    #MemTotal and MemAvailable in bytes, None where the kernel has no meminfo
+    values = {}
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                fields = value.split()
+                if (fields and fields[0].isdigit()):
+                    values[name] = int(fields[0]) * 1024
+    except OSError:
+        return None
+
+    if ("MemTotal" not in values or "MemAvailable" not in values):
+        return None
+
+    return values["MemTotal"], values["MemAvailable"]
+
+
+def read_load():
+    #the one minute load average per cpu, None where the platform has no load average
+    if (not hasattr(os, "getloadavg")):
+        return None
+
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+class ResourceGovernor:
+    '''
+        Samples free memory and load on an interval. While available memory is below min_free_percent
+        of the total, or the load per cpu is above max_load, the upscale and transcode limits drop by one
+        each sample down to one. Once both stay clear for a few samples they are raised by one, up to the
+        configured workers. A threshold of 0 is not checked.
+    '''
+
+    def __init__(self, min_free_percent: float = 0, max_load: float = 0, interval: float = 5.0):
+        self.min_free_percent = float(min_free_percent)
+        self.max_load = float(max_load)
+        self.interval = float(interval)
+        self.clear_samples = 0
+
+        if (self.min_free_percent > 0 and read_meminfo() is None):
+            logger.warning(f"No {MEMINFO_PATH} on this platform, memory is not governed")
+            self.min_free_percent = 0
+
+        if (self.max_load > 0 and read_load() is None):
+            logger.warning("No load average on this platform, load is not governed")
+            self.max_load = 0
+
+    @property
+    def enabled(self):
+        return self.min_free_percent > 0 or self.max_load > 0
+
+    def pressure(self, margin: float = 1.0):
+        #why the host is over a threshold scaled by margin, or None
+        if (self.min_free_percent > 0):
+            memory = read_meminfo()
+            if (memory is not None):
+                total, available = memory
+                free_percent = available * 100 / total
+                #a smaller margin asks for more memory free
+                if (free_percent < self.min_free_percent / margin):
+                    return f"{free_percent:.1f}% memory free"
+
+        if (self.max_load > 0):
+            load = read_load()
+            if (load is not None and load > self.max_load * margin):
+                return f"load {load:.2f} per cpu"
+
+        return None
+
+    async def adjust(self, limits: dict):
+        #one sample, limits is name -> AdaptiveLimit
+        reason = self.pressure()
+
+        if (reason is not None):
+            self.clear_samples = 0
+
+            for name, limit in limits.items():
+                if (limit.limit > 1):
+                    await limit.set_limit(limit.limit - 1)
+                    logger.warning(f"Lowered the {name} limit to {limit.limit}, {reason}")
+            return
+
+        if (self.pressure(RECOVER_MARGIN) is not None):
+            self.clear_samples = 0
+            return
+
+        self.clear_samples += 1
+        if (self.clear_samples < RECOVER_SAMPLES):
+            return
+
+        self.clear_samples = 0
+        for name, limit in limits.items():
+            if (limit.limit < limit.max_limit):
+                await limit.set_limit(limit.limit + 1)
+                logger.info(f"Raised the {name} limit to {limit.limit}")
+
+    async def run(self, limits: dict):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.adjust(limits)
+            except Exception as e:
+                #a failed sample leaves the limits as they are
+                logger.warning(f"Unable to sample host resources: {e}")
@@ -0,0 +1,222 @@
+'''
+    Video Upscaler
+    Content addressed cache of finished outputs so a source delivered again, under any name, is not upscaled again
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from work_queue import settings_key
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("videoupscaler")
+
+RESULT_CACHE_DIR_NAME = "results"
+RESULT_DB_FILE_NAME = "results.db"
+
+#bytes read from the start, middle and end of a source for the sampled hash
+SAMPLE_SIZE = 1 << 20
+READ_SIZE = 1 << 20
+#linux ioctl cloning a file on btrfs and xfs, the copy shares the data blocks
+FICLONE = 0x40049409
+
+LINK_HARDLINK = "hardlink"
+LINK_REFLINK = "reflink"
+LINK_COPY = "copy"
+
+
+def sampled_hash(path: str):
+    #the size and three samples, reads at most 3MB of a file of any size
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode("ascii"), digest_size=20)
+
+    with open(path, "rb") as f:
+        for offset in sorted({ 0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0) }):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def full_hash(path: str):
+    digest = hashlib.blake2b(digest_size=32)
+
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if (not data):
+                break
+            digest.update(data)
+
+    return digest.hexdigest()
+
+
+def reflink(src: str, dst: str):
+    if (fcntl is None):
+        raise OSError("reflink is not supported on this platform")
+
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+
+
+def place_file(src: str, dst: str, hardlink: bool = True):
+    #hardlinks, reflinks or copies src to dst replacing it, returns which was used
+    tmp = dst + ".cache_tmp"
+    if (os.path.exists(tmp)):
+        os.remove(tmp)
+
+    try:
+        if (not hardlink):
+            raise OSError("hardlink not wanted")
+        os.link(src, tmp)
+        method = LINK_HARDLINK
+    except OSError:
+        try:
+            reflink(src, tmp)
+            method = LINK_REFLINK
+        except OSError:
+            shutil.copyfile(src, tmp)
+            method = LINK_COPY
+
+    os.replace(tmp, dst)
+    return method
+
+
+class ResultCache:
+    '''
+        Finished outputs stored under a key made from a sampled hash of the source and the effective
+        settings, with a SQLite index. The first sampled hash match is confirmed with a hash of the whole
+        source and of the stored source, which is kept for later matches. Outputs are reflinked or copied
+        in, so writing an output again never changes an entry, and hardlinked out where the cache and output
+        directory share a filesystem. The least recently used entries are removed once the cache is over max_bytes.
+    '''
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.objects = os.path.join(root, "objects")
+        self.path = os.path.join(root, RESULT_DB_FILE_NAME)
+        os.makedirs(self.objects, exist_ok=True)
+
+        db = self.connect()
+        try:
+            db.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                full_hash TEXT,
+                settings_key TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                src TEXT,
+                src_size INTEGER,
+                src_mtime REAL,
+                created REAL,
+                last_used REAL)""")
+        finally:
+            db.close()
+
+    def connect(self):
+        #a connection per call, calls come from executor threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def key(self, src_file: str, settings: dict):
+        return hashlib.sha1(f"{sampled_hash(src_file)}:{settings_key(settings)}".encode("ascii")).hexdigest()
+
+    def object_path(self, key: str):
+        return os.path.join(self.objects, key[:2], key + ".mp4")
+
+    def remove(self, db, key: str):
+        db.execute("DELETE FROM results WHERE key = ?", (key,))
+        try:
+            os.remove(self.object_path(key))
+        except FileNotFoundError:
+            pass
+
+    def stored_hash(self, db, row, src_file: str, source_hash: str):
+        #the whole hash of the source an entry was stored from, hashed on its first match. None once that source is moved or changed
+        if (row["full_hash"] is not None):
+            return row["full_hash"]
+
+        try:
+            stat = os.stat(row["src"])
+        except OSError:
+            return None
+
+        if (stat.st_size != row["src_size"] or stat.st_mtime != row["src_mtime"]):
+            return None
+
+        stored = source_hash if os.path.abspath(src_file) == row["src"] else full_hash(row["src"])
+        db.execute("UPDATE results SET full_hash = ? WHERE key = ?", (stored, row["key"]))
+        return stored
+
+    def restore(self, key: str, src_file: str, dst_file: str):
+        #places the cached output of src_file at dst_file, returns how or None on a miss
+        db = self.connect()
+        try:
+            row = db.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+            if (row is None):
+                return None
+
+            path = self.object_path(key)
+            if (not os.path.exists(path)):
+                self.remove(db, key)
+                return None
+
+            source_hash = full_hash(src_file)
+            stored = self.stored_hash(db, row, src_file, source_hash)
+
+            if (stored is None):
+                logger.info(f"Sampled hash of {src_file} matches {row["src"]}, which has since moved or changed so the match cannot be confirmed")
+                return None
+
+            if (source_hash != stored):
+                logger.info(f"Sampled hash of {src_file} matches {row["src"]} but the content differs, not using the cached output")
+                return None
+
+            method = place_file(path, dst_file)
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            return method
+        finally:
+            db.close()
+
+    def store(self, key: str, src_file: str, dst_file: str, settings: dict):
+        size = os.path.getsize(dst_file)
+        if (size > self.max_bytes):
+            return False
+
+        #the whole source is hashed on the first match, most entries are never matched
+        stat = os.stat(src_file)
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #never a hardlink, the output can be written again in place
+        place_file(dst_file, path, False)
+
+        db = self.connect()
+        try:
+            now = time.time()
+            db.execute("INSERT OR REPLACE INTO results (key, full_hash, settings_key, size, src, src_size, src_mtime, created, last_used) VALUES (?, NULL, ?, ?, ?, ?, ?, ?, ?)",
+                (key, settings_key(settings), size, os.path.abspath(src_file), stat.st_size, stat.st_mtime, now, now))
+            self.evict(db)
+        finally:
+            db.close()
+
+        return True
+
+    def evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+        for row in db.execute("SELECT key, size, src FROM results ORDER BY last_used").fetchall():
+            if (total <= self.max_bytes):
+                break
+
+            logger.info(f"Evicting cached output of {row["src"]}")
+            self.remove(db, row["key"])
+            total -= row["size"]
@@ -0,0 +1,181 @@
+'''
+    Video Upscaler
+    Scratch directory management, per job temp space estimates, disk space admission and cleanup
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("videoupscaler")
+
+TEMP_PREFIX = "videoupscaler_"
+OWNER_FILE = ".owner"
+
+#rough sizes of the intermediates, lossless x265/ffv1 of 8 bit 4:2:0 lands around half of the raw 12 bits per pixel,
+#the lossy upscaled outputs are well under a bit per pixel
+LOSSLESS_BITS_PER_PIXEL = 6.0
+LOSSY_BITS_PER_PIXEL = 0.3
+#headroom for the estimate being low
+ESTIMATE_MARGIN = 1.25
+
+GIGABYTE = 1024 ** 3
+
+
+def lossless_bytes(width: int, height: int, frames: int):
+    return int(width * height * frames * LOSSLESS_BITS_PER_PIXEL / 8)
+
+
+def lossy_bytes(width: int, height: int, frames: int):
+    return int(width * height * frames * LOSSY_BITS_PER_PIXEL / 8)
+
+
+def directory_size(path: str):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def pid_alive(pid: int):
+    if (os.name == "nt"):
+        #os.kill terminates the process on Windows, leave those to the age check
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class ScratchSpace:
+    '''
+        Temp directories for jobs under one scratch root, ideally fast local disk separate from the output share.
+        A job reserves its estimated footprint before its temp directory is created and waits while the
+        free space less the outstanding reservations of running jobs would drop under min_free_bytes.
+        The job that is alone is always admitted so a low estimate or a small disk cannot stall the queue.
+    '''
+
+    def __init__(self, root: str = None, min_free_bytes: int = GIGABYTE, poll_interval: float = 5.0):
+        self.root = os.path.abspath(root if root else tempfile.gettempdir())
+        self.min_free_bytes = int(min_free_bytes)
+        self.poll_interval = float(poll_interval)
+        self.host = socket.gethostname()
+        #temp directory -> reserved bytes
+        self.reservations = {}
+        self.condition = None
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def outstanding(self):
+        #reserved space the running jobs have not written yet, what they have written already shows in the free space
+        total = 0
+        for path, reserved in self.reservations.items():
+            used = directory_size(path) if os.path.isdir(path) else 0
+            total += max(reserved - used, 0)
+        return total
+
+    def available(self):
+        return shutil.disk_usage(self.root).free - self.outstanding() - self.min_free_bytes
+
+    def create(self):
+        path = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.root)
+
+        with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+            json.dump({ "host": self.host, "pid": os.getpid(), "created": time.time() }, f)
+
+        return path
+
+    def remove(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+
+        if (os.path.exists(path)):
+            logger.warning(f"Unable to remove temp directory {path}")
+
+    @asynccontextmanager
+    async def job_dir(self, name: str, estimate: int):
+        #waits for space, yields a new temp directory and always removes it
+        if (self.condition is None):
+            self.condition = asyncio.Condition()
+
+        estimate = int(estimate * ESTIMATE_MARGIN)
+        waited = False
+
+        async with self.condition:
+            while self.reservations and estimate > self.available():
+                if (not waited):
+                    logger.info(f"Waiting for {estimate / GIGABYTE:.2f}GB scratch space in {self.root} for {name}")
+                    waited = True
+
+                #other processes can free space too so the wait is also timed
+                try:
+                    await asyncio.wait_for(self.condition.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            if (not self.reservations and estimate > self.available()):
+                logger.warning(f"{name} may need {estimate / GIGABYTE:.2f}GB scratch space, more than is free in {self.root}")
+
+            path = self.create()
+            self.reservations[path] = estimate
+
+        logger.info(f"Creating Temp Directory {path}, reserved {estimate / GIGABYTE:.2f}GB")
+
+        try:
+            yield path
+        finally:
+            self.remove(path)
+
+            async with self.condition:
+                self.reservations.pop(path, None)
+                self.condition.notify_all()
+
+    def sweep_orphans(self, max_age: float = 86400):
+        #temp directories left by killed runs on this host. Those of other hosts sharing the
+        #scratch root, or without an owner file, are only removed once older than max_age
+        removed = 0
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+
+            if (not name.startswith(TEMP_PREFIX) or not os.path.isdir(path)):
+                continue
+
+            owner = {}
+            try:
+                with open(os.path.join(path, OWNER_FILE), "r", encoding="utf-8") as f:
+                    owner = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+
+            if (owner.get("host") == self.host):
+                orphaned = owner.get("pid") != os.getpid() and not pid_alive(owner.get("pid", 0))
+            else:
+                orphaned = age > max_age
+
+            if (orphaned):
+                logger.info(f"Removing orphaned temp directory {path}")
+                self.remove(path)
+                removed += 1
+
+        return removed
@@ -0,0 +1,132 @@
+'''
+    Video Upscaler
+    Audio and subtitle tracks of a source planned for the mp4 output, copied or transcoded apart from the video
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import logging
+from media_probe import MediaInfo
+from encoder_profiles import EncoderProfile
+
+logger = logging.getLogger("videoupscaler")
+
+TRACK_AUDIO = "a"
+TRACK_SUBTITLE = "s"
+
+TRACK_COPY = "copy"
+TRACK_TRANSCODE = "transcode"
+TRACK_DROP = "drop"
+
+#audio codecs an mp4 holds, anything else is transcoded whatever the audio policy of the profile
+MP4_AUDIO_CODECS = ["aac", "ac3", "eac3", "mp3", "alac", "flac", "opus"]
+#the mp4 subtitle codec, text subtitles are converted to it
+MP4_SUBTITLE_CODEC = "mov_text"
+TEXT_SUBTITLE_CODECS = ["subrip", "srt", "ass", "ssa", "webvtt", "text"]
+
+
+class StreamTrack:
+    '''
+        One audio or subtitle stream of the source, index counts streams of its kind as ffmpeg
+        stream specifiers do. A track with no index stands for every audio stream of an unprobed source.
+    '''
+
+    def __init__(self, kind: str, index: int, codec: str, action: str):
+        self.kind = kind
+        self.index = index
+        self.codec = codec
+        self.action = action
+
+    @property
+    def spec(self):
+        return f"{self.kind}:{self.index}" if self.index is not None else f"{self.kind}?"
+
+    def __repr__(self):
+        return f"StreamTrack({self.spec} {self.codec} {self.action})"
+
+
+def plan_tracks(media: MediaInfo, profile: EncoderProfile):
+    #the tracks in source order with whether each is copied, transcoded or dropped
+    if (media is None):
+        #unknown source, copy whatever audio it has as before
+        return [StreamTrack(TRACK_AUDIO, None, None, TRACK_COPY)]
+
+    tracks = []
+
+    for index, stream in enumerate(media.audio_streams):
+        codec = stream.get("codec_name")
+        action = TRACK_COPY if profile.copies_audio(codec) and codec in MP4_AUDIO_CODECS else TRACK_TRANSCODE
+        tracks.append(StreamTrack(TRACK_AUDIO, index, codec, action))
+
+    for index, stream in enumerate(media.subtitle_streams):
+        codec = stream.get("codec_name")
+
+        if (codec == MP4_SUBTITLE_CODEC):
+            action = TRACK_COPY
+        elif (codec in TEXT_SUBTITLE_CODECS):
+            action = TRACK_TRANSCODE
+        else:
+            #bitmap subtitles, eg pgs and dvd, can not be stored in mp4
+            logger.warning(f"Dropping {codec} subtitle track {index}, it can not be stored in mp4")
+            action = TRACK_DROP
+
+        tracks.append(StreamTrack(TRACK_SUBTITLE, index, codec, action))
+
+    return tracks
+
+
+def transcode_args(src_file: str, tracks: list, profile: EncoderProfile, out_file: str):
+    #the transcoded tracks of the source in their own file, in track order, None when every track is copied
+    tracks = [track for track in tracks if track.action == TRACK_TRANSCODE]
+    if (not tracks):
+        return None
+
+    cmd = ['-i', src_file]
+    counts = { TRACK_AUDIO: 0, TRACK_SUBTITLE: 0 }
+
+    for track in tracks:
+        out_index = counts[track.kind]
+        counts[track.kind] += 1
+        cmd += ['-map', f"0:{track.spec}"]
+
+        if (track.kind == TRACK_AUDIO):
+            cmd += [f"-c:a:{out_index}", profile.audio_codec]
+            if (profile.audio_bitrate):
+                cmd += [f"-b:a:{out_index}", profile.audio_bitrate]
+        else:
+            cmd += [f"-c:s:{out_index}", MP4_SUBTITLE_CODEC]
+
+    return cmd + ['-vn', '-y', out_file]
+
+
+def mux_args(video_file: str, src_file: str, tracks: list, tracks_file: str, out_file: str, video_args: list):
+    '''
+        Joins the upscaled video, the copied tracks of the source and the transcoded tracks in source
+        order with the chapters and metadata of the source. Only video_args may encode, the rest is copied.
+    '''
+    cmd = ['-i', video_file, '-i', src_file]
+
+    if (tracks_file is not None):
+        cmd += ['-i', tracks_file]
+
+    cmd += ['-map', '0:v:0'] + video_args
+    counts = { TRACK_AUDIO: 0, TRACK_SUBTITLE: 0 }
+
+    for track in tracks:
+        if (track.action == TRACK_COPY):
+            cmd += ['-map', f"1:{track.spec}"]
+        elif (track.action == TRACK_TRANSCODE):
+            cmd += ['-map', f"2:{track.kind}:{counts[track.kind]}"]
+            counts[track.kind] += 1
+
+    return cmd + [
+        '-c:a',
+        'copy',
+        '-c:s',
+        'copy',
+        '-map_chapters',
+        '1',
+        '-map_metadata',
+        '1',
+        '-y',
+        out_file
+        ]
@@ -9,21 +9,24 @@ import logging
 import asyncio
 import os
 from video_upscaler import VideoUpscaler
+from upscale_config import UpscaleConfig
 from model_builder import ProcessorModelEnum, modeltypesmap
+from upscale_backends import BACKENDS, BACKEND_VIDEO2X
 
 logger = logging.getLogger("videoupscaler")
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-async def run_upscale(input, output, noise_level, model, model_type):
+async def run_upscale(input, output, noise_level, model, model_type, backend):
      
-
-        model_type_name = modeltypesmap[model][model_type]
+        #multi model chains have no type of their own
+        model_type_name = modeltypesmap[model][model_type]["type"] if model in modeltypesmap else "chain"
 
         out_dir = os.path.join(output, model.name, model_type_name)
 
         os.makedirs(out_dir, exist_ok=True)
         logger.info(f"Starting Upscale for {model.name} {model_type_name} in {out_dir}")
-        videoscaler = VideoUpscaler(input, out_dir, model, model_type, str(4), str(noise_level), False, False)
+        config = UpscaleConfig(input, out_dir, model, model_type, noise_level=noise_level, resume=False, backend=backend)
+        videoscaler = VideoUpscaler.from_config(config)
         await videoscaler.rescale()
         #videoscaler.run()
 
@@ -32,6 +35,7 @@ async def main():
     parser.add_argument('-i', '--input', required=True)
     parser.add_argument('-o', '--output', required=True)
     parser.add_argument('-n', '--noise_level', type=int, default=3)
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND_VIDEO2X)
   
     args = parser.parse_args()
 
@@ -40,8 +44,8 @@ async def main():
         run_tests = []
 
         for model in ProcessorModelEnum:
-            for type in modeltypesmap[model]:
-                await run_upscale(args.input, args.output, args.noise_level, model, type)
+            for type in modeltypesmap.get(model, { 1: None }):
+                await run_upscale(args.input, args.output, args.noise_level, model, type, args.backend)
                 #run_tests.append(run_upscale(args.input, args.output, args.noise_level, model, type))
 
         
@@ -0,0 +1,122 @@
+'''
+    Video Upscaler
+    Autotune choice, saved tuning and resource governor checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import os
+import tempfile
+import unittest
+from autotune import parse_counts, pick_best, clip_start
+from perf_profile import PerfProfile
+from resource_governor import AdaptiveLimit, ResourceGovernor, RECOVER_SAMPLES
+
+
+class PickBestTest(unittest.TestCase):
+
+    def test_fastest(self):
+        self.assertEqual(pick_best({ 1: 10.0, 2: 18.0, 4: 30.0 }), 4)
+
+    def test_small_gain_keeps_the_smaller_count(self):
+        #4 threads are only 3% faster than 2, not worth the memory
+        self.assertEqual(pick_best({ 1: 10.0, 2: 18.0, 4: 18.5 }, 0.05), 2)
+
+    def test_slower_count_is_not_chosen(self):
+        self.assertEqual(pick_best({ 1: 10.0, 2: 9.0, 4: 12.0 }, 0.05), 4)
+        self.assertEqual(pick_best({ 1: 10.0, 2: 9.0 }, 0.05), 1)
+
+    def test_parse_counts(self):
+        self.assertEqual(parse_counts("4, 1,2,2"), [1, 2, 4])
+
+        for value in ("", "0,2", "a"):
+            with self.assertRaises(ValueError):
+                parse_counts(value)
+
+    def test_clip_is_centred(self):
+        self.assertEqual(clip_start(60, 24, 120), 27.5)
+        #shorter than the clip, or unprobed
+        self.assertEqual(clip_start(3, 24, 120), 0.0)
+        self.assertEqual(clip_start(0, 0, 120), 0.0)
+
+
+class TuningTest(unittest.TestCase):
+
+    def test_saved_tuning(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profile = PerfProfile(os.path.join(temp_dir, "perf.db"), "host-a")
+            self.assertIsNone(profile.tuning("video2x", "realesrgan", "realesr-animevideov3", 2))
+
+            profile.save_tuning("video2x", "realesrgan", "realesr-animevideov3", 2, 2, 1, 20.0)
+            profile.save_tuning("video2x", "realesrgan", "realesr-animevideov3", 2, 4, 2, 31.0)
+            tuning = profile.tuning("video2x", "realesrgan", "realesr-animevideov3", 2)
+
+            self.assertEqual((tuning["thread_count"], tuning["upscale_workers"], tuning["fps"]), (4, 2, 31.0))
+            #per host and per scale
+            self.assertIsNone(PerfProfile(os.path.join(temp_dir, "perf.db"), "host-b").tuning("video2x", "realesrgan", "realesr-animevideov3", 2))
+            self.assertIsNone(profile.tuning("video2x", "realesrgan", "realesr-animevideov3", 4))
+
+
+class SampledGovernor(ResourceGovernor):
+    #reports the sample set by the test instead of reading the host
+
+    def __init__(self):
+        super().__init__()
+        self.sample = None
+
+    def pressure(self, margin: float = 1.0):
+        return self.sample
+
+
+class ResourceGovernorTest(unittest.TestCase):
+
+    def test_lowered_then_recovered(self):
+        limits = { "upscale": AdaptiveLimit(3), "transcode": AdaptiveLimit(1) }
+        governor = SampledGovernor()
+        samples = ["10% memory free"] * 3 + [None] * RECOVER_SAMPLES * 2
+
+        async def run():
+            seen = []
+            for sample in samples:
+                governor.sample = sample
+                await governor.adjust(limits)
+                seen.append(limits["upscale"].limit)
+            return seen
+
+        with self.assertLogs("videoupscaler", "INFO"):
+            seen = asyncio.run(run())
+
+        #down to one and no lower, then up by one every few clear samples, never past the configured limit
+        self.assertEqual(seen, [2, 1, 1] + [1] * (RECOVER_SAMPLES - 1) + [2] + [2] * (RECOVER_SAMPLES - 1) + [3])
+        self.assertEqual(limits["transcode"].limit, 1)
+
+    def test_raised_limit_wakes_waiters(self):
+        limit = AdaptiveLimit(2)
+
+        async def run():
+            await limit.set_limit(1)
+            entered = []
+
+            async def stage(name):
+                async with limit:
+                    entered.append(name)
+                    await asyncio.sleep(0.05)
+
+            tasks = [asyncio.create_task(stage(name)) for name in ("a", "b")]
+            await asyncio.sleep(0.01)
+            waiting = list(entered)
+            await limit.set_limit(2)
+            await asyncio.sleep(0.01)
+            running = list(entered)
+            await asyncio.gather(*tasks)
+            return waiting, running
+
+        waiting, running = asyncio.run(run())
+        self.assertEqual((waiting, running), (["a"], ["a", "b"]))
+
+    def test_disabled_without_thresholds(self):
+        self.assertFalse(ResourceGovernor().enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+'''
+    Video Upscaler
+    Failure classification, retry backoff, degrading and quarantine checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import tempfile
+import unittest
+from failure_policy import FailurePolicy, OutputValidationError, QuarantineList, classify_failure, validate_output, FAILURE_OOM, FAILURE_PERMANENT, FAILURE_TRANSIENT, OOM_SEGMENT_SECONDS, MIN_SEGMENT_SECONDS
+from job_scheduler import UpscaleJob
+from media_probe import MediaInfo
+from process_runner import CommandError
+
+
+def video_info(duration: float, frames: int = None):
+    stream = { "codec_type": "video", "avg_frame_rate": "24/1" }
+    if (frames is not None):
+        stream["nb_frames"] = str(frames)
+    return MediaInfo({ "streams": [stream], "format": { "duration": str(duration) } })
+
+
+class ClassifyFailureTest(unittest.TestCase):
+
+    def test_out_of_memory_in_the_output(self):
+        error = CommandError(["video2x"], 1, ["[error] vkAllocateMemory failed", "[error] frame 12 failed"])
+        self.assertEqual(classify_failure(error), FAILURE_OOM)
+
+    def test_permanent(self):
+        self.assertEqual(classify_failure(CommandError(["ffmpeg"], 1, ["src.mp4: moov atom not found"])), FAILURE_PERMANENT)
+
+    def test_cause_is_classified(self):
+        try:
+            try:
+                raise CommandError(["ffmpeg"], 1, ["Unknown encoder 'hevc_nvenc'"])
+            except CommandError as e:
+                raise RuntimeError("Pre process failed") from e
+        except RuntimeError as e:
+            self.assertEqual(classify_failure(e), FAILURE_PERMANENT)
+
+    def test_anything_else_is_transient(self):
+        self.assertEqual(classify_failure(CommandError(["video2x"], -9, reason="stalled for 300s")), FAILURE_TRANSIENT)
+        self.assertEqual(classify_failure(OutputValidationError("Output has no video stream")), FAILURE_TRANSIENT)
+
+
+class FailurePolicyTest(unittest.TestCase):
+
+    def test_retries(self):
+        policy = FailurePolicy(max_attempts=3)
+
+        self.assertTrue(policy.should_retry(2, FAILURE_TRANSIENT))
+        self.assertFalse(policy.should_retry(3, FAILURE_TRANSIENT))
+        self.assertFalse(policy.should_retry(1, FAILURE_PERMANENT))
+
+    def test_backoff_doubles_up_to_the_limit(self):
+        policy = FailurePolicy(backoff=30, max_backoff=100)
+        self.assertEqual([policy.delay(attempts) for attempts in range(1, 5)], [30, 60, 100, 100])
+
+    def test_degrade_threads_then_segments(self):
+        policy = FailurePolicy()
+        job = UpscaleJob("in.mkv", "in.mp4", "out.mp4")
+        job.thread_count = 4
+        changes = []
+
+        while True:
+            change = policy.degrade(job, 1000)
+            if (change is None):
+                break
+            changes.append(change)
+
+        self.assertEqual(changes, ["thread count 2", "thread count 1", f"segments of {OOM_SEGMENT_SECONDS}s", "segments of 60s", f"segments of {MIN_SEGMENT_SECONDS}s"])
+
+    def test_degrade_without_segments(self):
+        policy = FailurePolicy()
+        job = UpscaleJob("in.mkv", "in.mp4", "out.mp4")
+
+        #a piped source is upscaled whole
+        self.assertIsNone(policy.degrade(job, 1000, False))
+        #too short to segment
+        self.assertIsNone(policy.degrade(job, OOM_SEGMENT_SECONDS))
+
+    def test_quarantine_list(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            quarantine = QuarantineList(out_dir)
+            quarantine.add("in.mkv", CommandError(["ffmpeg"], 1, ["moov atom not found"]), FAILURE_PERMANENT, 1)
+            entries = quarantine.entries()
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual((entries[0]["failure"], entries[0]["attempts"], entries[0]["tail"]), (FAILURE_PERMANENT, 1, ["moov atom not found"]))
+
+
+class ValidateOutputTest(unittest.TestCase):
+
+    def test_matching_output(self):
+        validate_output(video_info(20, 480), video_info(20.02, 480), 480)
+
+    def test_duration_mismatch(self):
+        with self.assertRaises(OutputValidationError):
+            validate_output(video_info(20, 480), video_info(18, 432), 480)
+
+    def test_frame_mismatch(self):
+        with self.assertRaises(OutputValidationError):
+            validate_output(video_info(20, 480), video_info(20, 470), 480)
+
+    def test_estimated_count_is_not_checked(self):
+        #matroska has no frame count, it is estimated from the duration
+        validate_output(video_info(2.2), video_info(2, 48), 53)
+
+    def test_no_video(self):
+        with self.assertRaises(OutputValidationError):
+            validate_output(video_info(20, 480), MediaInfo({ "streams": [], "format": {} }))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+'''
+    Video Upscaler
+    Frame filter checks on synthetic frames, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import unittest
+from frame_pipeline import FrameFilters, FrameProcessor, np
+
+
+def column_frames(processor: FrameProcessor, count: int):
+    #every sample is its column number, so a crop shows in the values it keeps
+    processor.frames[:count] = np.arange(processor.width, dtype=np.uint8)
+    return count
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class FrameProcessorTest(unittest.TestCase):
+
+    def test_crop(self):
+        processor = FrameProcessor(FrameFilters(crop="64:32:8:4"), 96, 54, batch=2)
+        frames = processor.process(column_frames(processor, 2))
+
+        self.assertEqual(frames.shape, (2, 3, 32, 64))
+        self.assertEqual((frames[0, 0, 0, 0], frames[1, 2, 31, 63]), (8, 71))
+
+    def test_centred_crop(self):
+        processor = FrameProcessor(FrameFilters(crop="64:32"), 96, 54, batch=1)
+        frames = processor.process(column_frames(processor, 1))
+
+        self.assertEqual(frames.shape, (1, 3, 32, 64))
+        self.assertEqual(frames[0, 0, 0, 0], 16)
+
+    def test_resize(self):
+        processor = FrameProcessor(FrameFilters(resize="48x28"), 96, 54, batch=2)
+        processor.frames[:2] = 100
+        frames = processor.process(2)
+
+        self.assertEqual(frames.shape, (2, 3, 28, 48))
+        #a flat frame stays flat
+        self.assertTrue((frames == 100).all())
+
+    def test_crop_then_resize(self):
+        processor = FrameProcessor(FrameFilters(crop="64:32:8:4", resize="32x16"), 96, 54, batch=1)
+        frames = processor.process(column_frames(processor, 1))
+
+        self.assertEqual(frames.shape, (1, 3, 16, 32))
+        self.assertTrue(8 <= frames.min() and frames.max() <= 71)
+
+    def test_subsample(self):
+        processor = FrameProcessor(FrameFilters(crop="64:32:0:0"), 96, 54, batch=2)
+        processor.frames[:2] = np.tile(np.array([[10, 11], [12, 13]], dtype=np.uint8), (27, 48))
+        chroma = processor.subsample(processor.process(2))
+
+        self.assertEqual(chroma.shape, (2, 2, 16, 32))
+        #the rounded average of each 2x2 block
+        self.assertTrue((chroma == 12).all())
+
+    def test_deinterlace_and_denoise_keep_size(self):
+        processor = FrameProcessor(FrameFilters(deinterlace=True, denoise=4), 96, 54, batch=2)
+        processor.frames[0] = 100
+        processor.frames[1] = 102
+        frames = processor.process(2)
+
+        self.assertEqual(frames.shape, (2, 3, 54, 96))
+        #the second frame barely changed so it is averaged with the first
+        self.assertTrue((frames[1] == 101).all())
+
+    def test_odd_size_is_refused(self):
+        with self.assertRaises(ValueError):
+            FrameProcessor(FrameFilters(crop="63:32:0:0"), 96, 54)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+'''
+    Video Upscaler
+    Resume manifest checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import os
+import tempfile
+import unittest
+from job_manifest import JobManifest, STATUS_STARTED, STATUS_DONE, STATUS_FAILED, STATUS_QUARANTINED
+
+SETTINGS = { "model": "realesrgan", "scale": 2 }
+
+
+class JobManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.out_dir = self.temp.name
+        self.src_file = os.path.join(self.out_dir, "movie.mkv")
+        self.dst_file = os.path.join(self.out_dir, "movie.mp4")
+
+        with open(self.src_file, "wb") as f:
+            f.write(b"source")
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write_output(self):
+        with open(self.dst_file, "wb") as f:
+            f.write(b"output")
+
+    def test_new_source(self):
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (True, "new"))
+
+    def test_completed_is_skipped(self):
+        JobManifest(self.out_dir, SETTINGS).mark(self.src_file, self.dst_file, STATUS_DONE)
+        self.write_output()
+
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (False, "completed"))
+
+    def test_completed_without_output(self):
+        JobManifest(self.out_dir, SETTINGS).mark(self.src_file, self.dst_file, STATUS_DONE)
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (True, "output missing"))
+
+    def test_settings_change_reprocesses(self):
+        JobManifest(self.out_dir, SETTINGS).mark(self.src_file, self.dst_file, STATUS_DONE)
+        self.write_output()
+
+        manifest = JobManifest(self.out_dir, dict(SETTINGS, scale=4))
+        self.assertEqual(manifest.should_process(self.src_file, self.dst_file), (True, "settings changed"))
+
+    def test_settings_round_trip(self):
+        #tuples are saved as lists, the same settings must still match once loaded
+        settings = dict(SETTINGS, target=(1920, 1080))
+        JobManifest(self.out_dir, settings).mark(self.src_file, self.dst_file, STATUS_DONE)
+        self.write_output()
+
+        self.assertEqual(JobManifest(self.out_dir, settings).should_process(self.src_file, self.dst_file), (False, "completed"))
+
+    def test_source_change_reprocesses(self):
+        JobManifest(self.out_dir, SETTINGS).mark(self.src_file, self.dst_file, STATUS_DONE)
+        self.write_output()
+
+        with open(self.src_file, "ab") as f:
+            f.write(b" changed")
+
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (True, "source changed"))
+
+    def test_interrupted_and_failed_are_retried(self):
+        manifest = JobManifest(self.out_dir, SETTINGS)
+        manifest.mark(self.src_file, self.dst_file, STATUS_STARTED)
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (True, "resume interrupted"))
+
+        manifest.mark(self.src_file, self.dst_file, STATUS_FAILED, "stalled")
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (True, "retry failed"))
+
+    def test_quarantined_is_skipped(self):
+        JobManifest(self.out_dir, SETTINGS).mark(self.src_file, self.dst_file, STATUS_QUARANTINED, "moov atom not found")
+
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS).should_process(self.src_file, self.dst_file), (False, "quarantined, moov atom not found"))
+        self.assertEqual(JobManifest(self.out_dir, SETTINGS, retry_quarantined=True).should_process(self.src_file, self.dst_file), (True, "retry quarantined"))
+
+    def test_compaction_keeps_the_last_record(self):
+        manifest = JobManifest(self.out_dir, SETTINGS)
+        other_file = os.path.join(self.out_dir, "other.mkv")
+
+        with open(other_file, "wb") as f:
+            f.write(b"other")
+
+        manifest.mark(self.src_file, self.dst_file, STATUS_STARTED)
+        manifest.mark(other_file, self.dst_file, STATUS_STARTED)
+        manifest.mark(self.src_file, self.dst_file, STATUS_DONE)
+
+        #a line cut short by a crash is dropped
+        with open(manifest.path, "a", encoding="utf-8") as f:
+            f.write('{"src": "cut short')
+
+        with self.assertLogs("videoupscaler", "WARNING"):
+            JobManifest(self.out_dir, SETTINGS)
+
+        with open(manifest.path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual([(os.path.basename(record["src"]), record["status"]) for record in records], [("movie.mkv", STATUS_DONE), ("other.mkv", STATUS_STARTED)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+    Video Upscaler
+    Job cost estimate and queue ordering checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import json
+import os
+import tempfile
+import unittest
+from job_ordering import CostModel, PriorityRules, order_key, ORDER_WALK, ORDER_SJF, ORDER_PRIORITY, ORDER_DEADLINE, UNKNOWN_COST, DEFAULT_COST_FACTORS, MIN_SAMPLES, SIDECAR_SUFFIX
+from model_builder import ProcessorModelEnum
+from resolution_planner import ScalePlan, upscale_pass
+
+
+def plan(scale: int, width: int, height: int, model: ProcessorModelEnum = ProcessorModelEnum.realesrgan):
+    return ScalePlan([upscale_pass(model, "realesr-animevideov3", scale)], width, height)
+
+
+def upscale_record(model: str, seconds: float, frames: int = 100, out_pixels: int = 1000000):
+    return { "type": "stage", "stage": "upscale", "return_code": 0, "backend": "video2x", "model": model, "model_type": "realesr-animevideov3", "seconds": seconds, "frames": frames, "out_pixels": out_pixels }
+
+
+class CostModelTest(unittest.TestCase):
+
+    def test_cost_grows_with_frames_and_output_size(self):
+        model = CostModel()
+        small = model.estimate(plan(2, 640, 360), 1000, "video2x")
+
+        self.assertAlmostEqual(small, 1000 * 1280 * 720 / 1e6 * DEFAULT_COST_FACTORS["realesrgan"])
+        self.assertAlmostEqual(model.estimate(plan(2, 640, 360), 2000, "video2x"), small * 2)
+        self.assertAlmostEqual(model.estimate(plan(4, 640, 360), 1000, "video2x"), small * 4)
+
+    def test_unprobed_source_has_unknown_cost(self):
+        self.assertEqual(CostModel().estimate(plan(2, 0, 0), 0, "video2x"), UNKNOWN_COST)
+
+    def test_calibrated_from_metrics(self):
+        #one second per output megapixel frame on this host
+        records = [upscale_record("realesrgan", 100) for _ in range(MIN_SAMPLES)]
+        model = CostModel.from_metrics(records)
+
+        self.assertEqual(model.factor("video2x", "realesrgan", "realesr-animevideov3"), 1.0)
+        #models not recorded are scaled by how much slower this host is than the defaults
+        self.assertAlmostEqual(model.factor("video2x", "realcugan", "models-se"), DEFAULT_COST_FACTORS["realcugan"] / DEFAULT_COST_FACTORS["realesrgan"])
+
+    def test_too_few_samples_keep_the_default(self):
+        model = CostModel.from_metrics([upscale_record("realesrgan", 100)] * (MIN_SAMPLES - 1))
+        self.assertEqual(model.factor("video2x", "realesrgan", "realesr-animevideov3"), DEFAULT_COST_FACTORS["realesrgan"])
+
+
+class OrderKeyTest(unittest.TestCase):
+
+    def ordered(self, order: str, jobs: dict):
+        #job name -> (cost, priority, deadline), sorted the way the queue takes them
+        return sorted(jobs, key=lambda name: order_key(order, *jobs[name]))
+
+    def test_walk_keeps_the_queued_order(self):
+        self.assertEqual(order_key(ORDER_WALK, 10), order_key(ORDER_WALK, 1))
+
+    def test_shortest_first(self):
+        jobs = { "long": (300, 0, None), "short": (10, 0, None), "unknown": (UNKNOWN_COST, 0, None) }
+        self.assertEqual(self.ordered(ORDER_SJF, jobs), ["short", "long", "unknown"])
+
+    def test_priority_then_cost(self):
+        jobs = { "low": (10, 0, None), "high_long": (300, 5, None), "high_short": (20, 5, None) }
+        self.assertEqual(self.ordered(ORDER_PRIORITY, jobs), ["high_short", "high_long", "low"])
+
+    def test_least_slack_first(self):
+        #due last but takes longest, so it has to start first
+        jobs = { "soon": (10, 0, 1000), "later_long": (500, 0, 1200), "none": (1, 0, None) }
+        self.assertEqual(self.ordered(ORDER_DEADLINE, jobs), ["later_long", "soon", "none"])
+
+
+class PriorityRulesTest(unittest.TestCase):
+
+    def test_first_matching_rule_and_sidecar(self):
+        rules = PriorityRules([
+            { "pattern": "urgent/*", "priority": 10, "deadline": "2030-01-01T00:00:00+00:00" },
+            { "pattern": "*.mkv", "priority": 1 }
+            ])
+
+        with tempfile.TemporaryDirectory() as src_dir:
+            os.makedirs(os.path.join(src_dir, "urgent"))
+            urgent = os.path.join(src_dir, "urgent", "a.mkv")
+            other = os.path.join(src_dir, "b.mkv")
+
+            self.assertEqual(rules.lookup(urgent, src_dir), (10, 1893456000.0))
+            self.assertEqual(rules.lookup(other, src_dir), (1, None))
+            self.assertEqual(rules.lookup(os.path.join(src_dir, "c.mp4"), src_dir), (0, None))
+
+            #the sidecar wins over the rules
+            with open(other + SIDECAR_SUFFIX, "w", encoding="utf-8") as f:
+                json.dump({ "priority": 7 }, f)
+
+            self.assertEqual(rules.lookup(other, src_dir), (7, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+'''
+    Video Upscaler
+    Job queue order and stage limit checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import unittest
+from job_scheduler import JobScheduler, UpscaleJob
+
+
+def make_job(name: str, sort_key: tuple = (0,)):
+    job = UpscaleJob(name, name, name + ".mp4")
+    job.sort_key = sort_key
+    return job
+
+
+class StageCounter:
+    #the most handlers inside a stage at once
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def run(self, limit, seconds: float = 0.01):
+        async with limit:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            await asyncio.sleep(seconds)
+            self.active -= 1
+
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def test_sort_key_order(self):
+        scheduler = JobScheduler(1, 1)
+        started = []
+
+        async def handler(job):
+            started.append(job.src_file)
+
+        jobs = [make_job("c", (3,)), make_job("a", (1,)), make_job("b1", (2,)), make_job("b2", (2,))]
+        asyncio.run(scheduler.run(jobs, handler))
+
+        #equal keys run in the order they were queued
+        self.assertEqual(started, ["a", "b1", "b2", "c"])
+
+    def test_worker_per_slot(self):
+        scheduler = JobScheduler(2, 3)
+        self.assertEqual(scheduler.worker_count, 5)
+
+    def test_stage_limits(self):
+        scheduler = JobScheduler(2, 1)
+        upscale = StageCounter()
+        transcode = StageCounter()
+
+        async def handler(job):
+            await transcode.run(scheduler.transcode)
+            await upscale.run(scheduler.upscale, 0.03)
+            await transcode.run(scheduler.transcode)
+
+        asyncio.run(scheduler.run([make_job(str(index)) for index in range(8)], handler))
+
+        self.assertEqual((upscale.peak, transcode.peak), (2, 1))
+
+    def test_lowered_limit(self):
+        scheduler = JobScheduler(3, 1)
+        upscale = StageCounter()
+
+        async def handler(job):
+            await upscale.run(scheduler.upscale)
+
+        async def run():
+            await scheduler.upscale.set_limit(1)
+            await scheduler.run([make_job(str(index)) for index in range(6)], handler)
+
+        asyncio.run(run())
+        self.assertEqual(upscale.peak, 1)
+
+    def test_failed_job_does_not_stop_the_batch(self):
+        scheduler = JobScheduler(1, 1)
+        done = []
+
+        async def handler(job):
+            if (job.src_file == "bad"):
+                raise RuntimeError("bad file")
+            done.append(job.src_file)
+
+        with self.assertLogs("videoupscaler", "ERROR"):
+            asyncio.run(scheduler.run([make_job("bad", (0,)), make_job("good", (1,))], handler))
+
+        self.assertEqual(done, ["good"])
+
+    def test_retry_queued_later_is_waited_for(self):
+        scheduler = JobScheduler(1, 1)
+        started = []
+
+        async def handler(job):
+            started.append(job.src_file)
+            if (len(started) == 1):
+                scheduler.submit_later(job, 0.05)
+
+        asyncio.run(scheduler.run([make_job("a")], handler))
+        self.assertEqual(started, ["a", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
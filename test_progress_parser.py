@@ -0,0 +1,49 @@
+'''
+    Video Upscaler
+    Progress line parsing checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import sys
+import unittest
+from progress_parser import ProgressParser
+from process_runner import CommandError, run_process
+
+
+class ProgressParserTest(unittest.TestCase):
+
+    def test_ffmpeg_stats(self):
+        events, lines = ProgressParser(480).feed(b"frame=  120 fps= 24 q=28.0 size=256kB time=00:00:05.00 speed=1.5x\r")
+        self.assertEqual([event.frame for event in events], [120])
+        self.assertEqual(events[0].speed, 1.5)
+        self.assertEqual(lines, [])
+
+    def test_ffmpeg_progress_lines(self):
+        events, lines = ProgressParser(480).feed(b"frame=12\nfps=6.00\nspeed=0.25x\nprogress=continue\n")
+        self.assertEqual([event.frame for event in events], [12])
+        self.assertEqual(lines, [])
+
+    def test_video2x_progress(self):
+        events, lines = ProgressParser().feed(b"[info] Processing frame 12/480 (2.50%); time elapsed: 00:00:05; time remaining: 00:03:10\n")
+        self.assertEqual((events[0].frame, events[0].total_frames, events[0].eta), (12, 480, 190))
+        self.assertEqual(lines, [])
+
+    def test_error_mentioning_frame_is_output(self):
+        events, lines = ProgressParser().feed(b"Error: missing frame 12 in stream\nframe: 3 could not be decoded\n")
+        self.assertEqual(events, [])
+        self.assertEqual(lines, ["Error: missing frame 12 in stream", "frame: 3 could not be decoded"])
+
+    def test_error_mentioning_frame_stays_in_tail(self):
+        cmd = [sys.executable, "-c", "import sys; sys.stderr.write('frame=1 fps=1\\nError: missing frame 12 in stream\\n'); sys.exit(1)"]
+
+        with self.assertRaises(CommandError) as raised:
+            asyncio.run(run_process(cmd, None))
+
+        #tail lines are prefixed with the process name
+        self.assertTrue(raised.exception.tail[-1].endswith(": Error: missing frame 12 in stream"))
+        self.assertNotIn("frame=1", " ".join(raised.exception.tail))
+
+
+if __name__ == "__main__":
+    unittest.main()
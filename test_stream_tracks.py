@@ -0,0 +1,76 @@
+'''
+    Video Upscaler
+    Audio and subtitle track copy or transcode checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import unittest
+from encoder_profiles import EncoderProfile, AUDIO_COPY, AUDIO_COPY_COMPATIBLE, AUDIO_TRANSCODE
+from media_probe import MediaInfo
+from stream_tracks import plan_tracks, transcode_args, mux_args, TRACK_COPY, TRACK_TRANSCODE, TRACK_DROP
+
+
+def media(audio: list = (), subtitles: list = ()):
+    streams = [{ "codec_type": "video", "codec_name": "h264" }]
+    streams += [{ "codec_type": "audio", "codec_name": codec } for codec in audio]
+    streams += [{ "codec_type": "subtitle", "codec_name": codec } for codec in subtitles]
+    return MediaInfo({ "streams": streams, "format": {} })
+
+
+def profile(audio: str = AUDIO_COPY_COMPATIBLE, audio_copy_codecs: list = None):
+    return EncoderProfile("test", "libx264", audio=audio, audio_copy_codecs=audio_copy_codecs, audio_bitrate="160k")
+
+
+def actions(tracks: list):
+    return [(track.spec, track.action) for track in tracks]
+
+
+class PlanTracksTest(unittest.TestCase):
+
+    def test_compatible_audio_is_copied(self):
+        tracks = plan_tracks(media(["aac", "ac3"]), profile(audio_copy_codecs=["aac"]))
+        self.assertEqual(actions(tracks), [("a:0", TRACK_COPY), ("a:1", TRACK_TRANSCODE)])
+
+    def test_copy_policy_still_transcodes_what_mp4_can_not_hold(self):
+        tracks = plan_tracks(media(["ac3", "truehd", "pcm_s16le"]), profile(AUDIO_COPY))
+        self.assertEqual(actions(tracks), [("a:0", TRACK_COPY), ("a:1", TRACK_TRANSCODE), ("a:2", TRACK_TRANSCODE)])
+
+    def test_transcode_policy(self):
+        tracks = plan_tracks(media(["aac"]), profile(AUDIO_TRANSCODE))
+        self.assertEqual(actions(tracks), [("a:0", TRACK_TRANSCODE)])
+
+    def test_subtitles(self):
+        with self.assertLogs("videoupscaler", "WARNING"):
+            tracks = plan_tracks(media(subtitles=["mov_text", "subrip", "hdmv_pgs_subtitle"]), profile())
+
+        self.assertEqual(actions(tracks), [("s:0", TRACK_COPY), ("s:1", TRACK_TRANSCODE), ("s:2", TRACK_DROP)])
+
+    def test_unprobed_source_copies_any_audio(self):
+        self.assertEqual(actions(plan_tracks(None, profile())), [("a?", TRACK_COPY)])
+
+
+class TrackArgsTest(unittest.TestCase):
+
+    def test_nothing_to_transcode(self):
+        self.assertIsNone(transcode_args("in.mkv", plan_tracks(media(["aac"]), profile()), profile(), "tracks.mkv"))
+
+    def test_transcode_args(self):
+        tracks = plan_tracks(media(["aac", "dts"], ["subrip"]), profile())
+        args = transcode_args("in.mkv", tracks, profile(), "tracks.mkv")
+
+        self.assertEqual(args, ['-i', 'in.mkv', '-map', '0:a:1', '-c:a:0', 'aac', '-b:a:0', '160k', '-map', '0:s:0', '-c:s:0', 'mov_text', '-vn', '-y', 'tracks.mkv'])
+
+    def test_mux_keeps_the_source_order(self):
+        with self.assertLogs("videoupscaler", "WARNING"):
+            tracks = plan_tracks(media(["aac", "dts", "aac"], ["hdmv_pgs_subtitle", "subrip"]), profile())
+
+        args = mux_args("video.mp4", "in.mkv", tracks, "tracks.mkv", "out.mp4", ['-c:v', 'copy'])
+        maps = [args[index + 1] for index, arg in enumerate(args) if arg == '-map']
+
+        #copied tracks come from the source, transcoded ones from the tracks file, the pgs track is dropped
+        self.assertEqual(maps, ['0:v:0', '1:a:0', '2:a:0', '1:a:2', '2:s:0'])
+        self.assertEqual(args[:6], ['-i', 'video.mp4', '-i', 'in.mkv', '-i', 'tracks.mkv'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+'''
+    Video Upscaler
+    Segment split and concat checks, run with python -m unittest
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from upscale_backends import FAKE_VIDEO2X
+from video_segments import VideoSegment, plan_segments, extract_segment_args, write_concat_list, concat_args
+
+FFMPEG_BIN = shutil.which("ffmpeg")
+
+
+class PlanSegmentsTest(unittest.TestCase):
+
+    def test_cut_at_keyframes_in_order(self):
+        segments = plan_segments([0.0, 1.0, 2.0, 3.0, 4.0, 5.0], 6.0, 2.0)
+
+        self.assertEqual([segment.index for segment in segments], [0, 1, 2])
+        self.assertEqual([(segment.start, segment.end) for segment in segments], [(0.0, 2.0), (2.0, 4.0), (4.0, 6.0)])
+
+    def test_cut_waits_for_the_next_keyframe(self):
+        #no keyframe on the boundary, the cut is at the first one after it
+        segments = plan_segments([0.0, 2.5, 5.0, 7.5], 9.0, 4.0)
+        self.assertEqual([(segment.start, segment.end) for segment in segments], [(0.0, 5.0), (5.0, 9.0)])
+
+    def test_keyframe_at_the_end_is_not_a_cut(self):
+        segments = plan_segments([0.0, 2.0, 4.0], 4.0, 2.0)
+        self.assertEqual([(segment.start, segment.end) for segment in segments], [(0.0, 2.0), (2.0, 4.0)])
+
+    def test_short_file_is_one_segment(self):
+        segments = plan_segments([0.0, 1.0], 1.5, 2.0)
+        self.assertEqual([(segment.start, segment.end) for segment in segments], [(0.0, 1.5)])
+
+    def test_overlap_on_all_but_the_last(self):
+        segments = plan_segments([0.0, 2.0, 4.0], 6.0, 2.0, 0.5)
+        self.assertEqual([segment.overlap for segment in segments], [0.5, 0.5, 0.0])
+
+
+class SegmentArgsTest(unittest.TestCase):
+
+    def test_extract_includes_the_overlap(self):
+        args = extract_segment_args("in.mkv", VideoSegment(1, 2.0, 4.0, 0.5), "out.mkv")
+
+        self.assertEqual(args[args.index('-ss') + 1], "2.000000")
+        self.assertEqual(args[args.index('-t') + 1], "2.500000")
+        self.assertEqual((args[args.index('-i') + 1], args[-1]), ("in.mkv", "out.mkv"))
+
+    def test_concat_list_trims_the_overlap(self):
+        segments = plan_segments([0.0, 2.0, 4.0], 5.0, 2.0, 0.5)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for segment in segments:
+                segment.out_file = os.path.join(temp_dir, f"segment_{segment.index}.mp4")
+
+            #a quote in the path is escaped for the concat demuxer
+            segments[1].out_file = os.path.join(temp_dir, "it's.mp4")
+
+            with open(write_concat_list(segments, os.path.join(temp_dir, "segments.txt")), "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+
+        path = os.path.abspath(temp_dir).replace("\\", "/")
+        self.assertEqual(lines, [
+            f"file '{path}/segment_0.mp4'",
+            "outpoint 2.000000",
+            f"file '{path}/it'\\''s.mp4'",
+            "outpoint 2.000000",
+            f"file '{path}/segment_2.mp4'"
+            ])
+
+    def test_concat_args(self):
+        self.assertEqual(concat_args("segments.txt", "out.mp4"), ['-f', 'concat', '-safe', '0', '-i', 'segments.txt', '-c', 'copy', '-y', 'out.mp4'])
+
+
+def count_frames(path: str):
+    result = subprocess.run([FFMPEG_BIN, '-hide_banner', '-i', path, '-map', '0:v:0', '-f', 'null', '-'], capture_output=True, text=True, check=True)
+    return int(re.findall(r"frame=\s*(\d+)", result.stderr)[-1])
+
+
+@unittest.skipIf(FFMPEG_BIN is None, "ffmpeg is not installed")
+class SegmentPipelineTest(unittest.TestCase):
+    '''
+        Splits a clip with a keyframe every second, doubles the frame rate of each segment with
+        fake_video2x.py the way frame interpolation does, and joins them again.
+    '''
+
+    FPS = 24
+    SECONDS = 5
+
+    def run_ffmpeg(self, args: list):
+        subprocess.run([FFMPEG_BIN, '-v', 'error'] + args, check=True)
+
+    def test_split_interpolate_and_join(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src_file = os.path.join(temp_dir, "src.mkv")
+            self.run_ffmpeg(['-f', 'lavfi', '-i', f"testsrc=size=64x36:rate={self.FPS}:duration={self.SECONDS}", '-c:v', 'libx264', '-g', str(self.FPS), '-keyint_min', str(self.FPS), '-sc_threshold', '0', '-y', src_file])
+
+            #one frame of overlap like the interpolated segments get
+            segments = plan_segments([float(second) for second in range(self.SECONDS)], self.SECONDS, 2.0, 1 / self.FPS)
+            self.assertEqual(len(segments), 3)
+
+            for segment in segments:
+                segment.src_file = os.path.join(temp_dir, f"segment_{segment.index}.mkv")
+                segment.out_file = os.path.join(temp_dir, f"segment_{segment.index}_scaled.mp4")
+                self.run_ffmpeg(extract_segment_args(src_file, segment, segment.src_file))
+                #mpeg4 has no reordered frames, so the outpoint cuts on the exact frame
+                subprocess.run([sys.executable, FAKE_VIDEO2X, '-i', segment.src_file, '-o', segment.out_file, '-c', 'mpeg4', '-s', '2', '-m', '2'], check=True, capture_output=True)
+
+            out_file = os.path.join(temp_dir, "joined.mp4")
+            self.run_ffmpeg(concat_args(write_concat_list(segments, os.path.join(temp_dir, "segments.txt")), out_file))
+
+            #the keyframe before each cut and the overlap are trimmed off, so no frame is repeated at the seams
+            self.assertEqual(count_frames(out_file), self.SECONDS * self.FPS * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
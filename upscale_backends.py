@@ -0,0 +1,216 @@
+'''
+    Video Upscaler
+    Upscale backends building the command for a single upscale pass
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import os
+import sys
+from model_builder import ProcessorModelEnum, modeltypesmap
+from encoder_profiles import EncoderProfile
+
+BACKEND_VIDEO2X = "video2x"
+BACKEND_FFMPEG = "ffmpeg"
+BACKEND_STUB = "stub"
+BACKENDS = [BACKEND_VIDEO2X, BACKEND_FFMPEG, BACKEND_STUB]
+
+FAKE_VIDEO2X = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_video2x.py")
+
+
+class UpscaleBackend:
+    '''
+        Builds the argv for one upscale pass and reports what the backend can do.
+        Subclasses provide the command for their tool.
+    '''
+
+    name = None
+    default_profile = None
+    gpu = False
+    frame_interpolation = False
+    max_scale = 4
+
+    def __init__(self, binary):
+        self.binary = binary
+
+    def command_prefix(self):
+        return list(self.binary) if isinstance(self.binary, (list, tuple)) else [self.binary]
+
+    def max_model_scale(self, model: ProcessorModelEnum, model_type: str):
+        for item in modeltypesmap.get(model, {}).values():
+            if (item["type"] == model_type):
+                return min(item.get("max_scale", self.max_scale), self.max_scale)
+
+        return self.max_scale
+
+    def supports(self, model: ProcessorModelEnum, model_type: str = None):
+        if (model not in modeltypesmap):
+            return False
+
+        if (model == ProcessorModelEnum.rife and not self.frame_interpolation):
+            return False
+
+        return model_type is None or any(item["type"] == model_type for item in modeltypesmap[model].values())
+
+    def capabilities(self):
+        models = {}
+
+        for model, types in modeltypesmap.items():
+            if (self.supports(model)):
+                models[model.name] = { item["type"]: self.max_model_scale(model, item["type"]) for item in types.values() }
+
+        return {
+            "backend": self.name,
+            "gpu": self.gpu,
+            "frame_interpolation": self.frame_interpolation,
+            "max_scale": self.max_scale,
+            "models": models
+        }
+
+    def encoder_args(self, profile: EncoderProfile, lossless: bool = False, codec: str = None):
+        return []
+
+    def build_command(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, noise_level: int, frame_rate_mul: int, thread_count: int, no_audio: bool = False, lossless: bool = False, codec: str = None, profile: EncoderProfile = None):
+        raise NotImplementedError()
+
+
+class Video2xBackend(UpscaleBackend):
+
+    name = BACKEND_VIDEO2X
+    default_profile = "nvenc-hq"
+    gpu = True
+    frame_interpolation = True
+
+    def model_args(self, model: ProcessorModelEnum, model_type: str):
+        model_arg = ""
+        cmd = []
+        if (model == ProcessorModelEnum.realesrgan):
+            model_arg = "--realesrgan-model"
+        elif (model == ProcessorModelEnum.libplacebo):
+            model_arg = "libplacebo-shader"
+        elif (model == ProcessorModelEnum.realcugan):
+            model_arg = "--realcugan-model"
+        elif (model == ProcessorModelEnum.rife):
+            model_arg = "--rife-model"
+            cmd += ["--rife-uhd"]
+
+        cmd += ["-p", model.name, model_arg, model_type]
+        return cmd
+
+    def scale_noise_args(self, scale: int, width: int, height: int, noise_level: int, frame_rate_mul: int):
+        cmd = []
+        if (width > 0):
+            cmd += ["-w", str(width), "-h", str(height)]
+        else:
+            cmd += ["-s", str(scale)]
+
+        if (noise_level >= 0):
+            cmd += ['-n', str(noise_level)]
+
+        if (frame_rate_mul > 0):
+            cmd += ['-m', str(frame_rate_mul)]
+
+        return cmd
+
+    def encoder_args(self, profile: EncoderProfile, lossless: bool = False, codec: str = None):
+        #intermediate pipe codec for chained passes, the profile encoder options do not apply
+        if (codec):
+            return ['-c', codec]
+
+        cmd = ['-c', profile.encoder]
+
+        for key, value in profile.encoder_options(lossless).items():
+            cmd += ['-e', f"{key}={value}"]
+
+        return cmd
+
+    def build_command(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, noise_level: int, frame_rate_mul: int, thread_count: int, no_audio: bool = False, lossless: bool = False, codec: str = None, profile: EncoderProfile = None):
+        cmd = self.command_prefix() + [
+            '-i',
+            src_file
+            ]
+
+        if (no_audio):
+            cmd += ['--no-copy-streams']
+
+        cmd += self.model_args(model, model_type)
+        cmd += self.scale_noise_args(scale, width, height, noise_level, frame_rate_mul)
+        cmd += ['--thread-count', str(thread_count)]
+        cmd += self.encoder_args(profile, lossless, codec)
+        cmd += ['-o', out_file]
+        return cmd
+
+
+class FfmpegBackend(UpscaleBackend):
+    '''
+        CPU only backend. There are no AI models in plain ffmpeg so every model is a lanczos
+        scale and frame interpolation repeats frames and blends neighbours with tmix.
+    '''
+
+    name = BACKEND_FFMPEG
+    default_profile = "x265"
+    frame_interpolation = True
+    max_scale = 8
+
+    def encoder_args(self, profile: EncoderProfile, lossless: bool = False, codec: str = None):
+        if (codec):
+            return ['-c:v', codec]
+
+        return profile.ffmpeg_args(lossless)
+
+    def filter_args(self, scale: int, width: int, height: int, frame_rate_mul: int):
+        filters = []
+
+        if (width > 0 and height > 0):
+            filters.append(f"scale={width}:{height}:flags=lanczos")
+        elif (scale > 1):
+            filters.append(f"scale=iw*{scale}:ih*{scale}:flags=lanczos")
+
+        if (frame_rate_mul > 1):
+            filters.append(f"fps=source_fps*{frame_rate_mul},tmix=frames={frame_rate_mul}")
+
+        return ['-vf', ",".join(filters)] if filters else []
+
+    def build_command(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, noise_level: int, frame_rate_mul: int, thread_count: int, no_audio: bool = False, lossless: bool = False, codec: str = None, profile: EncoderProfile = None):
+        cmd = self.command_prefix() + [
+            '-i',
+            src_file,
+            '-map',
+            '0:v:0'
+            ]
+
+        if (not no_audio):
+            cmd += ['-map', '0:a?', '-c:a', 'copy']
+
+        cmd += self.filter_args(scale, width, height, frame_rate_mul)
+        cmd += self.encoder_args(profile, lossless, codec)
+        cmd += [
+            '-progress',
+            'pipe:1',
+            '-y',
+            out_file
+            ]
+        return cmd
+
+
+class StubBackend(Video2xBackend):
+    '''
+        Runs fake_video2x.py in passthrough mode, the output is a copy of the input.
+        Used to run and benchmark the orchestration without a GPU or a real upscale.
+    '''
+
+    name = BACKEND_STUB
+    gpu = False
+
+    def __init__(self, binary = None):
+        super().__init__(binary if binary else [sys.executable, FAKE_VIDEO2X, '--passthrough'])
+
+
+def create_backend(name: str, video2x_bin, ffmpeg_bin):
+    if (name == BACKEND_VIDEO2X):
+        return Video2xBackend(video2x_bin)
+    elif (name == BACKEND_FFMPEG):
+        return FfmpegBackend(ffmpeg_bin)
+    elif (name == BACKEND_STUB):
+        return StubBackend()
+
+    raise ValueError(f"Unknown backend {name}, must be one of {BACKENDS}")
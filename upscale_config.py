@@ -0,0 +1,268 @@
+'''
+    Video Upscaler
+    Typed upscaler settings validated against the model map, for building the upscaler from code rather than the command line
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import dataclasses
+from dataclasses import dataclass
+from model_builder import ProcessorModelEnum, modeltypesmap, multi_models_typemap
+from upscale_backends import BACKENDS, BACKEND_VIDEO2X
+from resolution_planner import target_box
+from job_ordering import ORDERS, ORDER_WALK
+from frame_pipeline import FrameFilters
+from autotune import AUTOTUNE_THREAD_COUNTS, AUTOTUNE_WORKERS, parse_counts
+
+PRE_PROCESS_AUTO = "auto"
+PRE_PROCESS_NONE = "none"
+PRE_PROCESS_REMUX = "remux"
+PRE_PROCESS_PIPE = "pipe"
+PRE_PROCESS_TRANSCODE = "transcode"
+#decoded frames filtered in process and streamed to the upscaler
+PRE_PROCESS_FRAMES = "frames"
+PRE_PROCESS_MODES = [PRE_PROCESS_AUTO, PRE_PROCESS_NONE, PRE_PROCESS_REMUX, PRE_PROCESS_PIPE, PRE_PROCESS_TRANSCODE, PRE_PROCESS_FRAMES]
+
+
+def parse_model(value):
+    #a ProcessorModelEnum, its name or its number as -m takes them
+    if (isinstance(value, ProcessorModelEnum)):
+        return value
+
+    if (isinstance(value, str) and not value.isdigit()):
+        if (value not in ProcessorModelEnum.__members__):
+            raise ValueError(f"Unknown model {value}, must be one of {list(ProcessorModelEnum.__members__)}")
+        return ProcessorModelEnum[value]
+
+    try:
+        return ProcessorModelEnum(int(value))
+    except ValueError:
+        raise ValueError(f"Unknown model {value}, must be one of {[model.value for model in ProcessorModelEnum]}") from None
+
+
+def model_settings(model: ProcessorModelEnum, model_type: int, scale: int, noise_level: int, frame_rate_mul: int):
+    '''
+        The scale, noise level and frame rate multiplier a model type actually runs with, the scale and
+        noise level are clamped to what the type supports and RIFE always interpolates. Chains keep the settings.
+    '''
+    if (model in multi_models_typemap):
+        return scale, noise_level, frame_rate_mul
+
+    model_item = modeltypesmap[model][model_type]
+
+    if ("max_scale" in model_item and scale > model_item["max_scale"]):
+        scale = model_item["max_scale"]
+
+    if ("min_scale" in model_item and scale < model_item["min_scale"]):
+        scale = model_item["min_scale"]
+
+    if ("max_noise_level" in model_item and noise_level > model_item["max_noise_level"]):
+        noise_level = model_item["max_noise_level"]
+
+    if (model == ProcessorModelEnum.rife and frame_rate_mul == 0):
+        frame_rate_mul = 2
+
+    return scale, noise_level, frame_rate_mul
+
+
+def check_model(model: ProcessorModelEnum, model_type: int):
+    if (model in multi_models_typemap):
+        return
+
+    if (model not in modeltypesmap):
+        raise ValueError(f"Unknown model {model}")
+
+    if (model_type not in modeltypesmap[model]):
+        types = ", ".join(f"{index} ({item["type"]})" for index, item in modeltypesmap[model].items())
+        raise ValueError(f"Unknown type {model_type} for {model.name}, must be one of {types}")
+
+
+@dataclass
+class UpscaleConfig:
+    '''
+        Every setting of VideoUpscaler, the fields are its constructor arguments and the defaults are those
+        of the command line. Validated on creation, effective() gives the scale and noise level clamped for the model type.
+    '''
+
+    src_dir: str
+    out_dir: str
+    model: ProcessorModelEnum = ProcessorModelEnum.realesrgan
+    model_type: int = 1
+    scale: int = 4
+    noise_level: int = 3
+    isHD: bool = False
+    is4K: bool = False
+    thread_count: int = 1
+    max_height: int = 0
+    frame_rate_mul: int = 0
+    upscale_workers: int = 1
+    transcode_workers: int = 1
+    resume: bool = True
+    pre_process_mode: str = PRE_PROCESS_AUTO
+    chain_pipe: bool = False
+    chain_codec: str = "ffv1"
+    cache_dir: str = None
+    segment_seconds: float = 0
+    video2x_bin: str = None
+    backend: str = BACKEND_VIDEO2X
+    profile: str = None
+    pre_process_profile: str = "x265"
+    profiles_file: str = None
+    metrics_file: str = None
+    watch: bool = False
+    settle_seconds: float = 5.0
+    watch_interval: float = 2.0
+    watch_poll: bool = False
+    work_queue: str = None
+    worker_id: str = None
+    lease_seconds: float = 120
+    scratch_dir: str = None
+    scratch_min_free: float = 1.0
+    dedup_frames: bool = False
+    target: str = None
+    max_passes: int = 2
+    stall_timeout: float = 0
+    max_attempts: int = 3
+    retry_backoff: float = 30
+    validate: bool = True
+    retry_quarantined: bool = False
+    order: str = ORDER_WALK
+    priority_rules: str = None
+    estimate: bool = False
+    estimate_hours: float = 0
+    dry_run: bool = False
+    result_cache_gb: float = 0
+    result_cache_dir: str = None
+    crop: str = None
+    pre_resize: str = None
+    deinterlace: bool = False
+    denoise: int = 0
+    auto_crop: bool = False
+    auto_crop_pad: bool = False
+    autotune: bool = False
+    autotune_threads: str = AUTOTUNE_THREAD_COUNTS
+    autotune_workers: str = AUTOTUNE_WORKERS
+    governor_min_free: float = 0
+    governor_max_load: float = 0
+    governor_interval: float = 5.0
+
+    def __post_init__(self):
+        self.model = parse_model(self.model)
+        self.model_type = int(self.model_type)
+        self.validate_settings()
+
+    def validate_settings(self):
+        #raises ValueError naming the first setting that can not run
+        check_model(self.model, self.model_type)
+
+        for name in ("scale", "transcode_workers", "max_passes", "max_attempts"):
+            if (getattr(self, name) < 1):
+                raise ValueError(f"{name} must be at least 1, got {getattr(self, name)}")
+
+        #0 is the calibrated count
+        for name in ("max_height", "frame_rate_mul", "segment_seconds", "stall_timeout", "retry_backoff", "estimate_hours", "scratch_min_free", "settle_seconds", "result_cache_gb", "thread_count", "upscale_workers", "governor_min_free", "governor_max_load"):
+            if (getattr(self, name) < 0):
+                raise ValueError(f"{name} can not be negative, got {getattr(self, name)}")
+
+        if (self.noise_level < -1):
+            raise ValueError(f"noise_level must be -1 or more, got {self.noise_level}")
+
+        if (self.governor_min_free >= 100):
+            raise ValueError(f"governor_min_free is a percentage of memory below 100, got {self.governor_min_free}")
+
+        if (self.governor_interval <= 0):
+            raise ValueError(f"governor_interval must be more than 0, got {self.governor_interval}")
+
+        if (self.isHD and self.is4K):
+            raise ValueError("isHD and is4K can not both be set")
+
+        if (self.pre_process_mode not in PRE_PROCESS_MODES):
+            raise ValueError(f"Unknown pre process mode {self.pre_process_mode}, must be one of {PRE_PROCESS_MODES}")
+
+        if (self.backend not in BACKENDS):
+            raise ValueError(f"Unknown backend {self.backend}, must be one of {BACKENDS}")
+
+        if (self.order not in ORDERS):
+            raise ValueError(f"Unknown order {self.order}, must be one of {ORDERS}")
+
+        #raises for a target that does not parse
+        target_box(self.target, self.isHD, self.is4K)
+
+        #raises for a crop, resize or denoise that does not parse
+        FrameFilters(self.crop, self.pre_resize, self.deinterlace, self.denoise)
+
+        parse_counts(self.autotune_threads)
+        parse_counts(self.autotune_workers)
+
+    def effective(self):
+        scale, noise_level, frame_rate_mul = model_settings(self.model, self.model_type, self.scale, self.noise_level, self.frame_rate_mul)
+        return dataclasses.replace(self, scale=scale, noise_level=noise_level, frame_rate_mul=frame_rate_mul)
+
+    def kwargs(self):
+        return { field.name: getattr(self, field.name) for field in dataclasses.fields(self) }
+
+    @staticmethod
+    def from_args(args):
+        #from the argparse namespace of video_upscaler.py
+        return UpscaleConfig(
+            src_dir=args.input,
+            out_dir=args.output,
+            model=args.model,
+            model_type=args.model_type,
+            scale=args.scale,
+            noise_level=args.noise_level,
+            isHD=args.hd,
+            is4K=args.fourk,
+            thread_count=args.tc,
+            max_height=args.mh,
+            frame_rate_mul=args.frame_rate_mul,
+            upscale_workers=args.upscale_workers,
+            transcode_workers=args.transcode_workers,
+            resume=not args.no_resume,
+            pre_process_mode=args.pre_process,
+            chain_pipe=args.chain_pipe,
+            chain_codec=args.chain_codec,
+            cache_dir=args.cache_dir,
+            segment_seconds=args.segment_seconds,
+            video2x_bin=args.video2x_bin,
+            backend=args.backend,
+            profile=args.profile,
+            pre_process_profile=args.pre_process_profile,
+            profiles_file=args.profiles_file,
+            metrics_file=args.metrics,
+            watch=args.watch,
+            settle_seconds=args.settle_seconds,
+            watch_interval=args.watch_interval,
+            watch_poll=args.watch_poll,
+            work_queue=args.work_queue,
+            worker_id=args.worker_id,
+            lease_seconds=args.lease_seconds,
+            scratch_dir=args.scratch_dir,
+            scratch_min_free=args.scratch_min_free,
+            dedup_frames=args.dedup_frames,
+            target=args.target,
+            max_passes=args.max_passes,
+            stall_timeout=args.stall_timeout,
+            max_attempts=args.max_attempts,
+            retry_backoff=args.retry_backoff,
+            validate=not args.no_validate,
+            retry_quarantined=args.retry_quarantined,
+            order=args.order,
+            priority_rules=args.priority_rules,
+            estimate=args.estimate,
+            estimate_hours=args.estimate_hours,
+            dry_run=args.dry_run,
+            result_cache_gb=args.result_cache_gb,
+            result_cache_dir=args.result_cache_dir,
+            crop=args.crop,
+            pre_resize=args.pre_resize,
+            deinterlace=args.deinterlace,
+            denoise=args.denoise,
+            auto_crop=args.auto_crop,
+            auto_crop_pad=args.auto_crop_pad,
+            autotune=args.autotune,
+            autotune_threads=args.autotune_threads,
+            autotune_workers=args.autotune_workers,
+            governor_min_free=args.governor_min_free,
+            governor_max_load=args.governor_max_load,
+            governor_interval=args.governor_interval
+        )
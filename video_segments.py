@@ -0,0 +1,141 @@
+'''
+    Video Upscaler
+    Splitting a video into keyframe aligned segments and joining the upscaled segments
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import logging
+import os
+from process_runner import CommandError, run_process
+
+logger = logging.getLogger("videoupscaler")
+
+#reading every packet of a long file over a slow share takes a while, a hung ffprobe does not
+KEYFRAME_SCAN_TIMEOUT = 1800
+
+
+class VideoSegment:
+
+    def __init__(self, index: int, start: float, end: float, overlap: float = 0.0):
+        #start and end are keyframe aligned times relative to the start of the file.
+        #overlap extends the upscaled input past the end so frame interpolation has the next frame
+        self.index = index
+        self.start = start
+        self.end = end
+        self.overlap = overlap
+        self.src_file = None
+        self.out_file = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"VideoSegment({self.index} {self.start:.3f}-{self.end:.3f} overlap {self.overlap:.3f})"
+
+
+async def keyframe_times(ffprobe_bin: str, src_file: str):
+    #packet flags only need the demuxer, no frames are decoded
+    cmd = [
+        ffprobe_bin,
+        '-v',
+        'error',
+        '-select_streams',
+        'v:0',
+        '-show_entries',
+        'packet=pts_time,flags',
+        '-of',
+        'csv=p=0',
+        src_file
+        ]
+
+    try:
+        result = await run_process(cmd, None, capture_stdout=True, timeout=KEYFRAME_SCAN_TIMEOUT)
+    except CommandError as e:
+        raise RuntimeError(f"ffprobe failed for {src_file}: {e}") from e
+
+    first_pts = None
+    keyframes = []
+
+    for line in result.stdout.decode('utf-8').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or parts[0] in ('', 'N/A'):
+            continue
+
+        pts = float(parts[0])
+        first_pts = pts if first_pts is None else min(first_pts, pts)
+
+        if 'K' in parts[1]:
+            keyframes.append(pts)
+
+    if first_pts is None:
+        return []
+
+    return sorted(pts - first_pts for pts in keyframes)
+
+
+def plan_segments(keyframes: list, duration: float, segment_seconds: float, overlap: float = 0.0):
+    #cut at the first keyframe at or after each segment_seconds boundary so every segment starts on a keyframe
+    segments = []
+    start = 0.0
+
+    for time in keyframes:
+        if time - start >= segment_seconds and duration - time > 0:
+            segments.append(VideoSegment(len(segments), start, time, overlap))
+            start = time
+
+    segments.append(VideoSegment(len(segments), start, duration))
+    return segments
+
+
+def extract_segment_args(src_file: str, segment: VideoSegment, out_file: str):
+    #a stream copy seek can land on the keyframe before start, as it does in mkv, those packets are dropped so the seams do not repeat frames
+    return [
+        '-ss',
+        f"{segment.start:.6f}",
+        '-i',
+        src_file,
+        '-t',
+        f"{segment.duration + segment.overlap:.6f}",
+        '-map',
+        '0:v:0',
+        '-c',
+        'copy',
+        '-copypriorss',
+        '0',
+        '-an',
+        '-avoid_negative_ts',
+        'make_zero',
+        '-y',
+        out_file
+        ]
+
+
+def write_concat_list(segments: list, list_file: str):
+    #the outpoint trims any overlap back off so frames are not repeated at the seams.
+    #a stream copy cut can also carry a few frames past the requested end because of frame reordering.
+    #the outpoint is compared with decode times, so when the upscaled segments have reordered frames one or two can still pass it
+    with open(list_file, "w", encoding="utf-8") as f:
+        for index, segment in enumerate(segments):
+            path = os.path.abspath(segment.out_file).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+            if index < len(segments) - 1:
+                f.write(f"outpoint {segment.duration:.6f}\n")
+
+    return list_file
+
+
+def concat_args(list_file: str, out_file: str):
+    return [
+        '-f',
+        'concat',
+        '-safe',
+        '0',
+        '-i',
+        list_file,
+        '-c',
+        'copy',
+        '-y',
+        out_file
+        ]
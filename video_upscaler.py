@@ -11,16 +11,39 @@ import os
 import asyncio
 from logging import Logger
 from asyncio import StreamReader
-import tempfile
 from pathlib import Path
 from model_builder import ProcessorModelEnum, modeltypesmap, multi_models_typemap 
 from enum_action import enum_action
+from job_scheduler import JobScheduler, UpscaleJob
+from job_manifest import JobManifest, MANIFEST_FILE_NAME, STATUS_STARTED, STATUS_DONE, STATUS_FAILED, STATUS_QUARANTINED, STATUS_SKIPPED
+from media_probe import MediaInfo, MediaProbe, ProbeCache, default_cache_dir
+from upscale_backends import create_backend, BACKENDS, BACKEND_VIDEO2X
+from encoder_profiles import EncoderProfile, load_profiles, get_profile
+from progress_parser import ProgressEvent
+from metrics import MetricsRecorder, METRICS_FILE_NAME, read_metrics
+from watch_folder import create_watcher
+from work_queue import Lease, create_lease_queue, default_worker_id
+from process_runner import CommandError, run_process
+from failure_policy import FailurePolicy, QuarantineList, FAILURE_OOM, classify_failure, validate_output
+from frame_dedup import FramePlan, DEDUP_MIN_SAVING, decimate, decimate_args, rebuild_timing
+from scratch_space import ScratchSpace, GIGABYTE, lossless_bytes, lossy_bytes
+from resolution_planner import plan_model, plan_chain, pass_labels, target_box, resolve_target
+from video_segments import keyframe_times, plan_segments, extract_segment_args, write_concat_list, concat_args
+from job_ordering import CostModel, PriorityRules, ORDERS, ORDER_WALK, PROBE_CONCURRENCY, SIDECAR_SUFFIX, UNKNOWN_COST, format_cost, order_key
+from perf_profile import PerfProfile, PERF_DB_FILE_NAME
+from result_cache import ResultCache, RESULT_CACHE_DIR_NAME
+from frame_pipeline import FrameFilters, FramePipeline, FrameProcessor, decode_args, run_frame_pipeline, np
+from crop_detect import detect_crop, pad_box
+from stream_tracks import plan_tracks, transcode_args, mux_args
+from autotune import AUTOTUNE_FRAMES, AUTOTUNE_THREAD_COUNTS, AUTOTUNE_WORKERS, clip_args, clip_start, format_rates, parse_counts, pick_best
+from resource_governor import ResourceGovernor
+from upscale_config import UpscaleConfig, PRE_PROCESS_AUTO, PRE_PROCESS_NONE, PRE_PROCESS_REMUX, PRE_PROCESS_PIPE, PRE_PROCESS_FRAMES, PRE_PROCESS_TRANSCODE, PRE_PROCESS_MODES, check_model, model_settings
 import sys
-import re
 from typing import Callable
-import math
 import traceback
-import shutil
+import math
+import shlex
+import time
 
 
 from rich.progress import Progress
@@ -33,6 +56,11 @@ if sys.platform == 'win32':
     is_windows = True
 
 
+#pre process modes, auto picks one from the probed source codecs
+
+#video codecs that can be stream copied into an mp4 container for video2x
+REMUX_VIDEO_CODECS = ["h264", "hevc", "av1", "vp9", "mpeg4"]
+
 richHandler = RichHandler(show_path=True)
 
 logger = logging.getLogger("videoupscaler")
@@ -48,83 +76,119 @@ logging.basicConfig(
 )
 
 
-async def read_stream(stream, prefix, log: Logger, progress: Callable = None):
-    try:
-        while True:
-            line = await stream.read(256)
-            if not line:
-                break
-            line_str = line.decode("utf-8").strip()
-            #log.info("frame" in line_str[:8])
-            #log.info(f"{prefix}: {line_str}")
-            if "frame" in line_str[:8] or "kframe" in line_str[:8]:
-                match = re.search(r"[-+]?[0-9]*\.?[0-9]+", line_str)
-                if match:
-                    float_value = float(match.group(0)) / 100
-
-                    progress(float_value)
-            else:
-                #log.info("")
-                log.info(f"{prefix}: {line_str}")
-    except Exception as e:
-        """"""
-            #logger.error(e)  
-
+async def run_command(cmd, log: Logger = None, verbose:bool = True, progress: Progress = None, description: str = "Processing Upscale...", total: int = 0, on_progress: Callable = None, idle_timeout: float = None):
+    #concurrent jobs share one progress display, rich only allows a single live display
+    if (progress is None):
+        with Progress() as progress:
+            return await run_command(cmd, log, verbose, progress, description, total, on_progress, idle_timeout)
 
+    log = log if log else logger
+    #without a probed frame count the bar is indeterminate until the process reports a total
+    task = progress.add_task(f"[red]{description}", total=total if total > 0 else None)
 
-async def run_command(cmd, log: Logger = None, verbose:bool = True):
-     if (verbose):
-        stdout=asyncio.subprocess.PIPE
-        stderr=asyncio.subprocess.PIPE
-     else:
-        stdout=asyncio.subprocess.DEVNULL
-        stderr=asyncio.subprocess.DEVNULL
+    def update_progress(event: ProgressEvent) -> None:
+        progress.update(task, completed=event.frame, total=event.total_frames if event.total_frames > 0 else None)
 
-     #print(*cmd)
- 
-     proc = await asyncio.create_subprocess_exec(*cmd, stdout=stdout, stderr=stderr)
+        if (on_progress is not None):
+            on_progress(event)
 
-     with Progress() as progress:
-            
-        task = progress.add_task("[red]Processing Upscale...", total=100)
-            
-        def upload_progress(perc) -> None:
-            progress.update(task, completed=perc)
+    #print(*cmd)
 
+    try:
+        #raises CommandError with the last lines of output when the process fails
+        result = await run_process(cmd, log if verbose else None, total=total, on_progress=update_progress, idle_timeout=idle_timeout)
+    finally:
+        progress.remove_task(task)
 
-        if (verbose):
-            await asyncio.gather(
-                read_stream(proc.stdout, "FFMPEG_STDOUT", log, upload_progress),
-                read_stream(proc.stderr, "FFMPEG_STDERR", log)
-            )
-            return_code = await proc.wait()
-        else:
-            return_code = await asyncio.gather(proc.wait())
-        
-        log.info(f'Stop Process, returned: {return_code}')
+    log.info(f'Stop Process, returned: {result.return_code}')
+    return result.return_code
 
 async def run_command_output(cmd, log: Logger = None):
-     
-    #print(*cmd)
- 
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    stdout_bytes, stderr_bytes = await proc.communicate()
-
-    await proc.wait() # Wait for the subprocess to complete
-    stdout_text = stdout_bytes.decode('utf-8').strip()
-    stderr_text = stderr_bytes.decode('utf-8').strip()
-
-    return stdout_text, stderr_text
+    result = await run_process(cmd, log, capture_stdout=True)
+    return result.stdout.decode('utf-8', errors='replace').strip(), "\n".join(result.tail)
 
 def replace_extension(filename, new_extension):
      file_path = Path(filename)
      return str(file_path.with_suffix(new_extension))
 
+def supports_fifo():
+    return hasattr(os, "mkfifo")
+
+def create_fifo(path):
+    if os.path.exists(path):
+        os.remove(path)
+    os.mkfifo(path)
+    return path
+
+def release_fifo(path):
+    #a writer blocked opening the fifo never returns if the reader failed before opening it.
+    #open and close a non blocking reader so the writer either completes its open or gets a broken pipe
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        os.close(fd)
+    except OSError:
+        pass
+
+def release_fifo_reader(path):
+    #the same for a reader blocked opening the fifo when the writer failed before opening it, it gets an end of file
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        os.close(fd)
+    except OSError:
+        pass
+
+async def run_pipeline(stages):
+    #stages is a list of (coroutine, input fifo or None[, output fifo]) all run concurrently.
+    #once a stage exits its input fifo is released so the stage writing to it cannot block forever.
+    #a stage that fails can exit before the stage on the other end of a fifo has opened it, so its
+    #fifos are released until the stages on the other ends have exited as well
+    readers = {}
+    writers = {}
+    exited = set()
+
+    async def release_until_exited(fifo, other_end, release):
+        index = other_end.get(fifo)
+        while (index is not None and index not in exited):
+            release(fifo)
+            await asyncio.sleep(0.1)
+
+    async def run_stage(index, stage, input_fifo, output_fifo = None):
+        try:
+            return await stage
+        except Exception:
+            exited.add(index)
+            await release_until_exited(input_fifo, writers, release_fifo)
+            await release_until_exited(output_fifo, readers, release_fifo_reader)
+            raise
+        finally:
+            exited.add(index)
+            if (input_fifo is not None):
+                release_fifo(input_fifo)
+
+    for index, stage in enumerate(stages):
+        if (stage[1] is not None):
+            readers[stage[1]] = index
+        if (len(stage) > 2 and stage[2] is not None):
+            writers[stage[2]] = index
+
+    tasks = [run_stage(index, *stage) for index, stage in enumerate(stages)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return results
+
+def lease_lost(heartbeat: asyncio.Task):
+    #the heartbeat only returns by itself once the lease was taken by another worker
+    return heartbeat is not None and heartbeat.done() and not heartbeat.cancelled()
+
 
 
 class VideoUpscaler:
 
-    def __init__(self, src_dir:str, out_dir:str, model: ProcessorModelEnum, model_type: int, scale:int, noise_level:int, isHD: bool, is4K: bool, thread_count: int, max_height: int, frame_rate_mul: int):
+    def __init__(self, src_dir:str, out_dir:str, model: ProcessorModelEnum, model_type: int, scale:int, noise_level:int, isHD: bool, is4K: bool, thread_count: int, max_height: int, frame_rate_mul: int, upscale_workers: int = 1, transcode_workers: int = 1, resume: bool = True, pre_process_mode: str = PRE_PROCESS_AUTO, chain_pipe: bool = False, chain_codec: str = "ffv1", cache_dir: str = None, segment_seconds: float = 0, video2x_bin: str = None, backend: str = BACKEND_VIDEO2X, profile: str = None, pre_process_profile: str = "x265", profiles_file: str = None, metrics_file: str = None, watch: bool = False, settle_seconds: float = 5.0, watch_interval: float = 2.0, watch_poll: bool = False, work_queue: str = None, worker_id: str = None, lease_seconds: float = 120, scratch_dir: str = None, scratch_min_free: float = 1.0, dedup_frames: bool = False, target: str = None, max_passes: int = 2, stall_timeout: float = 0, max_attempts: int = 3, retry_backoff: float = 30, validate: bool = True, retry_quarantined: bool = False, order: str = ORDER_WALK, priority_rules: str = None, estimate: bool = False, estimate_hours: float = 0, dry_run: bool = False, result_cache_gb: float = 0, result_cache_dir: str = None, crop: str = None, pre_resize: str = None, deinterlace: bool = False, denoise: int = 0, auto_crop: bool = False, auto_crop_pad: bool = False, autotune: bool = False, autotune_threads: str = AUTOTUNE_THREAD_COUNTS, autotune_workers: str = AUTOTUNE_WORKERS, governor_min_free: float = 0, governor_max_load: float = 0, governor_interval: float = 5.0):
         self.src_dir = src_dir
         self.out_dir = out_dir
         self.useWSL = False
@@ -146,293 +210,1519 @@ class VideoUpscaler:
         
         self.scale = int(scale)
         self.noise_level = noise_level
-        self.thread_count = thread_count
         self.max_height = int(max_height)
         self.model = None
         self.models = None
         self.frame_rate_mul = frame_rate_mul
+        self.progress = None
+        self.resume = resume
+        self.manifest = None
+        self.pre_process_mode = pre_process_mode
+        self.chain_pipe = chain_pipe
+        self.chain_codec = chain_codec
+        cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.probe_cache = ProbeCache(cache_dir)
+        #frame rates of past upscale stages on this host, for estimates and thread count suggestions
+        self.perf_profile = PerfProfile(os.path.join(cache_dir, PERF_DB_FILE_NAME))
+        #finished outputs by source content and settings, a source seen before is linked from the cache rather than upscaled.
+        #size in GB, 0 is off
+        self.result_cache = ResultCache(result_cache_dir if result_cache_dir else os.path.join(cache_dir, RESULT_CACHE_DIR_NAME), int(float(result_cache_gb) * GIGABYTE)) if result_cache_gb else None
+        #cache key -> (job, event set when it ends) of the jobs upscaling content not cached yet
+        self.cache_running = {}
+        self.media_probe = MediaProbe(self.ffprobe_bin, self.probe_cache)
+        self.segment_seconds = float(segment_seconds)
+
+        #a different upscaler binary, eg fake_video2x.py to run the pipeline without a GPU
+        if (video2x_bin):
+            self.video2x_bin = video2x_bin
+
+        self.backend = create_backend(backend, self.video2x_bin, self.ffmpeg_bin)
+        logger.info(f"Using {self.backend.name} backend")
+
+        self.profiles = load_profiles(profiles_file)
+        self.profile = get_profile(self.profiles, profile if profile else self.backend.default_profile)
+        self.pre_process_profile = get_profile(self.profiles, pre_process_profile)
+        logger.info(f"Using encoder profile {self.profile}")
+
+        #a stage with no output for this many seconds is killed, 0 waits forever
+        self.stall_timeout = float(stall_timeout) if stall_timeout else None
+
+        self.failure_policy = FailurePolicy(max_attempts, retry_backoff)
+        self.validate = validate
+        self.retry_quarantined = retry_quarantined
+        self.quarantine = None
+
+        self.metrics_file = metrics_file
+        self.metrics = None
+
+        #the order queued jobs run in, costs are estimated from the planned passes and the recorded upscale rates
+        self.order = order
+        self.priority_rules = PriorityRules.load(priority_rules)
+        self.cost_model = None
+
+        #only report the estimated upscale time of the input directory, and the hosts to finish it in estimate_hours
+        self.estimate = estimate
+        self.estimate_hours = float(estimate_hours)
+        #only log the commands each file would run
+        self.dry_run = dry_run
+
+        self.watch = watch
+        self.settle_seconds = float(settle_seconds)
+        self.watch_interval = float(watch_interval)
+        self.watch_poll = watch_poll
+        self.watch_active = set()
+        self.watch_changed = set()
+
+        #shared lease queue so several hosts can work through the same input directory
+        self.lease_seconds = float(lease_seconds)
+        self.lease_queue = create_lease_queue(work_queue, self.lease_seconds, self.failure_policy.max_attempts) if work_queue else None
+        self.worker_id = worker_id if worker_id else default_worker_id()
+
+        #temp files go to the scratch root, eg local NVMe rather than the output share. min free is in GB
+        self.scratch = ScratchSpace(scratch_dir, int(float(scratch_min_free) * GIGABYTE))
+
+        self.dedup_frames = dedup_frames
+
+        #crop, deinterlace, denoise and resize run on the decoded frames in process, streamed to the upscaler
+        self.frame_filters = FrameFilters(crop, pre_resize, deinterlace, denoise)
+
+        #black bars found by sampling each source are cropped with the frame filters, and padded back after upscaling with auto_crop_pad
+        self.auto_crop = auto_crop
+        self.auto_crop_pad = auto_crop_pad
+
+        if (self.auto_crop and self.frame_filters.crop is not None):
+            logger.warning("Black bar detection is not used with a fixed crop")
+            self.auto_crop = False
+
+        filtered = self.frame_filters.active or self.auto_crop
+
+        if (filtered or pre_process_mode == PRE_PROCESS_FRAMES):
+            if (np is None):
+                raise ValueError("Frame filters need numpy, install it with pipenv install numpy")
+
+            if (filtered and (self.useWSL or not supports_fifo())):
+                raise ValueError("Frame filters stream to the upscaler through a fifo, which is not supported on this platform")
+
+        #the decimate pass reads the source itself, the filters would be skipped
+        if (self.dedup_frames and filtered):
+            logger.warning("Duplicate frame skipping is not used with frame filters")
+            self.dedup_frames = False
+
+        #the box each output is fitted in, the scale of each file is planned from its probed size
+        self.width, self.height = target_box(target, isHD, is4K)
+        self.target = resolve_target((self.width, self.height), self.max_height)
+        self.max_passes = max(int(max_passes), 1)
 
         self.setModel(model, model_type)
 
-        
-        self.setDimensions(isHD, is4K)
+        #interpolated frames are made from neighbouring frames, a held frame has to stay held
+        if (self.dedup_frames and self.frame_rate_mul > 0):
+            logger.warning("Duplicate frame skipping is not used with frame interpolation")
+            self.dedup_frames = False
 
-        
+        #every pass would interpolate again
+        if (self.frame_rate_mul > 0):
+            self.max_passes = 1
+
+        #calibrate the thread count and upscale workers on a clip of the first source, then save them for this host
+        self.autotune = autotune
+        self.autotune_threads = parse_counts(autotune_threads)
+        self.autotune_workers = parse_counts(autotune_workers)
+
+        #0 takes what autotune chose on this host
+        self.thread_count, upscale_workers = self.apply_tuning(int(thread_count), int(upscale_workers))
+
+        #stage limits are lowered while free memory or load cross the thresholds, 0 is not checked
+        governor = ResourceGovernor(governor_min_free, governor_max_load, governor_interval)
+        self.scheduler = JobScheduler(upscale_workers, transcode_workers, governor)
+
+
+    @classmethod
+    def from_config(cls, config: UpscaleConfig):
+        return cls(**config.kwargs())
 
     def setModel(self, model, model_type):
+        check_model(model, model_type)
+        #the configured model or chain, autotune results are saved under it
+        self.model_name = model.name
        
-        if (model == ProcessorModelEnum.lib2realsr or model == ProcessorModelEnum.lib2realplusanime or model == ProcessorModelEnum.lib2realplus):
+        if (model in multi_models_typemap):
             self.models = multi_models_typemap[model]
+
+            for item in self.models:
+                if (not self.backend.supports(item["model"], item["type"])):
+                    raise ValueError(f"{self.backend.name} backend does not support {item["model"].name} {item["type"]}")
+
+                #a chain stage may name its own encoder profile
+                if (item.get("profile")):
+                    get_profile(self.profiles, item["profile"])
+
             logger.info(f"Starting Upscale {self.models}")
         else:
             self.model = model
-            model_item = modeltypesmap[model][model_type]
-            self.model_type = model_item["type"]
+            self.model_type = modeltypesmap[model][model_type]["type"]
 
-            if ("max_scale" in model_item and self.scale > model_item["max_scale"]):
-                self.scale = model_item["max_scale"]
-            
-            if ("min_scale" in model_item and self.scale < model_item["min_scale"]):
-                self.scale = model_item["min_scale"]
+            if (not self.backend.supports(model, self.model_type)):
+                raise ValueError(f"{self.backend.name} backend does not support {model.name} {self.model_type}")
 
-            if ("max_noise_level" in model_item and self.noise_level > model_item["max_noise_level"]):
-                self.noise_level = model_item["max_noise_level"]
+            #clamped to what the model type supports, the same as UpscaleConfig.effective
+            self.scale, self.noise_level, self.frame_rate_mul = model_settings(model, model_type, self.scale, self.noise_level, self.frame_rate_mul)
 
-            if (model == ProcessorModelEnum.rife and self.frame_rate_mul == 0):
-                self.frame_rate_mul = 2
+            logger.info(f"Starting Upscale {model.name} {self.model_type} Scale {self.scale} Noise Level {self.noise_level}")
 
+    def tuning_key(self):
+        #backend, model, type and scale a configuration is calibrated and saved for, a chain has no type
+        return self.backend.name, self.model_name, "" if self.models else self.model_type, self.scale
 
-            logger.info(f"Starting Upscale {model.name} {self.model_type} Scale {self.scale} Noise Level {self.noise_level}")
+    def apply_tuning(self, thread_count: int, upscale_workers: int):
+        #a thread count or worker count of 0 is the calibrated one, or the recorded suggestion or 1 without a calibration
+        if (thread_count > 0 and upscale_workers > 0):
+            return thread_count, upscale_workers
 
-    def setMaxScale(self, height, max_height):
-        if (self.model is not None and self.model == ProcessorModelEnum.realesrgan and max_height > 0):
-            if ((height * self.scale) > max_height):
-                self.scale = min(math.floor(max_height / height),4)
-                logger.info(f"New Scale Set {self.scale}")
-
-    def setDimensions(self, isHD, is4K):
-        self.width = 0
-        self.height = 0
-
-        if (self.model is not None and self.model == ProcessorModelEnum.libplacebo):
-            if (isHD):
-                self.scale = 0
-                self.width = 1920
-                self.height = 1080
-            elif (is4K):
-                self.scale = 0
-                self.width = 3840
-                self.height = 2160
-
-    def model_args(self, model: ProcessorModelEnum, model_type: str):
-        model_arg = ""
-        cmd = []
-        if (model == ProcessorModelEnum.realesrgan):
-            model_arg = "--realesrgan-model"
-        elif (model == ProcessorModelEnum.libplacebo):
-            model_arg = "libplacebo-shader"
-        elif (model == ProcessorModelEnum.realcugan):
-            model_arg = "--realcugan-model"
-        elif (model == ProcessorModelEnum.rife):
-            model_arg = "--rife-model"
-            cmd += ["--rife-uhd"]
-
-        cmd += ["-p", model.name, model_arg, model_type]
-        return cmd
-
-    def scale_noise_args(self, scale: int, width: int, height: int):
-        cmd = []
-        if (width > 0):
-            cmd += ["-w", str(width), "-h", str(height)]
-        else:
-            cmd += ["-s", str(scale)]
-        
-        if (self.noise_level >= 0):
-            cmd += ['-n', str(self.noise_level)]
-        
-        if (self.frame_rate_mul > 0):
-            cmd += ['-m', str(self.frame_rate_mul)]
-        
-        return cmd
+        tuning = self.perf_profile.tuning(*self.tuning_key())
 
-    async def super_resolution(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, no_audio:bool = False, lossless: bool = False):
-        cmd = [
-            self.video2x_bin,
-            '-i',
-            src_file,
-            '-c',
-            'hevc_nvenc'
-            ]
-        
-        if (no_audio):
-            cmd += ['--no-copy-streams']
+        if (thread_count == 0):
+            if (tuning is not None):
+                thread_count = tuning["thread_count"]
+            elif (not self.models):
+                thread_count = self.perf_profile.suggest_thread_count(self.backend.name, self.model.name, self.model_type, self.scale) or 1
+            else:
+                thread_count = 1
 
-        cmd += self.model_args(model, model_type)
-        cmd += self.scale_noise_args(scale, width, height)
-        cmd += ['--thread-count', str(self.thread_count)]
-        
-        if (lossless):
-            cmd += ['-e',
-                'preset=p7',
-                '-e', 
-                'tune=lossless']
+        if (upscale_workers == 0):
+            upscale_workers = tuning["upscale_workers"] if tuning is not None else 1
+
+        logger.info(f"Using thread count {thread_count} and {upscale_workers} upscale workers{" calibrated on this host" if tuning is not None else ", run with --autotune to calibrate them"}")
+        return thread_count, upscale_workers
+
+    def plan_job(self, job: UpscaleJob):
+        #the passes for one file rather than mutating the scale as jobs run concurrently
+        width, height = (job.media.width, job.media.height) if job.media is not None else (0, 0)
+        #the upscaler gets the filtered frames
+        width, height = self.job_filters(job).output_size(width, height)
+
+        if (self.models):
+            plan = plan_chain(self.models, width, height, self.target, self.backend.max_scale)
         else:
-            cmd += ['-e',
-            'preset=p7',
-            '-e', 
-            'tune=hq']
-    
-        """
-        cmd += ['-e',
-                'crf=17',
-                '-e', 
-                'preset=slow']
-        """
+            plan = plan_model(self.model, self.model_type, self.scale, width, height, self.target, self.backend.max_scale, self.max_passes)
 
+        logger.info(f"Plan for {job.src_file}: {plan}")
+        return plan
 
-        cmd += [
-            '-e',
-            'rc=vbr',
-            '-e',
-            'cq=19',
-            '-o',
-            out_file
-            ]
+    def settings(self):
+        #effective settings recorded in the manifest, a change in any of these reprocesses the file
+        settings = {
+            "noise_level": self.noise_level,
+            "max_height": self.max_height,
+            "frame_rate_mul": self.frame_rate_mul
+        }
+
+        #only recorded when on so existing manifests stay valid
+        if (self.dedup_frames):
+            settings["dedup_frames"] = True
+
+        #the box every plan fits, a chain records only its fixed sizes
+        if (self.target is not None):
+            settings["target"] = list(self.target)
+            settings["max_passes"] = self.max_passes
+
+        if (self.frame_filters.active):
+            settings["frame_filters"] = self.frame_filters.settings()
+
+        if (self.auto_crop):
+            settings["auto_crop"] = "pad" if self.auto_crop_pad else True
+
+        if (self.models):
+            settings["models"] = [{ "model": model["model"].name, "type": model["type"], "scale": model["scale"], "width": model["width"], "height": model["height"] } for model in self.models]
+        else:
+            settings.update({
+                "model": self.model.name,
+                "model_type": self.model_type,
+                "scale": self.scale,
+                "width": self.width,
+                "height": self.height
+            })
+
+        #the encoder options change the bytes of the output as much as the model does
+        profiles = [self.profile, self.pre_process_profile] + [self.profiles[item["profile"]] for item in (self.models or []) if item.get("profile")]
+        settings["backend"] = self.backend.name
+        settings["profiles"] = { profile.name: vars(profile) for profile in profiles }
+
+        return settings
+
+    async def run_stage(self, cmd, stage: str, src_file: str, description: str, total_frames: int = 0, **labels):
+        #runs a command and records its timing and frame rate to the metrics file
+        stage_metrics = self.metrics.stage(stage, src_file, **labels) if self.metrics is not None else None
+
+        try:
+            return_code = await run_command(cmd, logger, True, self.progress, description, total_frames, stage_metrics.update if stage_metrics is not None else None, self.stall_timeout)
+        except CommandError as e:
+            if (stage_metrics is not None):
+                self.metrics.write_stage(stage_metrics, e.return_code)
+            raise
+
+        if (stage_metrics is not None):
+            record = self.metrics.write_stage(stage_metrics, return_code)
+
+            if (stage == "upscale"):
+                await self.record_throughput(record)
+
+        return return_code
+
+    async def record_throughput(self, record: dict):
+        #a profile that can not be written never fails the job
+        try:
+            await asyncio.to_thread(self.perf_profile.record, record)
+        except Exception as e:
+            logger.warning(f"Unable to record throughput to {self.perf_profile.path}: {e}")
+
+    def stage_profile(self, model: dict):
+        return self.profiles[model["profile"]] if model.get("profile") else self.profile
+
+    def upscale_command(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, no_audio:bool = False, lossless: bool = False, codec: str = None, profile: EncoderProfile = None, thread_count: int = None):
+        return self.backend.build_command(src_file, out_file, model, model_type, scale, width, height, self.noise_level, self.frame_rate_mul, thread_count if thread_count else self.thread_count, no_audio, lossless, codec, profile if profile else self.profile)
+
+    async def super_resolution(self, src_file: str, out_file: str, model: ProcessorModelEnum, model_type: str, scale: int, width: int, height: int, no_audio:bool = False, lossless: bool = False, codec: str = None, total_frames: int = 0, profile: EncoderProfile = None, thread_count: int = None, **labels):
+        profile = profile if profile else self.profile
+        thread_count = thread_count if thread_count else self.thread_count
+        cmd = self.upscale_command(src_file, out_file, model, model_type, scale, width, height, no_audio, lossless, codec, profile, thread_count)
         
         #print(' '.join(cmd))
 
-        await run_command(cmd, logger, True)
+        await self.run_stage(cmd, "upscale", src_file, f"Upscaling {os.path.basename(out_file)}", total_frames, backend=self.backend.name, model=model.name, model_type=model_type, scale=scale, width=width, height=height, thread_count=thread_count, profile=profile.name, lossless=lossless, **labels)
 
-    async def mux_audio(self, src_file, tmp_file, out_file):
-        cmd = [
-            self.ffmpeg_bin,
-            '-i',
-            tmp_file,
-            '-i',
-            src_file,
-            '-c:v', 
-            'copy',
-            '-c:a',
-            'aac',
-            '-map', 
-            '0:v:0', 
-            '-map', 
-            '1:a:0',
-            '-y',
-            out_file
-            ]
-        
-        #print(cmd)
+    def tracks_command(self, job: UpscaleJob, temp_dir: str):
+        #the command transcoding the tracks that can not be copied into the output and the file it writes, or None
+        tracks_file = os.path.join(temp_dir, "tracks_{0}".format(job.src_file_name))
+        args = transcode_args(job.src_file, job.tracks, self.profile, tracks_file)
+        return ([self.ffmpeg_bin] + args, tracks_file) if args is not None else (None, None)
 
-        await run_command(cmd, logger, True)
-    
-    async def pre_process(self, src_file, src_file_name, tmp_dir):
-        tmp_src_file = converted_tmp_src_file = os.path.join(tmp_dir, "transcoded_{0}".format(src_file_name))
+    async def transcode_tracks(self, job: UpscaleJob, cmd: list, tracks_file: str):
+        #a cpu bound ffmpeg stage like the pre process and mux, it shares their limit
+        async with self.scheduler.transcode:
+            await self.run_stage(cmd, "tracks", job.src_file, f"Transcoding tracks of {job.src_file_name}")
+
+        return tracks_file
+
+    def start_tracks(self, job: UpscaleJob, temp_dir: str):
+        #audio and subtitles are transcoded while the video upscales, the final mux only copies
+        job.tracks = plan_tracks(job.media, self.profile)
+        cmd, tracks_file = self.tracks_command(job, temp_dir)
+        job.tracks_task = asyncio.ensure_future(self.transcode_tracks(job, cmd, tracks_file)) if cmd is not None else None
+        logger.info(f"Tracks of {job.src_file}: {job.tracks}")
+
+    async def stop_tracks(self, job: UpscaleJob):
+        task = job.tracks_task
+        job.tracks_task = None
+
+        if (task is not None and not task.done()):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def mux_command(self, job: UpscaleJob, video_file: str, tracks_file: str = None):
+        pad = self.job_pad(job)
+        filters = []
 
+        #resized down to the target when no scale of the model lands within it
+        if (job.plan.fit is not None):
+            filters.append("scale={0}:{1}:flags=lanczos".format(*job.plan.fit))
+
+        #black bars put back around the upscaled crop
+        if (pad is not None):
+            filters.append("pad={0}:{1}:{2}:{3}:black".format(*pad))
+
+        if (filters or not job.plan.passes):
+            #encoded again, as is the source video when no model runs
+            video_args = (['-vf', ",".join(filters)] if filters else []) + self.profile.ffmpeg_args(False)
+        else:
+            video_args = ['-c:v', 'copy']
+
+        return [self.ffmpeg_bin] + mux_args(video_file, job.src_file, job.tracks, tracks_file, job.dst_file, video_args)
+
+    async def mux_tracks(self, job: UpscaleJob, video_file: str, total_frames: int = 0):
+        #waits for the transcoded tracks then joins them, the copied tracks and the chapters of the source with the upscaled video
+        tracks_file = await job.tracks_task if job.tracks_task is not None else None
+        cmd = self.mux_command(job, video_file, tracks_file)
+
+        async with self.scheduler.transcode:
+            await self.run_stage(cmd, "mux", job.src_file, f"Muxing {os.path.basename(job.dst_file)}", total_frames)
+    
+    def ffmpeg_command(self, src_file, out_file):
         #Massive bug with Windows ffmpeg for transcoding. timescale and durations are cut. Use Linux WSL ffmpeg instead
         if (self.useWSL):
-            converted_tmp_src_file = wslPath.to_posix(tmp_src_file)
-            src_file = wslPath.to_posix(src_file)
-            cmd = self.wsl_ffmpeg_bin
-        else:
-            cmd = [self.ffmpeg_bin]
+            return list(self.wsl_ffmpeg_bin), wslPath.to_posix(src_file), wslPath.to_posix(out_file)
+
+        return [self.ffmpeg_bin], src_file, out_file
+
+    def pre_process_command(self, src_file, src_file_name, tmp_dir, remux: bool = False):
+        #returns the command and the file it writes, video only as the tracks are muxed from the source
+        tmp_src_file = os.path.join(tmp_dir, "transcoded_{0}".format(src_file_name))
+        cmd, src_file, converted_tmp_src_file = self.ffmpeg_command(src_file, tmp_src_file)
 
         cmd += [
             '-i',
-            src_file,
-            '-c:v', 
-            'libx265'
+            src_file
             ]
+
+        cmd += [
+            '-map',
+            '0:v:0'
+            ]
+
+        if (remux):
+            #container only remux, the video codec is already usable by video2x
+            cmd += [
+                '-c:v',
+                'copy'
+                ]
+        else:
+            cmd += self.pre_process_profile.ffmpeg_args(True)
         
         #cmd += ['-preset:v p7',
         #        '-tune:v lossless']
-        
+
         cmd +=[
-            '-x265-params',
-            'lossless=1',
-            '-c:a',
-            'aac',
-            '-b:a',
-            '192k', 
+            '-an',
+            '-sn',
             '-y',
             converted_tmp_src_file
             ]
-        
-        
+
+        return cmd, tmp_src_file
+
+    async def pre_process(self, src_file, src_file_name, tmp_dir, remux: bool = False, total_frames: int = 0):
+        cmd, tmp_src_file = self.pre_process_command(src_file, src_file_name, tmp_dir, remux)
         
         #print(' '.join(cmd))
 
-        await run_command(cmd, logger, True)
+        await self.run_stage(cmd, "remux" if remux else "transcode", src_file, f"{"Remuxing" if remux else "Transcoding"} {src_file_name}", total_frames)
         return tmp_src_file
 
-    async def get_video_dimensions(self, src_file):
-        cmd = [
-            self.ffprobe_bin,
-            '-v', 
-            'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height',
-            '-of', 'csv=p=0:s=x', 
-            src_file
+    def pipe_command(self, src_file, fifo_file):
+        #decode straight into the fifo the upscaler reads from, raw frames avoid any encode cost.
+        #the tracks are muxed from the original source after upscaling
+        return [
+            self.ffmpeg_bin,
+            '-i',
+            src_file,
+            '-map',
+            '0:v:0',
+            '-c:v',
+            'rawvideo',
+            '-an',
+            '-f',
+            'nut',
+            '-y',
+            fifo_file
             ]
-        
-        stdout, stderr = await run_command_output(cmd, logger)
 
-        if 'x' in stdout:
-            width_str, height_str = stdout.split('x')
-            width = int(width_str)
-            height = int(height_str)
-            return width, height
+    async def pipe_source(self, src_file, fifo_file, src_file_name, total_frames: int = 0):
+        await self.run_stage(self.pipe_command(src_file, fifo_file), "pipe", src_file, f"Streaming {src_file_name}", total_frames)
+
+    def frames_command(self, src_file):
+        return [self.ffmpeg_bin] + decode_args(src_file)
+
+    async def frame_source(self, job: UpscaleJob, fifo_file):
+        #decodes into reused NumPy buffers, filters a batch of frames at a time and writes yuv4mpeg to the fifo
+        filters = self.job_filters(job)
+        processor = FrameProcessor(filters, job.media.width, job.media.height)
+        frame_rate = job.media.video.get("r_frame_rate") or "{0}/1".format(round(job.media.fps))
+        total_frames = self.total_frames(job)
+        stage_metrics = self.metrics.stage("frames", job.src_file, out_width=processor.out_width, out_height=processor.out_height) if self.metrics is not None else None
+        task = self.progress.add_task(f"[red]Filtering {job.src_file_name}", total=total_frames if total_frames > 0 else None) if self.progress is not None else None
+
+        def update_progress(frames: int):
+            if (task is not None):
+                self.progress.update(task, completed=frames)
+            if (stage_metrics is not None):
+                stage_metrics.update(ProgressEvent(frames, total_frames))
+
+        pipeline = FramePipeline(self.frames_command(job.src_file), fifo_file, processor, frame_rate, update_progress)
+        logger.info(f"Streaming {job.src_file} through {filters} at {processor.out_width}x{processor.out_height}")
+
+        try:
+            await run_frame_pipeline(pipeline)
+        except Exception as e:
+            if (stage_metrics is not None):
+                self.metrics.write_stage(stage_metrics, e.return_code if isinstance(e, CommandError) else 1)
+            raise
+        finally:
+            if (task is not None):
+                self.progress.remove_task(task)
+
+        if (stage_metrics is not None):
+            self.metrics.write_stage(stage_metrics, 0)
+
+    async def probe(self, src_file):
+        return await self.media_probe.probe(src_file)
+
+    async def probe_job(self, job: UpscaleJob):
+        try:
+            media = await self.probe(job.src_file)
+        except Exception as e:
+            logger.error(f"Unable to probe {job.src_file}: {e}")
+            return None
+
+        if (self.auto_crop):
+            await self.detect_job_crop(job, media)
+
+        return media
+
+    def job_filters(self, job: UpscaleJob):
+        return job.filters if job.filters is not None else self.frame_filters
+
+    async def detect_job_crop(self, job: UpscaleJob, media: MediaInfo):
+        #the crop is kept in the probe cache beside the probe, a source is only sampled again once it changes
+        job.filters = None
+        if (media.width <= 0 or media.height <= 0):
+            return
+
+        entry = self.probe_cache.get(job.src_file)
+
+        if (entry is not None and "crop" in entry):
+            crop = entry["crop"]
+        else:
+            try:
+                crop = await detect_crop(self.ffmpeg_bin, job.src_file, media.duration, media.width, media.height)
+            except Exception as e:
+                #a source that can not be sampled is upscaled whole
+                logger.warning(f"Unable to detect black bars in {job.src_file}: {e}")
+                return
+
+            self.probe_cache.update(job.src_file, crop=crop)
+
+        if (crop is not None):
+            job.filters = self.frame_filters.with_crop(crop)
+
+    def job_pad(self, job: UpscaleJob):
+        #the padded size and offset of the upscaled crop with auto_crop_pad, or None
+        filters = self.job_filters(job)
+
+        if (not self.auto_crop_pad or filters.crop is None or filters.resize is not None or job.media is None):
+            return None
+
+        out_width, out_height = job.plan.out_width, job.plan.out_height
+        x, y, crop_width, crop_height = filters.crop_box(job.media.width, job.media.height)
+        return pad_box((crop_width, crop_height, x, y), job.media.width, job.media.height, out_width, out_height)
+
+    def select_pre_process(self, src_file, media, filters: FrameFilters = None):
+        is_mp4 = os.path.splitext(src_file)[1] == ".mp4"
+        mode = self.pre_process_mode
+        filters = filters if filters is not None else self.frame_filters
+
+        if (filters.active):
+            #the filters only run on decoded frames
+            mode = PRE_PROCESS_FRAMES
+
+        if (mode == PRE_PROCESS_AUTO):
+            if (media is None or media.video_codec is None):
+                #unknown source, keep the original extension based behaviour
+                mode = PRE_PROCESS_NONE if is_mp4 else PRE_PROCESS_TRANSCODE
+            elif (media.video_codec in REMUX_VIDEO_CODECS):
+                #the upscaler only reads the video, the tracks are muxed from the source
+                mode = PRE_PROCESS_NONE if is_mp4 else PRE_PROCESS_REMUX
+            else:
+                mode = PRE_PROCESS_PIPE
+
+        if (mode == PRE_PROCESS_FRAMES and (media is None or media.width <= 0)):
+            if (filters.active):
+                raise ValueError(f"Frame filters need the probed frame size, {src_file} could not be probed")
+
+            logger.warning(f"Frame mode needs the probed frame size, transcoding {src_file}")
+            mode = PRE_PROCESS_TRANSCODE
+
+        if (mode in (PRE_PROCESS_PIPE, PRE_PROCESS_FRAMES) and (self.useWSL or not supports_fifo())):
+            logger.warning(f"Pipe mode is not supported on this platform, transcoding {src_file}")
+            mode = PRE_PROCESS_TRANSCODE
+
+        logger.info(f"Pre process {mode} for {src_file} {media}")
+        return mode
+
+    def total_frames(self, job: UpscaleJob, interpolated: bool = False):
+        if (job.media is None):
+            return 0
+
+        if (interpolated and self.frame_rate_mul > 0):
+            return job.media.frame_count * self.frame_rate_mul
+
+        return job.media.frame_count
 
+    async def piped_model_chain(self, job: UpscaleJob, src_file, temp_dir, feeder = None):
+        #every pass runs at once, each writing its frames into a fifo read by the next pass.
+        #only the final pass writes a file
+        stages = []
 
-    async def multi_model_pass(self, src_file, src_file_name, temp_dir, dst_file):
+        if (feeder is not None):
+            stages.append((feeder, None, src_file))
+
+        next_src_file = src_file
+        input_fifo = src_file if feeder is not None else None
+
+        passes = job.plan.passes
+
+        for index, model in enumerate(passes):
+            logger.info(f"Process piped pass with model {model["model"].name}")
+
+            if (index == len(passes) - 1):
+                next_dst_file = os.path.join(temp_dir, "scaled_{0}_{1}".format(model["model"].name, job.src_file_name))
+                upscale = self.super_resolution(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"], total_frames=self.total_frames(job), profile=self.stage_profile(model), thread_count=job.thread_count, **pass_labels(model))
+            else:
+                next_dst_file = create_fifo(os.path.join(temp_dir, "chain_{0}_{1}".format(index, replace_extension(job.src_file_name, ".nut"))))
+                upscale = self.super_resolution(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"], self.chain_codec, self.total_frames(job), thread_count=job.thread_count, **pass_labels(model))
+
+            stages.append((upscale, input_fifo, next_dst_file if index < len(passes) - 1 else None))
+            input_fifo = next_src_file = next_dst_file
+
+        await run_pipeline(stages)
+        return next_dst_file
+
+    async def multi_model_pass(self, job: UpscaleJob, src_file, temp_dir, feeder = None):
         
         next_src_file = src_file
         
+        async with self.scheduler.upscale:
+            if (self.chain_pipe and supports_fifo() and not self.useWSL):
+                next_dst_file = await self.piped_model_chain(job, src_file, temp_dir, feeder)
+            else:
+                if (self.chain_pipe):
+                    logger.warning("Piped model chain is not supported on this platform, writing intermediate files")
+
+                for index, model in enumerate(job.plan.passes):
+                    logger.info(f"Process pass with model {model["model"].name}")
+                    dst_filename = "scaled_{0}_{1}_{2}".format(index, model["model"].name, job.src_file_name)
+                    next_dst_file = os.path.join(temp_dir, dst_filename)
+                    upscale = self.super_resolution(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"], total_frames=self.total_frames(job), profile=self.stage_profile(model), thread_count=job.thread_count, **pass_labels(model))
+
+                    if (feeder is not None):
+                        await run_pipeline([(feeder, None, next_src_file), (upscale, next_src_file)])
+                        feeder = None
+                    else:
+                        await upscale
+
+                    next_src_file = next_dst_file
+        
+        await self.mux_tracks(job, next_dst_file, self.total_frames(job))
+
+    async def upscale_passes(self, job: UpscaleJob, src_file, dst_file, temp_dir, prefix, total_frames: int = 0, codec: str = None):
+        #every planned pass for one input file, used for each segment of a segmented upscale.
+        #codec is the intermediate codec of the final pass when its output is piped on
+        next_src_file = src_file
+        passes = job.plan.passes
+
+        for index, model in enumerate(passes):
+            final = index == len(passes) - 1
+
+            if (final):
+                next_dst_file = dst_file
+            else:
+                next_dst_file = os.path.join(temp_dir, "{0}_{1}_{2}.mp4".format(prefix, index, model["model"].name))
 
-        for model in self.models:
-            logger.info(f"Process pass with model {model["model"].name}")
-            dst_filename = "scaled_{0}_{1}".format(model["model"].name, src_file_name)
-            next_dst_file = os.path.join(temp_dir, dst_filename)
-            await self.super_resolution(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"])
+            await self.super_resolution(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"], codec if final else None, total_frames=total_frames, profile=self.stage_profile(model), thread_count=job.thread_count, **pass_labels(model))
             next_src_file = next_dst_file
-        
-        await self.mux_audio(src_file, next_dst_file, dst_file)
 
-    
-    async def single_model_pass(self, src_file, dst_file):
+    async def upscale_segment(self, job: UpscaleJob, segment, temp_dir):
+        fps = job.media.fps if job.media is not None else 0
+        total_frames = int(round((segment.duration + segment.overlap) * fps))
+
+        if (not self.models and self.frame_rate_mul > 0):
+            total_frames *= self.frame_rate_mul
+
+        async with self.scheduler.upscale:
+            logger.info(f"Upscaling segment {segment} of {job.src_file}")
+            await self.upscale_passes(job, segment.src_file, segment.out_file, temp_dir, "segment_{0:05d}".format(segment.index), total_frames)
+
+    async def segmented_pass(self, job: UpscaleJob, src_file, temp_dir):
+        #split at keyframes, upscale the segments concurrently within the upscale limit and join them with a stream copy
+        keyframes = await keyframe_times(self.ffprobe_bin, src_file)
+        duration = job.media.duration if job.media is not None else 0
+        fps = job.media.fps if job.media is not None else 0
+
+        if (duration <= 0 and keyframes):
+            duration = keyframes[-1]
+
+        #frame interpolation needs the first frame of the next segment to interpolate across the seam
+        overlap = 0.0
+        if (not self.models and self.frame_rate_mul > 0 and fps > 0):
+            overlap = 1.5 / fps
+
+        segments = plan_segments(keyframes, duration, job.segment_seconds, overlap)
+
+        if (len(segments) < 2):
+            return False
+
+        logger.info(f"Split {job.src_file} into {len(segments)} segments")
+
+        cmd, src_file, _ = self.ffmpeg_command(src_file, temp_dir)
+
+        async with self.scheduler.transcode:
+            for segment in segments:
+                segment.src_file = os.path.join(temp_dir, "segment_{0:05d}.mkv".format(segment.index))
+                segment.out_file = os.path.join(temp_dir, "segment_{0:05d}_scaled.mp4".format(segment.index))
+                segment_src_file = wslPath.to_posix(segment.src_file) if self.useWSL else segment.src_file
+                await self.run_stage(cmd + extract_segment_args(src_file, segment, segment_src_file), "split", job.src_file, f"Splitting {job.src_file_name} {segment.index}")
+
+        results = await asyncio.gather(*[self.upscale_segment(job, segment, temp_dir) for segment in segments], return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        joined_file = os.path.join(temp_dir, "joined_{0}".format(job.src_file_name))
+        list_file = write_concat_list(segments, os.path.join(temp_dir, "segments.txt"))
+
+        async with self.scheduler.transcode:
+            await self.run_stage([self.ffmpeg_bin] + concat_args(list_file, joined_file), "concat", job.src_file, f"Joining {job.src_file_name}", self.total_frames(job, True))
+
+        await self.mux_tracks(job, joined_file, self.total_frames(job, True))
+
+        return True
+
+    async def find_duplicate_frames(self, job: UpscaleJob, decimated_file: str):
+        cmd, src_file, out_file = self.ffmpeg_command(job.src_file, decimated_file)
+        cmd += decimate_args(src_file, out_file, ['-c:v', self.chain_codec])
+        stage_metrics = self.metrics.stage("decimate", job.src_file) if self.metrics is not None else None
+        logger.info(f"Finding duplicate frames in {job.src_file}")
+
+        try:
+            plan = await decimate(cmd)
+        except Exception:
+            if (stage_metrics is not None):
+                self.metrics.write_stage(stage_metrics, 1)
+            raise
+
+        if (stage_metrics is not None):
+            stage_metrics.update(ProgressEvent(plan.total_frames, plan.total_frames))
+            stage_metrics.labels.update(total_frames=plan.total_frames, unique_frames=plan.unique_frames)
+            self.metrics.write_stage(stage_metrics, 0)
+
+        return plan
+
+    async def rebuild_frame_timing(self, job: UpscaleJob, upscaled_file: str, rebuilt_file: str, plan: FramePlan):
+        #repeats each upscaled unique frame for the frames it stood in for, at the source frame rate
+        decoder_cmd, upscaled_file, rebuilt_file = self.ffmpeg_command(upscaled_file, rebuilt_file)
+        encoder_cmd = list(decoder_cmd)
+        decoder_cmd += ['-v', 'error', '-i', upscaled_file, '-map', '0:v:0', '-fps_mode', 'passthrough', '-f', 'yuv4mpegpipe', '-strict', '-1', '-']
+        encoder_cmd += ['-v', 'error', '-f', 'yuv4mpegpipe', '-i', '-'] + self.profile.ffmpeg_args(False) + ['-y', rebuilt_file]
+        frame_rate = job.media.video.get("r_frame_rate") or "{0}/1".format(round(job.media.fps))
+        stage_metrics = self.metrics.stage("rebuild", job.src_file) if self.metrics is not None else None
+
+        try:
+            frames = await rebuild_timing(decoder_cmd, encoder_cmd, plan.repeats(), frame_rate)
+
+            if (frames != plan.unique_frames):
+                raise RuntimeError(f"Upscaled {frames} frames of {job.src_file}, expected {plan.unique_frames} unique frames")
+        except Exception:
+            if (stage_metrics is not None):
+                self.metrics.write_stage(stage_metrics, 1)
+            raise
+
+        if (stage_metrics is not None):
+            stage_metrics.update(ProgressEvent(plan.total_frames, plan.total_frames))
+            stage_metrics.labels.update(total_frames=plan.total_frames, unique_frames=plan.unique_frames)
+            self.metrics.write_stage(stage_metrics, 0)
+
+    async def dedup_pass(self, job: UpscaleJob, temp_dir):
+        #upscales only the unique frames then rebuilds the original timing.
+        #returns False when too few frames repeat to be worth it and the normal pass runs instead
+        decimated_file = os.path.join(temp_dir, "decimated_{0}".format(replace_extension(job.src_file_name, ".mkv")))
+
+        async with self.scheduler.transcode:
+            plan = await self.find_duplicate_frames(job, decimated_file)
+
+        if (plan.saving < DEDUP_MIN_SAVING):
+            logger.info(f"{plan} in {job.src_file}, upscaling every frame")
+            os.remove(decimated_file)
+            return False
+
+        logger.info(f"{plan} in {job.src_file}, upscaling unique frames only")
+
+        rebuilt_file = os.path.join(temp_dir, "rebuilt_{0}".format(job.src_file_name))
+
+        async with self.scheduler.upscale:
+            if (supports_fifo() and not self.useWSL):
+                #the upscaled unique frames are streamed straight into the rebuild, so are encoded once
+                upscaled_file = create_fifo(os.path.join(temp_dir, "upscaled_{0}".format(replace_extension(job.src_file_name, ".nut"))))
+                upscale = self.upscale_passes(job, decimated_file, upscaled_file, temp_dir, "dedup", plan.unique_frames, self.chain_codec)
+                await run_pipeline([(upscale, None, upscaled_file), (self.rebuild_frame_timing(job, upscaled_file, rebuilt_file, plan), upscaled_file)])
+            else:
+                upscaled_file = os.path.join(temp_dir, "upscaled_{0}".format(job.src_file_name))
+                await self.upscale_passes(job, decimated_file, upscaled_file, temp_dir, "dedup", plan.unique_frames)
+                await self.rebuild_frame_timing(job, upscaled_file, rebuilt_file, plan)
+
+        await self.mux_tracks(job, rebuilt_file, plan.total_frames)
+
+        return True
 
-        if (self.max_height > 0):
+    async def single_model_pass(self, job: UpscaleJob, src_file, temp_dir, feeder = None):
+
+        model = job.plan.passes[0]
+
+        total_frames = self.total_frames(job, True)
+
+        #the upscaler writes the video only, the tracks of the source are muxed with it after
+        scaled_file = os.path.join(temp_dir, "scaled_{0}".format(job.src_file_name))
+        upscale = self.super_resolution(src_file, scaled_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, total_frames=total_frames, thread_count=job.thread_count, **pass_labels(model))
+
+        async with self.scheduler.upscale:
+            if (feeder is not None):
+                await run_pipeline([(feeder, None, src_file), (upscale, src_file)])
+            else:
+                await upscale
+
+        await self.mux_tracks(job, scaled_file, total_frames)
+
+    def record_job(self, job: UpscaleJob, started: float, status: str):
+        if (self.metrics is not None):
+            self.metrics.write_job(job.src_file, job.dst_file, time.monotonic() - started, status, self.settings())
+
+    async def claim_job(self, job: UpscaleJob):
+        #the lease key is relative to the input directory and uses whole second mtimes, hosts may mount the share differently
+        stat = os.stat(job.src_file)
+        src = os.path.relpath(job.src_file, self.src_dir).replace(os.sep, "/")
+        return await asyncio.to_thread(self.lease_queue.claim, src, self.settings(), self.worker_id, stat.st_size, int(stat.st_mtime))
+
+    async def heartbeat_lease(self, lease: Lease, work: asyncio.Future):
+        #returns once the lease has expired and been taken by another worker, after cancelling the work on it
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
             try:
-                width, height = await self.get_video_dimensions(src_file)
-                self.setMaxScale(height, self.max_height)
+                if (not await asyncio.to_thread(self.lease_queue.heartbeat, lease)):
+                    logger.warning(f"Lost lease on {lease.src}, another worker has taken it, stopping")
+                    work.cancel()
+                    return
             except Exception as e:
-                logger.error(e)
+                #the queue may be back before the lease expires
+                logger.warning(f"Heartbeat failed for {lease.src}: {e}")
+
+    async def end_lease(self, lease: Lease, error: str = None):
+        try:
+            if (error is None):
+                await asyncio.to_thread(self.lease_queue.complete, lease)
+            else:
+                await asyncio.to_thread(self.lease_queue.release, lease, error)
+        except Exception as e:
+            logger.error(f"Unable to update lease on {lease.src}: {e}")
+
+    async def validate_job_output(self, job: UpscaleJob):
+        if (not os.path.exists(job.dst_file) or os.path.getsize(job.dst_file) == 0):
+            raise RuntimeError(f"No output written to {job.dst_file}")
+
+        if (self.validate):
+            #probed without the cache, the output was only just written
+            out_media = MediaInfo(await self.media_probe.run_ffprobe(job.dst_file))
+            validate_output(job.media, out_media, self.total_frames(job, True))
+
+    def remove_output(self, job: UpscaleJob):
+        #a failed job does not leave a broken output behind
+        try:
+            if (os.path.exists(job.dst_file)):
+                os.remove(job.dst_file)
+        except OSError as e:
+            logger.warning(f"Unable to remove output {job.dst_file}: {e}")
+
+    async def handle_failure(self, job: UpscaleJob, error: Exception):
+        #returns True when the job was queued to try again
+        failure = classify_failure(error)
+        job.attempts += 1
+
+        if (self.failure_policy.should_retry(job.attempts, failure)):
+            delay = self.failure_policy.delay(job.attempts)
+            change = self.failure_policy.degrade(job, job.media.duration if job.media is not None else 0, self.segments_apply(job)) if failure == FAILURE_OOM else None
+            logger.warning(f"Attempt {job.attempts} of {job.src_file} failed ({failure}), retrying in {delay:.0f}s{f" with {change}" if change else ""}: {error}")
+            self.scheduler.submit_later(job, delay)
+            return True
+
+        logger.error(f"Quarantining {job.src_file} after {job.attempts} attempts ({failure})")
+        job.status = STATUS_QUARANTINED
+        self.quarantine.add(job.src_file, error, failure, job.attempts)
+        self.mark_failed(job, STATUS_QUARANTINED, error)
+        return False
+
+    def mark_failed(self, job: UpscaleJob, status: str, error: Exception):
+        #a manifest that can not be written, eg the source was removed while it ran, must not stop the failure handling
+        if (self.manifest is None):
+            return
+
+        try:
+            self.manifest.mark(job.src_file, job.dst_file, status, str(error))
+        except Exception as e:
+            logger.warning(f"Unable to mark {job.src_file} {status} in the manifest: {e}")
+
+    def segments_apply(self, job: UpscaleJob):
+        #segments are cut from a file, a piped or streamed source is upscaled whole
+        try:
+            mode = self.select_pre_process(job.src_file, job.media, self.job_filters(job))
+        except ValueError:
+            return False
+
+        return mode not in (PRE_PROCESS_PIPE, PRE_PROCESS_FRAMES)
+
+    async def restore_result(self, job: UpscaleJob):
+        #places the cached output of a source with the same content and settings, returns False to upscale it.
+        #a job with the same content running now is waited for, it is cached when it ends
+        if (self.result_cache is None):
+            return False
+
+        try:
+            job.cache_key = await asyncio.to_thread(self.result_cache.key, job.src_file, self.settings())
+
+            while (job.cache_key in self.cache_running):
+                running_job, ended = self.cache_running[job.cache_key]
+                logger.info(f"Waiting for {running_job.src_file}, it has the same content as {job.src_file}")
+                await ended.wait()
+
+            #claimed before the lookup so a copy starting meanwhile waits for this one
+            self.cache_running[job.cache_key] = (job, asyncio.Event())
+            method = await asyncio.to_thread(self.result_cache.restore, job.cache_key, job.src_file, job.dst_file)
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed for {job.src_file}: {e}")
+            return False
+
+        if (method is not None):
+            logger.info(f"Restored {job.dst_file} from the result cache ({method})")
+            self.release_result(job)
+            return True
+
+        return False
+
+    async def store_result(self, job: UpscaleJob):
+        #a cache that can not be written never fails the job
+        if (self.result_cache is None or job.cache_key is None):
+            return
+
+        try:
+            if (await asyncio.to_thread(self.result_cache.store, job.cache_key, job.src_file, job.dst_file, self.settings())):
+                logger.info(f"Stored {job.dst_file} in the result cache")
+        except Exception as e:
+            logger.warning(f"Unable to store {job.dst_file} in the result cache: {e}")
+
+    def release_result(self, job: UpscaleJob):
+        running = self.cache_running.get(job.cache_key)
+
+        if (running is not None and running[0] is job):
+            del self.cache_running[job.cache_key]
+            running[1].set()
+
+    async def produce_output(self, job: UpscaleJob):
+        if (not await self.restore_result(job)):
+            await self.upscale_job(job)
+            await self.validate_job_output(job)
+            await self.store_result(job)
+
+    async def process_job(self, job: UpscaleJob):
+        #returns True when the job failed and was queued to try again
+        if (self.manifest is not None):
+            should_process, reason = self.manifest.should_process(job.src_file, job.dst_file)
+
+            if (not should_process):
+                logger.info(f"Skipping {job.src_file}, {reason}")
+                job.status = STATUS_SKIPPED
+                return False
+
+            logger.info(f"Queued {job.src_file}, {reason}")
+
+        lease = None
+        heartbeat = None
+
+        if (self.lease_queue is not None):
+            lease, reason = await self.claim_job(job)
+
+            if (lease is None):
+                logger.info(f"Skipping {job.src_file}, {reason}")
+                job.status = STATUS_SKIPPED
+                return False
+
+        if (self.manifest is not None):
+            self.manifest.mark(job.src_file, job.dst_file, STATUS_STARTED)
+
+        started = time.monotonic()
+        #an output restored from the result cache by an earlier run is a hardlink of the entry, it is removed
+        #rather than written over, also when this run has no cache
+        self.remove_output(job)
+
+        try:
+            work = asyncio.ensure_future(self.produce_output(job))
+            if (lease is not None):
+                heartbeat = asyncio.create_task(self.heartbeat_lease(lease, work))
+
+            await work
+        except asyncio.CancelledError:
+            if (not lease_lost(heartbeat)):
+                raise
+
+            #the worker that took the lease writes the output and the manifest, so neither is touched
+            logger.warning(f"Stopped {job.src_file}, its lease was taken by another worker")
+            job.status = STATUS_SKIPPED
+            return False
+        except Exception as e:
+            self.remove_output(job)
+            job.status = STATUS_FAILED
+
+            self.mark_failed(job, STATUS_FAILED, e)
+            self.record_job(job, started, STATUS_FAILED)
+
+            #released on every failed attempt, another host may take the file during the backoff
+            if (lease is not None):
+                await self.end_lease(lease, str(e))
+
+            if (await self.handle_failure(job, e)):
+                return True
+            raise
+        finally:
+            if (heartbeat is not None):
+                heartbeat.cancel()
+            self.release_result(job)
+
+        if (self.manifest is not None):
+            self.manifest.mark(job.src_file, job.dst_file, STATUS_DONE)
+        self.record_job(job, started, STATUS_DONE)
+        job.status = STATUS_DONE
+
+        if (lease_lost(heartbeat)):
+            logger.warning(f"Finished {job.src_file} after its lease was taken by another worker, not completing it")
+        elif (lease is not None):
+            await self.end_lease(lease)
+
+        return False
+
+    def scratch_estimate(self, job: UpscaleJob, mode: str, dedup: bool = False):
+        #bytes of temp files the job writes at most, from the probed duration and resolution
+        media = job.media
+        if (media is None or media.width <= 0 or media.height <= 0):
+            return 0
+
+        #without a model the source is encoded straight to the output
+        if (not job.plan.passes):
+            return 0
+
+        frames = self.total_frames(job)
+        out_frames = self.total_frames(job, True)
+        src_size = os.path.getsize(job.src_file)
+        passes = job.plan.dimensions
+        out_width, out_height, _ = passes[-1]
+        estimate = 0
+
+        if (dedup):
+            #the lossless unique frames, the rebuilt output, and the upscaled unique frames when they can not be piped
+            estimate = lossless_bytes(media.width, media.height, frames) + lossy_bytes(out_width, out_height, frames)
+            if (not supports_fifo() or self.useWSL):
+                estimate += lossy_bytes(out_width, out_height, frames)
+            return estimate
+
+        if (mode == PRE_PROCESS_TRANSCODE):
+            estimate += lossless_bytes(media.width, media.height, frames)
+        elif (mode == PRE_PROCESS_REMUX):
+            estimate += src_size
+
+        if (job.segment_seconds > 0 and mode not in (PRE_PROCESS_PIPE, PRE_PROCESS_FRAMES) and media.duration > job.segment_seconds):
+            #segment copies of the source, the upscaled segments and the joined file
+            return estimate + src_size + 2 * lossy_bytes(out_width, out_height, out_frames)
+
+        if (job.plan.chained):
+            if (not self.chain_pipe):
+                for width, height, lossless in passes[:-1]:
+                    estimate += lossless_bytes(width, height, frames) if lossless else lossy_bytes(width, height, frames)
+            estimate += lossy_bytes(out_width, out_height, out_frames)
+        else:
+            #the upscaled video only file before the mux, transcoded tracks are small beside it
+            estimate += lossy_bytes(out_width, out_height, out_frames)
 
-        await self.super_resolution(src_file, dst_file, self.model, self.model_type, self.scale, self.width, self.height)
-        #await self.super_resolution(src_file, output_path, self.model, self.model_type, self.scale, self.width, self.height)
-        #await self.mux_audio(original_src_file, output_path, dst_file)
+        return estimate
 
+    async def upscale_job(self, job: UpscaleJob):
+        #ordered jobs were probed and planned when they were queued
+        if (job.media is None):
+            job.media = await self.probe_job(job)
+            job.plan = None
 
-    async def process_video(self):
+        if (job.plan is None):
+            job.plan = self.plan_job(job)
+        mode = self.select_pre_process(job.src_file, job.media, self.job_filters(job))
+        dedup = self.dedup_frames and job.media is not None
+
+        #waits for the scratch space the job needs, the temp directory is always removed
+        async with self.scratch.job_dir(job.src_file_name, self.scratch_estimate(job, mode, dedup)) as temp_dir:
+            self.start_tracks(job, temp_dir)
+
+            try:
+                await self.upscale_video(job, mode, dedup, temp_dir)
+            finally:
+                #the video failed or was cancelled, the temp directory is about to be removed
+                await self.stop_tracks(job)
+
+    async def fit_pass(self, job: UpscaleJob, mode: str, temp_dir: str):
+        #no model runs, the source is encoded at the fitted size with the tracks. Filtered frames are streamed to the encoder
+        logger.info(f"Not upscaling {job.src_file}, {job.plan.reason}")
+
+        if (mode == PRE_PROCESS_FRAMES):
+            fifo = create_fifo(os.path.join(temp_dir, "frames_{0}".format(replace_extension(job.src_file_name, ".y4m"))))
+            await run_pipeline([(self.frame_source(job, fifo), None, fifo), (self.mux_tracks(job, fifo, self.total_frames(job)), fifo)])
+        else:
+            await self.mux_tracks(job, job.src_file, self.total_frames(job))
+
+    async def upscale_video(self, job: UpscaleJob, mode: str, dedup: bool, temp_dir: str):
+        feeder = None
+        src_file = job.src_file
+
+        if (not job.plan.passes):
+            await self.fit_pass(job, mode, temp_dir)
+            return
+
+        #the decimate pass decodes the source itself so it replaces the pre process
+        if (dedup and await self.dedup_pass(job, temp_dir)):
+            return
+
+        if (mode == PRE_PROCESS_PIPE):
+            src_file = create_fifo(os.path.join(temp_dir, "piped_{0}".format(replace_extension(job.src_file_name, ".nut"))))
+            feeder = self.pipe_source(job.src_file, src_file, job.src_file_name, self.total_frames(job))
+            logger.info(f"Streaming Source {job.src_file} through {src_file}")
+        elif (mode == PRE_PROCESS_FRAMES):
+            src_file = create_fifo(os.path.join(temp_dir, "frames_{0}".format(replace_extension(job.src_file_name, ".y4m"))))
+            feeder = self.frame_source(job, src_file)
+        elif (mode in (PRE_PROCESS_REMUX, PRE_PROCESS_TRANSCODE)):
+            async with self.scheduler.transcode:
+                src_file = await self.pre_process(job.src_file, job.src_file_name, temp_dir, mode == PRE_PROCESS_REMUX, self.total_frames(job))
+
+            logger.info(f"Converted Source from {job.src_file} to {src_file}")
+
+        logger.info(f"Processing Source {src_file}")
+
+        #segments are cut from a file, a piped source is upscaled whole
+        if (job.segment_seconds > 0 and feeder is None and job.media is not None and job.media.duration > job.segment_seconds):
+            if (await self.segmented_pass(job, src_file, temp_dir)):
+                return
+
+        if (job.plan.chained):
+            await self.multi_model_pass(job, src_file, temp_dir, feeder)
+        else:
+            await self.single_model_pass(job, src_file, temp_dir, feeder)
+
+    def command_plan(self, job: UpscaleJob, temp_dir: str, mode: str = None):
+        '''
+            The commands upscale_job runs for a probed and planned job, as a list of { "stage", "cmd" }
+            in order, without running anything. Commands in a pipe run at once. Segments and duplicate
+            frame skipping depend on scans made while the job runs, these are planned as the whole file.
+        '''
+        mode = mode if mode else self.select_pre_process(job.src_file, job.media, self.job_filters(job))
+        commands = []
+
+        #without a model the source, or its filtered frames, go straight to the mux
+        if (not job.plan.passes and mode != PRE_PROCESS_FRAMES):
+            mode = PRE_PROCESS_NONE
+
+        src_file = job.src_file
+        job.tracks = plan_tracks(job.media, self.profile)
+        tracks_cmd, tracks_file = self.tracks_command(job, temp_dir)
+
+        if (tracks_cmd is not None):
+            #runs alongside the video stages
+            commands.append({ "stage": "tracks", "cmd": tracks_cmd })
+
+        if (mode == PRE_PROCESS_PIPE):
+            src_file = os.path.join(temp_dir, "piped_{0}".format(replace_extension(job.src_file_name, ".nut")))
+            commands.append({ "stage": "pipe", "cmd": self.pipe_command(job.src_file, src_file) })
+        elif (mode == PRE_PROCESS_FRAMES):
+            #the decoded frames are filtered in process and written to this fifo
+            src_file = os.path.join(temp_dir, "frames_{0}".format(replace_extension(job.src_file_name, ".y4m")))
+            commands.append({ "stage": "frames", "cmd": self.frames_command(job.src_file) })
+        elif (mode in (PRE_PROCESS_REMUX, PRE_PROCESS_TRANSCODE)):
+            cmd, src_file = self.pre_process_command(job.src_file, job.src_file_name, temp_dir, mode == PRE_PROCESS_REMUX)
+            commands.append({ "stage": mode, "cmd": cmd })
+
+        passes = job.plan.passes
+        chain_pipe = job.plan.chained and self.chain_pipe and supports_fifo() and not self.useWSL
+        next_src_file = src_file
+
+        for index, model in enumerate(passes):
+            final = index == len(passes) - 1
+
+            if (not job.plan.chained):
+                next_dst_file = os.path.join(temp_dir, "scaled_{0}".format(job.src_file_name))
+            elif (not chain_pipe):
+                next_dst_file = os.path.join(temp_dir, "scaled_{0}_{1}_{2}".format(index, model["model"].name, job.src_file_name))
+            elif (final):
+                next_dst_file = os.path.join(temp_dir, "scaled_{0}_{1}".format(model["model"].name, job.src_file_name))
+            else:
+                next_dst_file = os.path.join(temp_dir, "chain_{0}_{1}".format(index, replace_extension(job.src_file_name, ".nut")))
+
+            codec = self.chain_codec if chain_pipe and not final else None
+            profile = self.stage_profile(model) if job.plan.chained and codec is None else None
+            commands.append({ "stage": "upscale", "cmd": self.upscale_command(next_src_file, next_dst_file, model["model"], model["type"], model["scale"], model["width"], model["height"], True, model["lossless"], codec, profile, job.thread_count) })
+            next_src_file = next_dst_file
+
+        commands.append({ "stage": "mux", "cmd": self.mux_command(job, next_src_file, tracks_file) })
+        return commands
+
+    async def plan_file(self, src_file: str):
+        #probes and plans one file, returns the job and its command plan. Nothing is run
+        job = self.create_job(src_file)
+        job.media = await self.probe_job(job)
+        job.plan = self.plan_job(job)
+        return job, self.command_plan(job, os.path.join(self.scratch.root, "<job temp dir>"))
+
+    async def dry_run_batch(self):
+        #logs the commands every file in the input directory would run
+        for src_file in (job.src_file for job in self.find_jobs()):
+            job, commands = await self.plan_file(src_file)
 
+            for command in commands:
+                logger.info(f"Dry run {job.src_file} {command["stage"]}: {shlex.join(str(arg) for arg in command["cmd"])}")
+
+    def create_job(self, src_file: str):
+        src_file_name = replace_extension(os.path.basename(src_file), ".mp4")
+        job = UpscaleJob(src_file, src_file_name, os.path.join(self.out_dir, src_file_name))
+        job.thread_count = self.thread_count
+        job.segment_seconds = self.segment_seconds
+        return job
+
+    def find_jobs(self):
         for root, dirs, files in os.walk(self.src_dir):
             for file in files:
-                try:
-                    with tempfile.TemporaryDirectory(delete=False) as temp_dir:
-                            logger.info(f"Creating Temp Directory {temp_dir}")
-
-                            src_file_name = replace_extension(file, ".mp4")
-                        
-
-                            original_src_file = os.path.join(root, file)
-                            dst_file = os.path.join(self.out_dir, src_file_name)
-                            
-                            if (os.path.splitext(file)[1] != ".mp4"):
-                                src_file = await self.pre_process(original_src_file, src_file_name, temp_dir)
-                                #await asyncio.sleep(20)
-
-                                logger.info(f"Converted Source from {original_src_file} to {src_file}")
-                            else:
-                                src_file = original_src_file
-
-                            logger.info(f"Processing Source {src_file}")
-
-                            if (self.models):
-                                await self.multi_model_pass(src_file, src_file_name, temp_dir, dst_file)
-                            else:
-                                await self.single_model_pass(src_file, dst_file)
-                            
-                            #await asyncio.sleep(10)
-                finally:
-                    """"""
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
-
-                await asyncio.sleep(10)
+                #per source priority settings, not a source
+                if (file.endswith(SIDECAR_SUFFIX)):
+                    continue
+
+                yield self.create_job(os.path.join(root, file))
+
+    async def estimate_job(self, job: UpscaleJob):
+        #probes and plans the job before it is queued so it can be ordered by its cost
+        job.media = await self.probe_job(job)
+        job.plan = self.plan_job(job)
+        job.cost = await asyncio.to_thread(self.cost_model.estimate, job.plan, job.media.frame_count if job.media is not None else 0, self.backend.name, self.frame_rate_mul, job.thread_count)
+
+        try:
+            priority, deadline = self.priority_rules.lookup(job.src_file, self.src_dir)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring priority settings of {job.src_file}: {e}")
+            priority, deadline = 0, None
+
+        job.sort_key = order_key(self.order, job.cost, priority, deadline)
+
+    async def estimate_jobs(self, jobs: list):
+        limit = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+        async def estimate(job):
+            async with limit:
+                await self.estimate_job(job)
+
+        await asyncio.gather(*(estimate(job) for job in jobs))
+
+    async def order_jobs(self, jobs):
+        #walk order queues jobs as they are found, the others probe every job first
+        if (self.order == ORDER_WALK):
+            return jobs
+
+        jobs = list(jobs)
+        await self.estimate_jobs(jobs)
+
+        jobs.sort(key=lambda job: job.sort_key)
+        for index, job in enumerate(jobs):
+            logger.info(f"Order {index + 1}/{len(jobs)} ({self.order}) {job.src_file}, estimated {format_cost(job.cost)}")
+
+        return jobs
+
+    def prepare_output(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.scratch.sweep_orphans()
+
+        if (self.resume):
+            self.manifest = JobManifest(self.out_dir, self.settings(), retry_quarantined=self.retry_quarantined)
+
+        self.quarantine = QuarantineList(self.out_dir)
+
+        self.metrics = MetricsRecorder(self.metrics_path())
+        self.log_thread_counts()
+
+        if (self.order != ORDER_WALK):
+            self.cost_model = CostModel.from_metrics(read_metrics(self.metrics.path), self.perf_profile)
+            logger.info(f"Ordering jobs by {self.order}, {self.cost_model}")
+
+    def metrics_path(self):
+        return self.metrics_file if self.metrics_file else os.path.join(self.out_dir, METRICS_FILE_NAME)
+
+    def planned_models(self):
+        #(model, type, scale) of the configured model or every model of the chain
+        if (self.models):
+            return [(item["model"], item["type"], item["scale"]) for item in self.models]
+
+        return [(self.model, self.model_type, self.scale)]
+
+    def log_thread_counts(self):
+        #the fastest thread count recorded on this host for each model when it is not the one in use
+        for model, model_type, scale in self.planned_models():
+            suggested = self.perf_profile.suggest_thread_count(self.backend.name, model.name, model_type, scale)
+
+            if (suggested is not None and suggested != self.thread_count):
+                rates = ", ".join(f"{thread_count}: {rate:.2f}" for thread_count, rate in self.perf_profile.thread_rates(self.backend.name, model.name, model_type).items())
+                logger.info(f"Recorded runs suggest --tc {suggested} for {model.name} {model_type}, megapixels per second by thread count {rates}")
+
+    async def estimate_batch(self):
+        #probes and plans every file and reports the expected upscale time, nothing is processed
+        self.cost_model = CostModel.from_metrics(read_metrics(self.metrics_path()), self.perf_profile)
+        manifest = None
+
+        if (self.resume and os.path.exists(os.path.join(self.out_dir, MANIFEST_FILE_NAME))):
+            manifest = JobManifest(self.out_dir, self.settings(), retry_quarantined=self.retry_quarantined)
+
+        jobs = []
+        for job in self.find_jobs():
+            should_process, reason = manifest.should_process(job.src_file, job.dst_file) if manifest is not None else (True, "new")
+
+            if (should_process):
+                jobs.append(job)
+            else:
+                logger.info(f"Estimate {job.src_file}: skipped, {reason}")
+
+        await self.estimate_jobs(jobs)
+
+        total = 0.0
+        unknown = 0
+
+        for job in jobs:
+            if (job.cost == UNKNOWN_COST):
+                unknown += 1
+                logger.info(f"Estimate {job.src_file}: unknown, not probed")
+                continue
+
+            total += job.cost
+            passes = self.cost_model.estimate_passes(job.plan, job.media.frame_count, self.backend.name, self.frame_rate_mul, job.thread_count)
+            basis = ", ".join(sorted(set(item for _, item in passes)))
+            logger.info(f"Estimate {job.src_file}: {format_cost(job.cost)} ({basis}) {job.media.frame_count} frames, {job.plan}")
+
+        #jobs are whole units of work, a worker count beyond the job count does not help
+        workers = max(min(self.scheduler.upscale_workers, len(jobs)), 1)
+        wall = max(total / workers, max((job.cost for job in jobs if job.cost != UNKNOWN_COST), default=0))
+        logger.info(f"Estimated upscale time {format_cost(total)} for {len(jobs) - unknown} files, {format_cost(wall)} with {workers} upscale workers{f", {unknown} files not estimated" if unknown else ""}")
+
+        if (self.estimate_hours > 0):
+            hosts = max(math.ceil(wall / (self.estimate_hours * 3600)), 1)
+            logger.info(f"{hosts} hosts like this one finish in {self.estimate_hours:g} hours")
+
+        self.log_thread_counts()
+
+    async def calibration_source(self):
+        #the first source that probes, planned at its unfiltered size as the clip is cut from it
+        for job in self.find_jobs():
+            try:
+                job.media = await self.probe(job.src_file)
+            except Exception as e:
+                logger.warning(f"Not calibrating with {job.src_file}, unable to probe it: {e}")
+                continue
+
+            if (job.media.width > 0 and job.media.height > 0):
+                job.filters = FrameFilters()
+                job.plan = self.plan_job(job)
+
+                if (job.plan.passes):
+                    return job
+
+                logger.info(f"Not calibrating with {job.src_file}, {job.plan.reason}")
+
+        return None
+
+    async def calibration_run(self, job: UpscaleJob, clip_file: str, temp_dir: str, thread_count: int, workers: int, frames: int):
+        #frames per second of every worker together, each upscaling the clip through every planned pass. None when a run fails
+        job.thread_count = thread_count
+        total_frames = frames * self.frame_rate_mul if not self.models and self.frame_rate_mul > 0 else frames
+        prefix = f"tune_{thread_count}_{workers}"
+        started = time.monotonic()
+
+        results = await asyncio.gather(*(self.upscale_passes(job, clip_file, os.path.join(temp_dir, f"{prefix}_{index}.mp4"), temp_dir, f"{prefix}_{index}", total_frames) for index in range(workers)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+
+        if (errors):
+            if (not isinstance(errors[0], CommandError)):
+                raise errors[0]
+
+            logger.warning(f"Calibration with thread count {thread_count} and {workers} workers failed: {errors[0]}")
+            return None
+
+        return workers * frames / (time.monotonic() - started)
+
+    async def autotune_batch(self):
+        '''
+            Upscales a clip of the first source at each of the thread counts, then with more workers at once at
+            the fastest of them, and saves the fastest configuration for this host. Each pass is recorded to the
+            throughput profile too. A higher count has to be AUTOTUNE_MIN_GAIN faster to be chosen.
+        '''
+        job = await self.calibration_source()
+        if (job is None):
+            raise ValueError(f"No source in {self.src_dir} to calibrate with")
+
+        frames = min(AUTOTUNE_FRAMES, job.media.frame_count) if job.media.frame_count > 0 else AUTOTUNE_FRAMES
+        workers_max = max(self.autotune_workers)
+        estimate = lossy_bytes(job.media.width, job.media.height, frames) + workers_max * sum(lossy_bytes(item.get("out_width", 0), item.get("out_height", 0), frames) for item in job.plan.passes)
+
+        if (self.frame_filters.active or self.auto_crop):
+            logger.info("Calibrating on unfiltered frames of the source")
+
+        async with self.scratch.job_dir("autotune", estimate) as temp_dir:
+            #stage metrics of the calibration runs, the upscale stages are recorded to the throughput profile from them
+            self.metrics = MetricsRecorder(os.path.join(temp_dir, METRICS_FILE_NAME))
+            clip_file = os.path.join(temp_dir, "clip.mp4")
+            start = clip_start(job.media.duration, job.media.fps, frames)
+            await self.run_stage([self.ffmpeg_bin] + clip_args(job.src_file, start, frames, clip_file), "clip", job.src_file, f"Cutting a {frames} frame calibration clip", frames)
+
+            clip_job = self.create_job(clip_file)
+            clip_job.media = job.media
+            clip_job.plan = job.plan
+
+            thread_rates = {}
+            for thread_count in self.autotune_threads:
+                rate = await self.calibration_run(clip_job, clip_file, temp_dir, thread_count, 1, frames)
+                if (rate is not None):
+                    thread_rates[thread_count] = rate
+
+            if (not thread_rates):
+                raise RuntimeError(f"Every calibration run failed for {self.model_name}")
+
+            thread_count = pick_best(thread_rates)
+            logger.info(f"Autotune thread counts {format_rates(thread_rates)}, chose {thread_count}")
+
+            worker_rates = { 1: thread_rates[thread_count] }
+            for workers in self.autotune_workers:
+                if (workers == 1):
+                    continue
+
+                rate = await self.calibration_run(clip_job, clip_file, temp_dir, thread_count, workers, frames)
+                #more workers than this fail too, eg out of GPU memory
+                if (rate is None):
+                    break
+
+                worker_rates[workers] = rate
+
+            upscale_workers = pick_best(worker_rates)
+            logger.info(f"Autotune upscale workers {format_rates(worker_rates)}, chose {upscale_workers}")
+
+        backend, model, model_type, scale = self.tuning_key()
+        await asyncio.to_thread(self.perf_profile.save_tuning, backend, model, model_type, scale, thread_count, upscale_workers, worker_rates[upscale_workers])
+        logger.info(f"Saved thread count {thread_count} and {upscale_workers} upscale workers for {model} {model_type} scale {scale} on {self.perf_profile.host}, run with --tc 0 --upscale_workers 0 to use them")
+
+    async def process_video(self):
+        self.prepare_output()
+        await self.scheduler.run(await self.order_jobs(self.find_jobs()), self.process_job)
+
+    async def submit_watched(self, src_file: str):
+        if (src_file.endswith(SIDECAR_SUFFIX)):
+            return
+
+        if (src_file in self.watch_active):
+            #changed again while queued or running, submitted once more when that run ends
+            self.watch_changed.add(src_file)
+            return
+
+        self.watch_active.add(src_file)
+        job = self.create_job(src_file)
+
+        #only files waiting together are reordered, a running job is never preempted
+        if (self.order != ORDER_WALK):
+            await self.estimate_job(job)
+
+        self.scheduler.submit(job)
+
+    async def process_watched_job(self, job: UpscaleJob):
+        requeued = False
+        try:
+            requeued = await self.process_job(job)
+        finally:
+            #a job waiting to be retried is still active
+            if (not requeued):
+                self.watch_active.discard(job.src_file)
+
+                if (job.src_file in self.watch_changed):
+                    self.watch_changed.discard(job.src_file)
+                    await self.submit_watched(job.src_file)
+
+    async def watch_folder(self):
+        #long running, the workers stay up and only new or changed files are queued
+        self.prepare_output()
+        watcher = create_watcher(self.src_dir, self.settle_seconds, self.watch_interval, [self.out_dir], not self.watch_poll)
+        self.scheduler.start(self.process_watched_job)
+
+        try:
+            async for src_file in watcher.changes():
+                logger.info(f"Queueing {src_file}")
+                await self.submit_watched(src_file)
+        finally:
+            await self.scheduler.stop()
+
+    async def process_submitted_job(self, job: UpscaleJob):
+        try:
+            requeued = await self.process_job(job)
+        except asyncio.CancelledError:
+            job.result.cancel()
+            raise
+        except Exception as e:
+            job.result.set_exception(e)
+            raise
+
+        if (not requeued):
+            job.result.set_result(job)
+
+    async def start(self):
+        #starts the workers for files submitted from code rather than found in the input directory
+        self.prepare_output()
+        self.progress = Progress()
+        self.progress.start()
+        self.scheduler.start(self.process_submitted_job)
+
+    async def submit(self, src_file: str):
+        '''
+            Queues a file on a started upscaler. Returns a future of its UpscaleJob, resolved once the job
+            is done or skipped with job.status set, or with the error of a job that failed for good.
+            It stays pending while a failed attempt waits to be retried.
+        '''
+        job = self.create_job(src_file)
+        job.result = asyncio.get_running_loop().create_future()
+
+        if (self.order != ORDER_WALK):
+            await self.estimate_job(job)
+
+        self.scheduler.submit(job)
+        return job.result
+
+    async def close(self, wait: bool = True):
+        #waits for every submitted job unless wait is False, then stops the workers
+        try:
+            if (wait):
+                await self.scheduler.join()
+            else:
+                await self.scheduler.stop()
+        finally:
+            if (self.progress is not None):
+                self.progress.stop()
+                self.progress = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(exc_type is None)
+
+    async def upscale_files(self, src_files: list):
+        #runs the files as one batch and returns the finished job or the error of each, in order
+        async with self:
+            results = [await self.submit(src_file) for src_file in src_files]
+
+        return await asyncio.gather(*results, return_exceptions=True)
 
     async def rescale(self):
-        await self.process_video()
+        with Progress() as progress:
+            self.progress = progress
+            try:
+                if (self.dry_run):
+                    await self.dry_run_batch()
+                elif (self.autotune):
+                    await self.autotune_batch()
+                elif (self.estimate):
+                    await self.estimate_batch()
+                elif (self.watch):
+                    await self.watch_folder()
+                else:
+                    await self.process_video()
+            finally:
+                self.progress = None
         
     def run(self):
         asyncio.run(self.rescale())
@@ -453,12 +1743,64 @@ def main():
     parser.add_argument('--hd', action='store_true')
     parser.add_argument('--fourk', action='store_true')
     parser.add_argument('--frame_rate_mul', type=int, default=0)
+    parser.add_argument('--upscale_workers', type=int, default=1)
+    parser.add_argument('--transcode_workers', type=int, default=1)
+    parser.add_argument('--no_resume', action='store_true')
+    parser.add_argument('--pre_process', choices=PRE_PROCESS_MODES, default=PRE_PROCESS_AUTO)
+    parser.add_argument('--chain_pipe', action='store_true')
+    parser.add_argument('--chain_codec', default="ffv1")
+    parser.add_argument('--cache_dir', default=None)
+    parser.add_argument('--segment_seconds', type=float, default=0)
+    parser.add_argument('--video2x_bin', default=None)
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND_VIDEO2X)
+    parser.add_argument('--profile', default=None)
+    parser.add_argument('--pre_process_profile', default="x265")
+    parser.add_argument('--profiles_file', default=None)
+    parser.add_argument('--metrics', default=None)
+    parser.add_argument('--watch', action='store_true')
+    parser.add_argument('--settle_seconds', type=float, default=5.0)
+    parser.add_argument('--watch_interval', type=float, default=2.0)
+    parser.add_argument('--watch_poll', action='store_true')
+    parser.add_argument('--work_queue', default=None)
+    parser.add_argument('--worker_id', default=None)
+    parser.add_argument('--lease_seconds', type=float, default=120)
+    parser.add_argument('--scratch_dir', default=None)
+    parser.add_argument('--scratch_min_free', type=float, default=1.0)
+    parser.add_argument('--dedup_frames', action='store_true')
+    parser.add_argument('--target', default=None)
+    parser.add_argument('--max_passes', type=int, default=2)
+    parser.add_argument('--stall_timeout', type=float, default=0)
+    parser.add_argument('--max_attempts', type=int, default=3)
+    parser.add_argument('--retry_backoff', type=float, default=30)
+    parser.add_argument('--no_validate', action='store_true')
+    parser.add_argument('--retry_quarantined', action='store_true')
+    parser.add_argument('--order', choices=ORDERS, default=ORDER_WALK)
+    parser.add_argument('--priority_rules', default=None)
+    parser.add_argument('--estimate', action='store_true')
+    parser.add_argument('--estimate_hours', type=float, default=0)
+    parser.add_argument('--dry_run', action='store_true')
+    parser.add_argument('--result_cache_gb', type=float, default=0)
+    parser.add_argument('--result_cache_dir', default=None)
+    parser.add_argument('--crop', default=None)
+    parser.add_argument('--pre_resize', default=None)
+    parser.add_argument('--deinterlace', action='store_true')
+    parser.add_argument('--denoise', type=int, default=0)
+    parser.add_argument('--auto_crop', action='store_true')
+    parser.add_argument('--auto_crop_pad', action='store_true')
+    parser.add_argument('--autotune', action='store_true')
+    parser.add_argument('--autotune_threads', default=AUTOTUNE_THREAD_COUNTS)
+    parser.add_argument('--autotune_workers', default=AUTOTUNE_WORKERS)
+    parser.add_argument('--governor_min_free', type=float, default=0)
+    parser.add_argument('--governor_max_load', type=float, default=0)
+    parser.add_argument('--governor_interval', type=float, default=5.0)
    
     args = parser.parse_args()
 
     try:
-        videoscaler = VideoUpscaler(args.input, args.output, args.model, args.model_type, args.scale, args.noise_level, args.hd, args.fourk, args.tc, args.mh, args.frame_rate_mul)
+        videoscaler = VideoUpscaler.from_config(UpscaleConfig.from_args(args))
         videoscaler.run()
+    except KeyboardInterrupt:
+        logger.info("Stopped")
     except Exception as e:
         logger.error(e)
         print(traceback.format_exc())
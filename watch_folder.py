@@ -0,0 +1,218 @@
+'''
+    Video Upscaler
+    Watching the input directory for new or changed files, inotify on Linux with a polling fallback
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger("videoupscaler")
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class FolderWatcher:
+    '''
+        Polls the input tree for new or changed files. A file is only reported once its size
+        and mtime have not changed for settle_seconds, so files still being copied in are not picked up.
+        A file is reported again only if its size or mtime changes after it was reported.
+    '''
+
+    polling = True
+
+    def __init__(self, src_dir: str, settle_seconds: float = 5.0, poll_interval: float = 2.0, ignore_dirs: list = None):
+        self.src_dir = os.path.abspath(src_dir)
+        self.settle_seconds = float(settle_seconds)
+        self.poll_interval = float(poll_interval)
+        self.ignore_dirs = [os.path.abspath(path) for path in (ignore_dirs or [])]
+        #path -> (size, mtime_ns, stable since) of files waiting to settle
+        self.pending = {}
+        #path -> (size, mtime_ns) when last reported
+        self.reported = {}
+
+    def ignored(self, path: str):
+        #hidden files are usually partial copies, eg rsync temp files
+        if (os.path.basename(path).startswith(".")):
+            return True
+
+        return any(path == directory or path.startswith(directory + os.sep) for directory in self.ignore_dirs)
+
+    def track(self, path: str):
+        #files already waiting are re-checked by ready(), writes to them do not need a stat
+        if (path in self.pending or self.ignored(path)):
+            return
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        state = (stat.st_size, stat.st_mtime_ns)
+
+        if (self.reported.get(path) == state):
+            return
+
+        #a file already older than the settle time on first sight does not need to wait
+        self.pending[path] = state + (min(time.time(), stat.st_mtime_ns / 1e9),)
+
+    def scan(self, directory: str = None):
+        for root, dirs, files in os.walk(directory or self.src_dir):
+            dirs[:] = [name for name in dirs if not self.ignored(os.path.join(root, name))]
+
+            for file in files:
+                self.track(os.path.join(root, file))
+
+    def ready(self):
+        now = time.time()
+        ready = []
+
+        for path, (size, mtime, stable_since) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+
+            if ((stat.st_size, stat.st_mtime_ns) != (size, mtime) or stat.st_size == 0):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif (now - stable_since >= self.settle_seconds):
+                del self.pending[path]
+                self.reported[path] = (size, mtime)
+                ready.append(path)
+
+        return sorted(ready)
+
+    def start(self):
+        logger.info(f"Polling {self.src_dir} every {self.poll_interval}s")
+
+    def close(self):
+        pass
+
+    async def changes(self):
+        #async generator of settled new or changed file paths, runs until cancelled
+        self.start()
+        try:
+            self.scan()
+            while True:
+                for path in self.ready():
+                    yield path
+
+                await asyncio.sleep(self.poll_interval)
+
+                if (self.polling):
+                    self.scan()
+        finally:
+            self.close()
+
+
+class InotifyWatcher(FolderWatcher):
+    '''
+        Linux inotify through ctypes, only the files named in events are checked so the tree
+        is walked once at startup and again only if the kernel event queue overflows.
+    '''
+
+    polling = False
+
+    def __init__(self, src_dir: str, settle_seconds: float = 5.0, poll_interval: float = 2.0, ignore_dirs: list = None):
+        super().__init__(src_dir, settle_seconds, poll_interval, ignore_dirs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = -1
+        self.watches = {}
+
+    def add_watch(self, directory: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if (wd < 0):
+            error = ctypes.get_errno()
+            logger.warning(f"Unable to watch {directory}: {os.strerror(error)}")
+            return
+
+        self.watches[wd] = directory
+
+    def add_tree(self, directory: str):
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [name for name in dirs if not self.ignored(os.path.join(root, name))]
+            self.add_watch(root)
+
+    def start(self):
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if (self.fd < 0):
+            #eg the per user instance limit is reached
+            logger.warning(f"inotify_init1 failed, polling instead: {os.strerror(ctypes.get_errno())}")
+            self.polling = True
+            super().start()
+            return
+
+        self.add_tree(self.src_dir)
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+        logger.info(f"Watching {self.src_dir} with inotify, {len(self.watches)} directories")
+
+    def close(self):
+        if (self.fd >= 0):
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if (mask & IN_Q_OVERFLOW):
+                logger.warning("inotify queue overflow, rescanning")
+                self.scan()
+                continue
+
+            if (mask & IN_IGNORED):
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if (directory is None or not name):
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+
+            if (mask & IN_ISDIR):
+                if (mask & (IN_CREATE | IN_MOVED_TO) and not self.ignored(path)):
+                    #files can land in a new directory before its watch is added
+                    self.add_tree(path)
+                    self.scan(path)
+            else:
+                self.track(path)
+
+
+def create_watcher(src_dir: str, settle_seconds: float = 5.0, poll_interval: float = 2.0, ignore_dirs: list = None, use_inotify: bool = True):
+    if (use_inotify and sys.platform.startswith("linux")):
+        try:
+            watcher = InotifyWatcher(src_dir, settle_seconds, poll_interval, ignore_dirs)
+            if (hasattr(watcher.libc, "inotify_init1")):
+                return watcher
+        except OSError as e:
+            logger.warning(f"inotify unavailable, polling instead: {e}")
+
+    return FolderWatcher(src_dir, settle_seconds, poll_interval, ignore_dirs)
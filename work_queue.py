@@ -0,0 +1,316 @@
+'''
+    Video Upscaler
+    Lease based work queue so several hosts can share one input directory
+    Author: danrossi <electroteque@protonmail.com>
+'''
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("videoupscaler")
+
+LEASE_CLAIMED = "claimed"
+LEASE_DONE = "done"
+LEASE_RELEASED = "released"
+
+
+def settings_key(settings: dict):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+
+    def __init__(self, src: str, settings: dict, worker: str, expires: float, size: int = 0, mtime: int = 0):
+        #src is relative to the shared input directory as hosts may mount it at different paths
+        self.src = src
+        self.settings = settings
+        self.settings_key = settings_key(settings)
+        self.worker = worker
+        self.expires = expires
+        self.size = size
+        self.mtime = mtime
+
+    def to_dict(self):
+        return {
+            "src": self.src,
+            "settings": self.settings,
+            "worker": self.worker,
+            "expires": self.expires,
+            "size": self.size,
+            "mtime": self.mtime
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        return Lease(data["src"], data["settings"], data["worker"], data["expires"], data.get("size", 0), data.get("mtime", 0))
+
+    def __repr__(self):
+        return f"Lease({self.src} {self.worker} expires {self.expires:.0f})"
+
+
+class SqliteLeaseQueue:
+    '''
+        Leases in a SQLite database, on a shared filesystem the database file lock serialises claims
+        between hosts. A lease is keyed on the file and the settings hash so workers running
+        different models or scales over the same directory do not block each other. A claim expires
+        unless heartbeated, so files held by a host that died are picked up by another.
+    '''
+
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = int(max_attempts)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        db = self.connect()
+        try:
+            db.execute("""CREATE TABLE IF NOT EXISTS leases (
+                src TEXT NOT NULL,
+                settings_key TEXT NOT NULL,
+                settings TEXT,
+                size INTEGER,
+                mtime INTEGER,
+                worker TEXT,
+                status TEXT,
+                expires REAL,
+                attempts INTEGER DEFAULT 0,
+                updated REAL,
+                error TEXT,
+                PRIMARY KEY (src, settings_key))""")
+        finally:
+            db.close()
+
+    def connect(self):
+        #a connection per call, calls come from executor threads
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def claim(self, src: str, settings: dict, worker: str, size: int = 0, mtime: int = 0, max_attempts: int = None):
+        #returns (lease or None, reason). max_attempts is that of the claiming worker when it sends one
+        key = settings_key(settings)
+        max_attempts = int(max_attempts) if max_attempts else self.max_attempts
+        now = time.time()
+        db = self.connect()
+
+        try:
+            #immediate takes the write lock up front so two hosts can not both read an unclaimed row
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT * FROM leases WHERE src = ? AND settings_key = ?", (src, key)).fetchone()
+            attempts = 0
+
+            if (row is not None):
+                same_file = row["size"] == size and row["mtime"] == mtime
+
+                if (row["status"] == LEASE_CLAIMED and row["expires"] > now and row["worker"] != worker):
+                    db.execute("ROLLBACK")
+                    return None, f"claimed by {row["worker"]}"
+
+                if (same_file and row["status"] == LEASE_DONE):
+                    db.execute("ROLLBACK")
+                    return None, f"done by {row["worker"]}"
+
+                if (same_file):
+                    attempts = row["attempts"]
+
+                if (attempts >= max_attempts):
+                    db.execute("ROLLBACK")
+                    return None, f"failed {attempts} times, last error {row["error"]}"
+
+            expires = now + self.lease_seconds
+            db.execute("INSERT OR REPLACE INTO leases (src, settings_key, settings, size, mtime, worker, status, expires, attempts, updated, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                (src, key, json.dumps(settings, sort_keys=True, default=str), size, mtime, worker, LEASE_CLAIMED, expires, attempts, now))
+            db.execute("COMMIT")
+            return Lease(src, settings, worker, expires, size, mtime), "claimed"
+        except Exception:
+            if (db.in_transaction):
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def update(self, lease: Lease, sql: str, params: tuple):
+        db = self.connect()
+        try:
+            cursor = db.execute(sql + " WHERE src = ? AND settings_key = ? AND worker = ? AND status = ?", params + (lease.src, lease.settings_key, lease.worker, LEASE_CLAIMED))
+            return cursor.rowcount == 1
+        finally:
+            db.close()
+
+    def heartbeat(self, lease: Lease):
+        #False when the lease expired and was taken by another worker
+        expires = time.time() + self.lease_seconds
+        if (self.update(lease, "UPDATE leases SET expires = ?, updated = ?", (expires, time.time()))):
+            lease.expires = expires
+            return True
+        return False
+
+    def complete(self, lease: Lease):
+        return self.update(lease, "UPDATE leases SET status = ?, updated = ?", (LEASE_DONE, time.time()))
+
+    def release(self, lease: Lease, error: str = None):
+        #claimable again straight away, by any worker, until max_attempts failures
+        return self.update(lease, "UPDATE leases SET status = ?, attempts = attempts + 1, error = ?, updated = ?", (LEASE_RELEASED, error, time.time()))
+
+    def leases(self):
+        db = self.connect()
+        try:
+            return [dict(row) for row in db.execute("SELECT * FROM leases ORDER BY updated DESC")]
+        finally:
+            db.close()
+
+
+class HttpLeaseQueue:
+    '''
+        Client for the coordinator below, or any service with the same JSON endpoints.
+    '''
+
+    def __init__(self, url: str, timeout: float = 30, max_attempts: int = None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+    def request(self, endpoint: str, data: dict = None):
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(f"{self.url}/{endpoint}", data=body, headers={"Content-Type": "application/json"})
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def claim(self, src: str, settings: dict, worker: str, size: int = 0, mtime: int = 0):
+        #the attempts of the worker are sent so the coordinator refuses the lease when the worker gives up, not before
+        result = self.request("claim", { "src": src, "settings": settings, "worker": worker, "size": size, "mtime": mtime, "max_attempts": self.max_attempts })
+        return (Lease.from_dict(result["lease"]) if result.get("lease") else None), result["reason"]
+
+    def heartbeat(self, lease: Lease):
+        result = self.request("heartbeat", { "lease": lease.to_dict() })
+        if (result["ok"]):
+            lease.expires = result["expires"]
+        return result["ok"]
+
+    def complete(self, lease: Lease):
+        return self.request("complete", { "lease": lease.to_dict() })["ok"]
+
+    def release(self, lease: Lease, error: str = None):
+        return self.request("release", { "lease": lease.to_dict(), "error": error })["ok"]
+
+    def leases(self):
+        return self.request("leases")["leases"]
+
+
+def route_allows(routes: list, worker: str, settings: dict):
+    #routes are {"worker": pattern, "settings": {...}}. Workers matching no pattern take anything,
+    #otherwise the claim settings must contain the settings of one of the matching routes
+    matching = [route for route in routes if fnmatch.fnmatch(worker, route["worker"])]
+
+    if (not matching):
+        return True
+
+    return any(all(settings.get(key) == value for key, value in route.get("settings", {}).items()) for route in matching)
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+
+    queue = None
+    routes = []
+
+    def send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if (self.path.rstrip("/") == "/leases"):
+            self.send_json({ "leases": self.queue.leases() })
+        else:
+            self.send_json({ "error": "not found" }, 404)
+
+    def do_POST(self):
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            endpoint = self.path.strip("/")
+
+            if (endpoint == "claim" and not route_allows(self.routes, data["worker"], data["settings"])):
+                self.send_json({ "lease": None, "reason": f"not routed to {data["worker"]}" })
+            elif (endpoint == "claim"):
+                lease, reason = self.queue.claim(data["src"], data["settings"], data["worker"], data.get("size", 0), data.get("mtime", 0), data.get("max_attempts"))
+                logger.info(f"{data["worker"]} {reason} {data["src"]}")
+                self.send_json({ "lease": lease.to_dict() if lease else None, "reason": reason })
+            elif (endpoint == "heartbeat"):
+                lease = Lease.from_dict(data["lease"])
+                ok = self.queue.heartbeat(lease)
+                self.send_json({ "ok": ok, "expires": lease.expires })
+            elif (endpoint == "complete"):
+                self.send_json({ "ok": self.queue.complete(Lease.from_dict(data["lease"])) })
+            elif (endpoint == "release"):
+                self.send_json({ "ok": self.queue.release(Lease.from_dict(data["lease"]), data.get("error")) })
+            else:
+                self.send_json({ "error": "not found" }, 404)
+        except (KeyError, ValueError) as e:
+            self.send_json({ "error": str(e) }, 400)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def create_coordinator(db_path: str, host: str = "0.0.0.0", port: int = 8765, lease_seconds: float = 120, max_attempts: int = 3, routes: list = None):
+    handler = type("Handler", (CoordinatorHandler,), { "queue": SqliteLeaseQueue(db_path, lease_seconds, max_attempts), "routes": routes or [] })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def create_lease_queue(spec: str, lease_seconds: float = 120, max_attempts: int = 3):
+    #an http(s) coordinator url or a SQLite database path on the shared filesystem.
+    #max_attempts is that of the failure policy, a lease is refused once the worker would not retry it
+    if (spec.startswith("http://") or spec.startswith("https://")):
+        return HttpLeaseQueue(spec, max_attempts=max_attempts)
+
+    return SqliteLeaseQueue(spec, lease_seconds, max_attempts)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--host', default="0.0.0.0")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--lease_seconds', type=float, default=120)
+    parser.add_argument('--max_attempts', type=int, default=3)
+    parser.add_argument('--routes', default=None)
+    args = parser.parse_args()
+
+    routes = []
+    if (args.routes):
+        with open(args.routes, "r", encoding="utf-8") as f:
+            routes = json.load(f)
+
+    server = create_coordinator(args.db, args.host, args.port, args.lease_seconds, args.max_attempts, routes)
+    logger.info(f"Coordinator listening on {args.host}:{args.port}, leases in {args.db}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()